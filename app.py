@@ -1,26 +1,35 @@
 # Standard library imports
 import os
-import sys
 import logging
 import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Third party imports
 import jwt
 import requests
 import traceback
+from flask import g
 from flask import Flask
 from flask import jsonify
 from flask import request
+from flask import url_for
 from flask import redirect
 from flask import make_response
-from dotenv import load_dotenv
 from flask_cors import CORS
 from flask_cors import cross_origin
 
 
 # Local imports
+# Loads the .env file and configures logging; imported first, since the
+# modules below read their settings at import time.
+import settings
+from background import BackgroundTasks
+from metrics import REGISTRY
+from metrics import CONTENT_TYPE
+from metrics import HTTP_LATENCY
+from metrics import HTTP_REQUESTS
 from utils import USER_PLAYLISTS
-from utils import supabase
 from utils import delete_user_and_data
 from utils import follow_playlist
 from utils import unfollow_playlist
@@ -32,11 +41,9 @@ from utils import get_user_top_tracks
 from utils import add_tracks_to_playlist
 from utils import add_top_tracks_to_follower
 from utils import check_playlist_following
-from update_group_playlists import run_update_playlists
+from supabase_client import get_supabase
 
 
-load_dotenv()
-
 app = Flask(__name__)
 
 CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
@@ -44,21 +51,26 @@ CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
 
+# Number of new users onboarded at the same time in the background.
+ONBOARDING_WORKERS = int(os.getenv("ONBOARDING_WORKERS", "4"))
+
+onboarding_tasks = BackgroundTasks(max_workers=ONBOARDING_WORKERS)
+
+# Threads shared by requests to /create-follow to run lookups and both
+# follow directions concurrently.
+FOLLOW_WORKERS = int(os.getenv("FOLLOW_WORKERS", "8"))
+
+follow_executor = ThreadPoolExecutor(max_workers=FOLLOW_WORKERS, thread_name_prefix="follow")
+
+# If set, /metrics requires "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
 # Configure CORS
 CORS(app)
 
-# Configure basic logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)],
-)
-
+# Logging is configured by settings.
 logger = logging.getLogger("spotifriends")
 
-#Disable logging from the Supabase library
-logging.getLogger("supabase").setLevel(logging.WARNING)
-
 def verify_supabase_webhook(request):
     token = request.headers.get("Authorization")
     if not token:
@@ -73,7 +85,7 @@ def verify_supabase_webhook(request):
 def follow_user(follower_user_id, target_user_id):
     """Create a new follower relationship."""
     try:
-        response = supabase.table("spotify_follows").upsert({
+        response = get_supabase().table("spotify_follows").upsert({
             "follower_id": follower_user_id,
             "following_id": target_user_id
         }).execute()
@@ -86,6 +98,31 @@ def follow_user(follower_user_id, target_user_id):
         raise e
 
 
+def follow_direction(follower_id, follower_token, target_id, target_toptracks):
+    """
+    Make `follower_id` follow the My Top Tracks playlist of `target_id`, add
+    the target's top tracks to the follower's Friend Favorites and record
+    the relationship.
+
+    Returns:
+        str: "followed", or "already_following" if nothing had to be done
+    """
+    # Initiate follower relationship by following the playlist.
+    #     public=False => the playlist will not be visible on their profile
+    if check_playlist_following(follower_token, target_toptracks):
+        return "already_following"
+
+    print(f"New follower relationship: {follower_id} follows {target_id}")
+    follow_playlist(
+        follower_token, target_toptracks, public=False
+    )
+    add_top_tracks_to_follower(target_id, follower_id)
+
+    # Create follower relationship in supabase
+    follow_user(follower_id, target_id)
+    return "followed"
+
+
 @app.route("/create-follow", methods=["POST"])
 def handle_new_follower_relationship():
 
@@ -102,13 +139,17 @@ def handle_new_follower_relationship():
         if user1 == user2:
             return jsonify({"status": "null", "message": "User cannot follow themselves"}), 200
 
-        # Retrieve their access tokens.
-        access_token1 = get_user_access_token(user1)
-        access_token2 = get_user_access_token(user2)
+        # Retrieve their access tokens and respective top tracks playlists,
+        # all at the same time.
+        access_token1 = follow_executor.submit(get_user_access_token, user1)
+        access_token2 = follow_executor.submit(get_user_access_token, user2)
+        user1_playlists = follow_executor.submit(get_custom_playlists, user1)
+        user2_playlists = follow_executor.submit(get_custom_playlists, user2)
 
-        # Retrieve their respective top tracks playlists.
-        user1_playlists = get_custom_playlists(user1)
-        user2_playlists = get_custom_playlists(user2)
+        access_token1 = access_token1.result()
+        access_token2 = access_token2.result()
+        user1_playlists = user1_playlists.result()
+        user2_playlists = user2_playlists.result()
 
         if user1_playlists is None or user2_playlists is None:
             raise Exception("At least one of the users are not in our database: "
@@ -118,33 +159,36 @@ def handle_new_follower_relationship():
         user1_toptracks = user1_playlists["individual_playlist"]
         user2_toptracks = user2_playlists["individual_playlist"]
 
-        # Initiate follower relationship by following the playlists.
-        #     public=False => the playlist will not be visible on their profile
-        if not check_playlist_following(access_token1, user2_toptracks):
-            print(f"New follower relationship: {user1} follows {user1}")
-            follow_playlist(
-                access_token1, user2_toptracks, public=False
-            )
-            add_top_tracks_to_follower(user2, user1)
-
-            # Create follower relationship in supabase
-            follow_user(user1, user2)
-
-        if not check_playlist_following(access_token2, user1_toptracks):
-            print(f"New follower relationship: {user2} follows {user1}")
-            follow_playlist(
-                access_token2, user1_toptracks, public=False
-            )
-            add_top_tracks_to_follower(user1, user2)
-            
-            # Create follower relationship in supabase
-            follow_user(user2, user1)
-
+        # The two directions don't depend on each other, so run them concurrently.
+        directions = {
+            "user1_follows_user2": follow_executor.submit(
+                follow_direction, user1, access_token1, user2, user2_toptracks
+            ),
+            "user2_follows_user1": follow_executor.submit(
+                follow_direction, user2, access_token2, user1, user1_toptracks
+            ),
+        }
+
+        results = {}
+        for direction, future in directions.items():
+            try:
+                results[direction] = {"status": future.result()}
+            except Exception as e:
+                print(f"An error occurred ({direction}): " + str(e))
+                results[direction] = {"status": "error", "message": str(e)}
+
+        errors = [
+            f"{direction}: {result['message']}"
+            for direction, result in results.items() if result["status"] == "error"
+        ]
+        if errors:
+            return jsonify({"status": "error", "message": "; ".join(errors), **results}), 500
 
         return (
             jsonify(
                 {
                     "status": "success",
+                    **results,
                 }
             ),
             200,
@@ -155,86 +199,156 @@ def handle_new_follower_relationship():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-@app.route("/webhook/user-created", methods=["POST"])
-def handle_user_created():
-
-    # TODO: Checking the request's Authorization?
-    # verify_supabase_webhook(request)
+def onboard_user(user_id):
+    """
+    Create (or re-follow) the My Top Tracks and Friend Favorites playlists of
+    a new user and seed My Top Tracks with their top tracks.
 
-    # Access the user_id
-    user_id = request.json["user_id"]
+    Safe to run again after a partial failure: only the playlists the user
+    doesn't have yet are created.
 
-    print(f"User created with ID: {user_id}")
+    Returns:
+        dict: The user's playlist ids, or a message if they already existed
+    """
+    user_email = (
+        get_supabase().table("spotify_tokens")
+        .select("email")
+        .eq("user_id", user_id)
+        .execute()
+        .data[0]["email"]
+    )
 
-    try:
+    user_playlists = get_custom_playlists(user_id) or {}
+    access_token = get_user_access_token(user_id)
 
-        user_email = (
-            supabase.table("spotify_tokens")
-            .select("email")
-            .eq("user_id", user_id)
-            .execute()
-            .data[0]["email"]
+    # Case 1: User playlists have been made and we'll double check they're followed.
+    if has_both_playlists(user_playlists):
+        print("We already have playlists made for this user.")
+        follow_playlist(
+            access_token, user_playlists["individual_playlist"], public=True
+        )
+        follow_playlist(
+            access_token, user_playlists["group_playlist"], public=False
         )
+        return {
+            "message": "Playlists already exist for this user.",
+            "individual_playlist_id": user_playlists["individual_playlist"],
+            "group_playlist_id": user_playlists["group_playlist"],
+        }
+
+    # Case 2: User playlists have not been made yet (or an earlier attempt
+    # stopped between the two).
+    print("Creating new playlists for this user")
+    for playlist_type in ("individual", "group"):
+        if not user_playlists.get(f"{playlist_type}_playlist"):
+            create_and_save_playlist(
+                user_id, user_email, access_token, playlist_type=playlist_type
+            )
 
-        user_playlists = get_custom_playlists(user_id)
-        access_token = get_user_access_token(user_id)
+    # Ensure playlists are created with zero songs added initially.
+    user_playlists = get_custom_playlists(user_id)
+    group_playlist = user_playlists["group_playlist"]
+    individual_playlist = user_playlists["individual_playlist"]
+    clear_playlist(access_token, group_playlist)
+    clear_playlist(access_token, individual_playlist)
 
-        # Case 1: User playlists have been made and we'll double check they're followed.
-        if user_playlists is not None:
-            print("We already have playlists made for this user.")
-            follow_playlist(
-                access_token, user_playlists["individual_playlist"], public=True
-            )
-            follow_playlist(
-                access_token, user_playlists["group_playlist"], public=False
-            )
-            return (
-                jsonify(
-                    {
-                        "status": "success",
-                        "message": "Playlists already exist for this user."
-                    }
-                ),
-                200,
-            )
+    # Get user's tops tracks.
+    top_tracks = get_user_top_tracks(access_token)
 
-        # Case 2: User playlists have not been made yet.
-        print("Creating new playlists for this user")
-        create_and_save_playlist(
-            user_id, user_email, access_token, playlist_type="individual"
-        )
-        create_and_save_playlist(
-            user_id, user_email, access_token, playlist_type="group"
-        )
-    
-        # Ensure playlists are created with zero songs added initially.
-        user_playlists = get_custom_playlists(user_id)
-        group_playlist = user_playlists["group_playlist"]
-        individual_playlist = user_playlists["individual_playlist"]
-        clear_playlist(access_token, group_playlist)
-        clear_playlist(access_token, individual_playlist)
+    # Retry for longer time range if no tracks were found.
+    if len(top_tracks) == 0:
+        top_tracks = get_user_top_tracks(access_token, time_range="long_term")
+
+    # If top tracks we're finally found, add them to the individual playlist.
+    if len(top_tracks) != 0:
+        top_uris = [track["uri"] for track in top_tracks]
+        add_tracks_to_playlist(access_token, individual_playlist, top_uris)
+
+    return {
+        "individual_playlist_id": individual_playlist,
+        "group_playlist_id": group_playlist,
+    }
+
+
+def has_both_playlists(user_playlists):
+    return bool(
+        user_playlists
+        and user_playlists.get("individual_playlist")
+        and user_playlists.get("group_playlist")
+    )
+
+
+def run_onboarding_job(job, worker_id):
+    """
+    Onboard the user of a claimed onboarding job and record the outcome on
+    the job (a failure is retried with backoff, see job_queue).
+    """
+    # Local imports
+    from job_queue import complete_job, fail_job
+
+    try:
+        result = onboard_user(job["user_id"])
+    except Exception as e:
+        fail_job(job, worker_id, e)
+        raise
+    complete_job(job, worker_id)
+    return result
 
-        # Get user's tops tracks.
-        top_tracks = get_user_top_tracks(access_token)
 
-        # Retry for longer time range if no tracks were found.
-        if len(top_tracks) == 0:
-            top_tracks = get_user_top_tracks(access_token, time_range="long_term")
+@app.route("/webhook/user-created", methods=["POST"])
+def handle_user_created():
+    """
+    Queue the onboarding of a new user and respond right away with 202, so
+    the Supabase webhook doesn't time out and retry.
+
+    The onboarding is a job in the `onboarding` run of the job queue: the
+    first request for a user creates and leases it, so retries (on any
+    instance) don't start a second onboarding while it is in progress or
+    once it is done. An onboarding that failed for good is started over.
+    It then runs in the background of this instance. If the instance is
+    stopped before it finishes, the lease expires and the `/cron/onboarding`
+    sweep finishes it. Poll `GET /webhook/user-created/<user_id>` for the
+    playlist ids.
+    """
+    # Imported on first use, like the cron (see bench_import).
+    # Local imports
+    from job_queue import ONBOARDING_RUN_ID, claim_job, enqueue_run, get_job, new_worker_id, reset_job
 
-        # If top tracks we're finally found, add them to the individual playlist.
-        if len(top_tracks) != 0:
-            top_uris = [track["uri"] for track in top_tracks]
-            add_tracks_to_playlist(access_token, individual_playlist, top_uris)
+    # TODO: Checking the request's Authorization?
+    # verify_supabase_webhook(request)
+
+    try:
+        # Access the user_id
+        user_id = request.json["user_id"]
+
+        print(f"User created with ID: {user_id}")
+
+        enqueue_run(ONBOARDING_RUN_ID, [user_id])
+        job = get_job(ONBOARDING_RUN_ID, user_id)
+        if job["status"] == "failed":
+            print(f"Restarting the failed onboarding of user: {user_id}")
+            reset_job(job)
+
+        worker_id = new_worker_id()
+        claimed = claim_job(ONBOARDING_RUN_ID, user_id, worker_id)
+        if claimed is not None:
+            task, _ = onboarding_tasks.submit(user_id, run_onboarding_job, claimed, worker_id)
+            status = task["status"]
+        else:
+            # Held by another worker, waiting for a retry, or done.
+            job = get_job(ONBOARDING_RUN_ID, user_id)
+            print(f"Onboarding is already {job['status']} for user: {user_id}")
+            status = ONBOARDING_STATUSES[job["status"]]
 
         return (
             jsonify(
                 {
-                    "status": "success",
-                    "individual_playlist_id": individual_playlist, 
-                    "group_playlist_id": group_playlist, 
+                    "status": status,
+                    "user_id": user_id,
+                    "status_url": url_for("onboarding_status", user_id=user_id),
                 }
             ),
-            200,
+            202,
         )
 
     except Exception as e:
@@ -242,6 +356,59 @@ def handle_user_created():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+# Statuses of onboarding jobs as reported to clients.
+ONBOARDING_STATUSES = {"pending": "queued", "running": "running", "succeeded": "success", "failed": "error"}
+
+
+@app.route("/webhook/user-created/<user_id>", methods=["GET"])
+def onboarding_status(user_id):
+    """
+    Report the progress of a user's onboarding and, once both playlists
+    exist, their playlist ids. Only reads: an onboarding whose worker
+    stopped is finished by the `/cron/onboarding` sweep.
+    """
+    # Local imports
+    from job_queue import ONBOARDING_RUN_ID, get_job
+
+    user_playlists = get_custom_playlists(user_id)
+    if has_both_playlists(user_playlists):
+        return jsonify({
+            "status": "success",
+            "user_id": user_id,
+            "individual_playlist_id": user_playlists["individual_playlist"],
+            "group_playlist_id": user_playlists["group_playlist"],
+        }), 200
+
+    job = get_job(ONBOARDING_RUN_ID, user_id)
+    if job is None:
+        return jsonify({"status": "unknown", "user_id": user_id}), 404
+
+    body = {"status": ONBOARDING_STATUSES[job["status"]], "user_id": user_id}
+    if job["status"] == "failed":
+        body["message"] = job["last_error"]
+    elif job["status"] == "succeeded":
+        # Done, but the playlists are gone or incomplete (e.g. deleted since).
+        body["status"] = "error"
+        body["message"] = "The user's playlists are missing"
+    return jsonify(body), 200
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Record the latency and status of every request, labeled by route."""
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUESTS.inc(route, request.method, str(response.status_code))
+        HTTP_LATENCY.observe(time.perf_counter() - started, route, request.method)
+    return response
+
+
 @app.after_request
 def after_request(response):
     """Add CORS headers to every response"""
@@ -294,15 +461,63 @@ def delete_user_endpoint():
         return jsonify(result), 500
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Request counts, status codes and latency histograms of this instance (its
+    own routes, Spotify and Supabase) in the Prometheus text format.
+    """
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return REGISTRY.render(), 200, {"Content-Type": CONTENT_TYPE}
+
+
 @app.route('/cron/update-playlist', methods=['GET'])
 def cron_job():
     """
     An endpoint to run a weekly cron job that updates the user's
     My Top Tracks and Friend Favorites playlists.
+
+    The run can be split across invocations with `?shard=i&of=n`, each
+    updating a disjoint subset of the users. With `?queue=1` the invocation
+    instead works through the durable job queue of this week's run, so runs
+    cut short can be resumed by the next invocation.
+
+    Each invocation stops starting new users CRON_BUDGET_MARGIN_SECONDS before
+    CRON_TIME_BUDGET_SECONDS (by default the function's maxDuration) and the
+    next invocation of the week resumes where it left off.
     """
+    # The cron's modules are only imported by the invocations that run it,
+    # keeping them out of the app's cold start.
+    # Local imports
+    from update_group_playlists import CRON_TIME_BUDGET
+    from update_group_playlists import run_queue_worker
+    from update_group_playlists import run_update_playlists_concurrently
+
+    if request.args.get("queue") == "1":
+        try:
+            summary = run_queue_worker(time_budget=CRON_TIME_BUDGET)
+            return jsonify({"status": "success", **summary}), 200
+
+        except Exception as e:
+
+            logger.info(f"An error occurred updating playlists: {str(e)}")
+            logger.info(traceback.format_exc())
+            return jsonify({"status": "failed"}), 500
+
+    try:
+        shard = int(request.args.get("shard", 0))
+        num_shards = int(request.args.get("of", 1))
+        if not 0 <= shard < num_shards:
+            raise ValueError
+    except ValueError:
+        return jsonify({"status": "failed", "message": "Expected 0 <= shard < of"}), 400
+
     try:
-        run_update_playlists()
-        return jsonify({"status": "success"}), 200
+        summary = run_update_playlists_concurrently(
+            shard=shard, num_shards=num_shards, time_budget=CRON_TIME_BUDGET
+        )
+        return jsonify({"status": "success", **summary}), 200
 
     except Exception as e:
 
@@ -311,6 +526,57 @@ def cron_job():
         return jsonify({"status": "failed"}), 500
 
 
+@app.route('/cron/onboarding', methods=['GET'])
+def onboarding_cron_job():
+    """
+    An endpoint to periodically finish onboardings that no request did,
+    e.g. because the instance that received the webhook was stopped.
+
+    Stops claiming jobs CRON_BUDGET_MARGIN_SECONDS before the cron's time
+    budget; the rest are left to the next sweep.
+    """
+    # Local imports
+    from job_queue import ONBOARDING_RUN_ID, claim_jobs, new_worker_id
+    from update_group_playlists import CRON_TIME_BUDGET, CRON_BUDGET_MARGIN
+
+    deadline = time.monotonic() + max(CRON_TIME_BUDGET - CRON_BUDGET_MARGIN, 0) if CRON_TIME_BUDGET else None
+    worker_id = new_worker_id()
+    succeeded = failed = 0
+    while deadline is None or time.monotonic() < deadline:
+        jobs = claim_jobs(ONBOARDING_RUN_ID, worker_id, limit=ONBOARDING_WORKERS)
+        if not jobs:
+            break
+        for job in jobs:
+            try:
+                run_onboarding_job(job, worker_id)
+                succeeded += 1
+            except Exception as e:
+                logger.info(f"An error occurred onboarding user {job['user_id']}: {str(e)}")
+                failed += 1
+
+    return jsonify({"status": "success", "succeeded": succeeded, "failed": failed}), 200
+
+
+@app.route('/cron/reconcile-follows', methods=['GET'])
+def reconcile_follows_cron_job():
+    """
+    An endpoint to periodically repair the follow graph in `spotify_follows`
+    against the playlists users actually follow on Spotify.
+    """
+    # Local imports
+    from update_group_playlists import reconcile_follow_graph
+
+    try:
+        summary = reconcile_follow_graph()
+        return jsonify({"status": "success", **summary}), 200
+
+    except Exception as e:
+
+        logger.info(f"An error occurred reconciling follows: {str(e)}")
+        logger.info(traceback.format_exc())
+        return jsonify({"status": "failed"}), 500
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
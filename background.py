@@ -0,0 +1,98 @@
+"""
+Bounded worker pool for work that shouldn't hold up an HTTP response.
+
+Tasks are keyed (e.g. by user_id) so that a retried request for work that is
+already queued or running doesn't start it a second time, and so clients can
+poll for the outcome.
+"""
+
+# Standard library imports
+import time
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger("spotifriends")
+
+
+class BackgroundTasks:
+    """
+    Run keyed tasks on a bounded thread pool and remember their outcome.
+
+    Args:
+        max_workers (int): Number of tasks run at the same time
+        max_history (int): Number of finished tasks whose status is kept
+    """
+
+    def __init__(self, max_workers=4, max_history=1000):
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="background"
+        )
+        self._tasks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Queue `fn(*args, **kwargs)` unless a task with the same key is
+        already queued or running.
+
+        Returns:
+            tuple: (status record of the task, whether a new task was queued)
+        """
+        with self._lock:
+            existing = self._tasks.get(key)
+            if existing is not None and existing["status"] in ("queued", "running"):
+                return dict(existing), False
+
+            task = {
+                "status": "queued",
+                "result": None,
+                "error": None,
+                "submitted_at": time.time(),
+                "finished_at": None,
+            }
+            self._tasks[key] = task
+            self._tasks.move_to_end(key)
+            self._prune()
+
+        self._executor.submit(self._run, task, fn, args, kwargs)
+        return dict(task), True
+
+    def _run(self, task, fn, args, kwargs):
+        with self._lock:
+            task["status"] = "running"
+        try:
+            result = fn(*args, **kwargs)
+            with self._lock:
+                task["status"] = "success"
+                task["result"] = result
+                task["finished_at"] = time.time()
+        except Exception as e:
+            logger.info(f"Background task failed: {str(e)}")
+            logger.info(traceback.format_exc())
+            with self._lock:
+                task["status"] = "error"
+                task["error"] = str(e)
+                task["finished_at"] = time.time()
+
+    def _prune(self):
+        # Forget the oldest finished tasks beyond `max_history`.
+        finished = [
+            key for key, task in self._tasks.items()
+            if task["status"] in ("success", "error")
+        ]
+        for key in finished[:max(len(self._tasks) - self.max_history, 0)]:
+            del self._tasks[key]
+
+    def get(self, key):
+        """Status record of the task for `key`, or None if it isn't known."""
+        with self._lock:
+            task = self._tasks.get(key)
+            return dict(task) if task is not None else None
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,5 @@
+"""
+Offline benchmarks: local stand-ins for the Spotify Web API and Supabase, a
+synthetic population generator, and harnesses that measure the cron and the
+Flask endpoints against them without touching production services.
+"""
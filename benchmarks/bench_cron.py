@@ -0,0 +1,161 @@
+"""
+Benchmark a full weekly cron run against local Spotify and Supabase stand-ins.
+
+Reports wall time, requests per endpoint (including injected 429s) and peak
+memory of the run. With --dry-run only the run's plan is built, so its
+predicted request count can be checked against the requests the stand-ins
+saw (reads only).
+
+Example:
+    python -m benchmarks.bench_cron --users 500 --mean-degree 8 --latency 0.02 --throttle-rate 0.01
+"""
+
+# Standard library imports
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import tracemalloc
+
+# Local imports
+from benchmarks.harness import FakeServices
+from benchmarks.harness import format_request_counts
+from benchmarks.population import describe
+from benchmarks.population import generate_population
+from benchmarks.population import DEGREE_DISTRIBUTIONS
+from tracing import format_summary
+
+
+def add_population_arguments(parser):
+    parser.add_argument("--users", type=int, default=100, help="Number of users")
+    parser.add_argument("--mean-degree", type=int, default=5, help="Average number of users each user follows")
+    parser.add_argument("--degree-distribution", choices=DEGREE_DISTRIBUTIONS, default="powerlaw")
+    parser.add_argument("--popularity-skew", type=float, default=1.0, help="Zipf exponent of who gets followed")
+    parser.add_argument("--playlist-size", type=int, default=50, help="Average My Top Tracks playlist size")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def add_fault_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every Spotify request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds around --latency")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of Spotify requests answered 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds of injected 429s")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="Seconds added to every Supabase request")
+    parser.add_argument("--rate-limit", type=float, default=None,
+                        help="Override SPOTIFY_RATE_LIMIT (requests / second) of the client under test")
+
+
+def fake_services(args):
+    """Generate the population described by `args` and wrap it in stand-ins."""
+    population = generate_population(
+        users=args.users,
+        mean_degree=args.mean_degree,
+        degree_distribution=args.degree_distribution,
+        popularity_skew=args.popularity_skew,
+        playlist_size=args.playlist_size,
+        seed=args.seed,
+    )
+    services = FakeServices(
+        population,
+        spotify_faults={
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "throttle_rate": args.throttle_rate,
+            "retry_after": args.retry_after,
+            "seed": args.seed,
+        },
+        supabase_faults={"latency": args.db_latency, "seed": args.seed},
+    )
+    return population, services
+
+
+def run_benchmark(args):
+    population, services = fake_services(args)
+    with services:
+        services.configure()
+        if args.rate_limit:
+            os.environ["SPOTIFY_RATE_LIMIT"] = str(args.rate_limit)
+            os.environ["SPOTIFY_RATE_BURST"] = str(int(args.rate_limit * 2))
+
+        # Imported only now: the app reads its settings at import time.
+        # Local imports
+        import update_group_playlists
+        from rate_limiter import SPOTIFY_RATE_LIMIT
+
+        if args.quiet:
+            logging.getLogger("spotifriends").setLevel(logging.WARNING)
+        if args.tracemalloc:
+            tracemalloc.start()
+        started = time.perf_counter()
+
+        if args.dry_run:
+            summary = update_group_playlists.plan_update_playlists(args.concurrency)
+        elif args.queue:
+            summary = update_group_playlists.run_queue_worker(concurrency=args.concurrency)
+        else:
+            summary = update_group_playlists.run_update_playlists_concurrently(args.concurrency)
+
+        wall_time = time.perf_counter() - started
+        peak_traced = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        tracemalloc.stop()
+
+        return {
+            "population": describe(population),
+            "concurrency": args.concurrency,
+            "rate_limit": SPOTIFY_RATE_LIMIT,
+            "mode": "dry-run" if args.dry_run else "queue" if args.queue else "engine",
+            "wall_time": round(wall_time, 3),
+            "summary": summary,
+            "requests": services.stats(),
+            "peak_traced_memory_mb": round(peak_traced / 2 ** 20, 1) if peak_traced is not None else None,
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+def format_report(report):
+    lines = [
+        f"Population: {report['population']}",
+        f"Mode: {report['mode']}, concurrency {report['concurrency']}, "
+        f"Spotify rate limit {report['rate_limit']:g} req/s",
+        f"Wall time: {report['wall_time']:.2f}s",
+    ]
+    summary = dict(report["summary"])
+    run_report = summary.pop("report", None)
+    if report["mode"] == "dry-run":
+        # Already imported by `run_benchmark`.
+        # Local imports
+        from update_group_playlists import format_plan
+        lines.append(format_plan(summary))
+    else:
+        lines.append(f"Result: {summary}")
+    if run_report is not None:
+        lines.append(format_summary(run_report))
+    if report["peak_traced_memory_mb"] is not None:
+        lines.append(f"Peak traced memory: {report['peak_traced_memory_mb']} MB")
+    lines.append(f"Max RSS: {report['max_rss_mb']} MB")
+    lines.append(format_request_counts(report["requests"]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_population_arguments(parser)
+    add_fault_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=8, help="Users updated at the same time")
+    parser.add_argument("--queue", action="store_true", help="Run the job queue worker instead of the engine")
+    parser.add_argument("--dry-run", action="store_true", help="Only plan the run and report its predicted requests")
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false",
+                        help="Skip tracing allocations (faster, only max RSS is reported)")
+    parser.add_argument("--quiet", action="store_true", help="Only print the report")
+    parser.add_argument("--json", default=None, help="Also write the report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(0 if report["summary"].get("failed", 0) == 0 else 1)
@@ -0,0 +1,181 @@
+"""
+Benchmark the app's cold start: importing `app` and serving a first request
+in a fresh interpreter, as a serverless instance does before it can respond.
+
+Each run is a new process, so nothing is cached between runs except the
+bytecode on disk. Reports the median and max import time and time to the
+first response (`/metrics`, which needs neither Spotify nor Supabase), the
+slowest imports (from `python -X importtime`) and whether modules only some
+requests need (supabase-py, the cron) were imported at start-up.
+
+Save a baseline once, then compare later runs against it; the run exits
+with 1 when the cold start got slower than the baseline allows or a
+deferred module is imported at start-up again. Timings depend on the
+machine, so record the baseline on the machine that runs the comparison:
+    python -m benchmarks.bench_import --save-baseline benchmarks/baselines/bench_import.json
+    python -m benchmarks.bench_import --baseline benchmarks/baselines/bench_import.json
+"""
+
+# Standard library imports
+import os
+import sys
+import json
+import argparse
+import platform
+import statistics
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules a cold start should not import: they are only needed by some
+# requests and are imported on first use.
+DEFERRED_MODULES = ("supabase", "update_group_playlists", "job_queue")
+
+# Settings the app reads at import time. Placeholders are used for the ones
+# not set, so the benchmark never depends on (or reaches) real services.
+PLACEHOLDER_ENV = {
+    "SUPABASE_URL": "http://127.0.0.1:9",
+    "SUPABASE_SERVICE_KEY": "bench",
+    "SPOTIFY_CLIENT_ID": "bench",
+    "SPOTIFY_CLIENT_SECRET": "bench",
+}
+
+# Runs in the fresh interpreter and prints its timings as JSON.
+CHILD = f"""
+import sys, time, json
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.app.test_client().get("/metrics")
+responded = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (responded - started) * 1000,
+    "loaded": [name for name in {DEFERRED_MODULES!r} if name in sys.modules],
+}}))
+"""
+
+
+def child_env():
+    env = {**PLACEHOLDER_ENV, **os.environ}
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    return env
+
+
+def run_once(env):
+    """Timings of one cold start."""
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=ROOT, env=env, check=True, capture_output=True, text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(env, top=10):
+    """
+    The `top` direct imports of `app` that took longest, including what they
+    imported in turn (`python -X importtime`).
+
+    Returns:
+        list: [module, cumulative milliseconds] pairs, slowest first
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=ROOT, env=env, check=True, capture_output=True, text=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Direct imports of app are indented by two spaces (after the one
+        # that follows the separator).
+        if not cumulative.strip().isdigit() or len(name) - len(name.lstrip()) != 3:
+            continue
+        imports.append([name.strip(), round(int(cumulative) / 1000, 1)])
+    return sorted(imports, key=lambda item: -item[1])[:top]
+
+
+def run_benchmark(runs):
+    env = child_env()
+    # Compile the bytecode first, as a deployed instance would have it.
+    run_once(env)
+    samples = [run_once(env) for _ in range(runs)]
+
+    def stats(key):
+        values = [sample[key] for sample in samples]
+        return {"median": round(statistics.median(values), 1), "max": round(max(values), 1)}
+
+    return {
+        "config": {"python": platform.python_version()},
+        "runs": runs,
+        "import_ms": stats("import_ms"),
+        "first_request_ms": stats("first_request_ms"),
+        "deferred_loaded": sorted({name for sample in samples for name in sample["loaded"]}),
+        "slowest_imports": slowest_imports(env),
+    }
+
+
+def compare_with_baseline(report, baseline, tolerance, slack_ms):
+    """
+    Regressions of `report` against `baseline`: a median cold start slower
+    than the baseline's by more than `tolerance` (relative) plus `slack_ms`,
+    or a deferred module imported at start-up again.
+
+    Returns:
+        list: Human-readable regressions (empty if there are none)
+    """
+    if report["config"] != baseline["config"]:
+        raise ValueError(f"The baseline was recorded with different settings: {baseline['config']}")
+
+    regressions = []
+    for key in ("import_ms", "first_request_ms"):
+        expected, actual = baseline[key]["median"], report[key]["median"]
+        limit = expected * (1 + tolerance) + slack_ms
+        if actual > limit:
+            regressions.append(f"{key}: median {actual:.1f} > {limit:.1f} (baseline {expected:.1f})")
+    for name in sorted(set(report["deferred_loaded"]) - set(baseline["deferred_loaded"])):
+        regressions.append(f"{name} is imported at start-up again")
+    return regressions
+
+
+def format_report(report):
+    lines = [
+        f"Cold start over {report['runs']} runs (Python {report['config']['python']}):",
+        f"  import app:     median {report['import_ms']['median']:.1f} ms, max {report['import_ms']['max']:.1f} ms",
+        f"  first response: median {report['first_request_ms']['median']:.1f} ms, "
+        f"max {report['first_request_ms']['max']:.1f} ms",
+        f"Deferred modules imported at start-up: {', '.join(report['deferred_loaded']) or 'none'}",
+        "Slowest imports:",
+    ]
+    for name, milliseconds in report["slowest_imports"]:
+        lines.append(f"  {milliseconds:>8.1f} ms  {name}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Number of cold starts measured")
+    parser.add_argument("--baseline", default=None, help="Fail if this run regressed against this report")
+    parser.add_argument("--save-baseline", default=None, help="Write this run's report as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="Allowed relative slowdown against the baseline")
+    parser.add_argument("--slack-ms", type=float, default=50,
+                        help="Slowdown (ms) always allowed against the baseline")
+    parser.add_argument("--json", default=None, help="Also write the report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.runs)
+    print(format_report(report))
+    for path in filter(None, (args.json, args.save_baseline)):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(report, json.load(f), args.tolerance, args.slack_ms)
+        if regressions:
+            print("Regressions against the baseline:")
+            print("\n".join(f"  {regression}" for regression in regressions))
+            sys.exit(1)
@@ -0,0 +1,101 @@
+"""
+Plumbing shared by the local Spotify and Supabase stand-ins: a Flask app that
+counts requests per endpoint, injects latency and 429 responses, and exposes
+its counters on `/_bench/stats`.
+"""
+
+# Standard library imports
+import time
+import random
+import threading
+from collections import Counter
+
+# Third party imports
+from flask import Flask
+from flask import jsonify
+from flask import request
+from werkzeug.serving import make_server
+from werkzeug.serving import WSGIRequestHandler
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    # HTTP/1.1 so clients can reuse connections, like they do with the real services.
+    protocol_version = "HTTP/1.1"
+
+
+class FakeService:
+    """
+    Base class of the stand-ins.
+
+    Args:
+        name (str): Name of the Flask app
+        latency (float): Seconds added to every request
+        jitter (float): Maximum random deviation from `latency`, in seconds
+        throttle_rate (float): Fraction of requests answered with a 429
+        retry_after (int): `Retry-After` seconds sent with injected 429s
+        seed (int): Seed of the fault injection
+    """
+
+    def __init__(self, name, latency=0.0, jitter=0.0, throttle_rate=0.0, retry_after=1, seed=0):
+        self.app = Flask(name)
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+        # Guards the fake's state as well as the counters.
+        self.lock = threading.RLock()
+        self._rng = random.Random(seed)
+        self.requests = Counter()
+        self.throttled = Counter()
+
+        self.app.before_request(self._before_request)
+        self.app.add_url_rule("/_bench/stats", "bench_stats", self._stats)
+        self.app.add_url_rule("/_bench/reset", "bench_reset", self._reset, methods=["POST"])
+
+    def _before_request(self):
+        if request.path.startswith("/_bench/"):
+            return None
+
+        rule = request.url_rule.rule if request.url_rule else request.path
+        endpoint = f"{request.method} {rule}"
+        with self.lock:
+            self.requests[endpoint] += 1
+            throttle = self._rng.random() < self.throttle_rate
+            delay = max(self.latency + self._rng.uniform(-self.jitter, self.jitter), 0)
+            if throttle:
+                self.throttled[endpoint] += 1
+
+        if delay:
+            time.sleep(delay)
+        if throttle:
+            response = jsonify({"error": {"status": 429, "message": "API rate limit exceeded"}})
+            response.status_code = 429
+            response.headers["Retry-After"] = str(self.retry_after)
+            return response
+        return None
+
+    def _stats(self):
+        with self.lock:
+            return jsonify({
+                "requests": dict(self.requests),
+                "throttled": dict(self.throttled),
+            })
+
+    def _reset(self):
+        with self.lock:
+            self.requests.clear()
+            self.throttled.clear()
+        return "", 204
+
+    def make_server(self, host="127.0.0.1", port=0):
+        """A threaded WSGI server for the app; port 0 picks a free port."""
+        return make_server(
+            host, port, self.app, threaded=True, request_handler=KeepAliveRequestHandler
+        )
+
+
+def serve_in_thread(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
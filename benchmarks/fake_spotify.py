@@ -0,0 +1,264 @@
+"""
+Local stand-in for the parts of the Spotify Web API (and the accounts token
+endpoint) that this project uses.
+
+Playlists keep their items, versions (snapshot ids) and followers in memory,
+so a cron run against the fake performs the same reads and writes it would
+against Spotify. GET responses carry ETags and honor `If-None-Match`.
+"""
+
+# Standard library imports
+import itertools
+from datetime import datetime
+from datetime import timezone
+
+# Third party imports
+from flask import abort
+from flask import jsonify
+from flask import request
+
+# Local imports
+from benchmarks.fake_service import FakeService
+
+
+PAGE_LIMIT = 100
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class FakeSpotify(FakeService):
+    """
+    Args:
+        state (dict): The "spotify" part of a population (see population.py)
+        **faults: Latency / 429 injection settings, see `FakeService`
+    """
+
+    def __init__(self, state, **faults):
+        super().__init__("fake_spotify", **faults)
+        self.catalog = state["catalog"]
+        self.users = state["users"]
+        self.playlists = state["playlists"]
+        for playlist in self.playlists.values():
+            playlist.setdefault("version", 0)
+            playlist["followers"] = set(playlist.get("followers", ()))
+
+        self.tokens = {user["access_token"]: user_id for user_id, user in self.users.items()}
+        self.refresh_tokens = {user["refresh_token"]: user_id for user_id, user in self.users.items()}
+        self._ids = itertools.count()
+
+        self.app.after_request(self._conditional)
+        route = self.app.add_url_rule
+        route("/api/token", "token", self.token, methods=["POST"])
+        route("/v1/me", "me", self.me)
+        route("/v1/me/top/tracks", "top_tracks", self.top_tracks)
+        route("/v1/me/playlists", "my_playlists", self.my_playlists)
+        route("/v1/users/<user_id>/playlists", "user_playlists", self.user_playlists)
+        route("/v1/users/<user_id>/playlists", "create_playlist", self.create_playlist, methods=["POST"])
+        route("/v1/playlists/<playlist_id>", "playlist", self.playlist)
+        route("/v1/playlists/<playlist_id>/tracks", "playlist_tracks", self.playlist_tracks)
+        route("/v1/playlists/<playlist_id>/tracks", "add_tracks", self.add_tracks, methods=["POST"])
+        route("/v1/playlists/<playlist_id>/tracks", "remove_tracks", self.remove_tracks, methods=["DELETE"])
+        route("/v1/playlists/<playlist_id>/tracks", "reorder_tracks", self.reorder_tracks, methods=["PUT"])
+        route("/v1/playlists/<playlist_id>/followers", "follow", self.follow, methods=["PUT"])
+        route("/v1/playlists/<playlist_id>/followers", "unfollow", self.unfollow, methods=["DELETE"])
+        route("/v1/playlists/<playlist_id>/followers/contains", "follows", self.follows)
+
+    def _conditional(self, response):
+        if request.method == "GET" and response.status_code == 200 and response.is_json:
+            response.add_etag()
+            response.make_conditional(request)
+        return response
+
+    def _current_user(self):
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        user_id = self.tokens.get(token)
+        if user_id is None:
+            abort(401)
+        return user_id
+
+    def _playlist(self, playlist_id):
+        playlist = self.playlists.get(playlist_id)
+        if playlist is None:
+            abort(404)
+        return playlist
+
+    def _editable_playlist(self, playlist_id):
+        user_id = self._current_user()
+        playlist = self._playlist(playlist_id)
+        if playlist["owner"] != user_id and not playlist["collaborative"]:
+            abort(403)
+        return user_id, playlist
+
+    def _snapshot(self, playlist):
+        return f"{playlist['id']}:{playlist['version']}"
+
+    def _edited(self, playlist):
+        playlist["version"] += 1
+        return jsonify({"snapshot_id": self._snapshot(playlist)})
+
+    def _simplified(self, playlist):
+        return {
+            "id": playlist["id"],
+            "name": playlist["name"],
+            "description": "",
+            "public": playlist["public"],
+            "collaborative": playlist["collaborative"],
+            "owner": {"id": playlist["owner"]},
+            "snapshot_id": self._snapshot(playlist),
+            "tracks": {"total": len(playlist["items"])},
+            "external_urls": {"spotify": f"https://open.spotify.com/playlist/{playlist['id']}"},
+        }
+
+    def _track(self, uri):
+        return self.catalog.get(uri) or {"uri": uri, "name": uri, "artists": [{"name": "Unknown"}]}
+
+    # Accounts
+
+    def token(self):
+        user_id = self.refresh_tokens.get(request.form.get("refresh_token"))
+        if user_id is None:
+            return jsonify({"error": "invalid_grant"}), 400
+        with self.lock:
+            access_token = f"{user_id}-token-{next(self._ids)}"
+            self.tokens[access_token] = user_id
+        return jsonify({"access_token": access_token, "token_type": "Bearer", "expires_in": 3600})
+
+    # Users
+
+    def me(self):
+        user_id = self._current_user()
+        return jsonify({"id": user_id, "display_name": user_id, "email": self.users[user_id].get("email")})
+
+    def top_tracks(self):
+        user_id = self._current_user()
+        limit = int(request.args.get("limit", 20))
+        uris = self.users[user_id]["top_tracks"][:limit]
+        return jsonify({"items": [self._track(uri) for uri in uris], "total": len(uris)})
+
+    def my_playlists(self):
+        return self.user_playlists(self._current_user())
+
+    def user_playlists(self, user_id):
+        self._current_user()
+        limit = min(int(request.args.get("limit", 20)), 50)
+        offset = int(request.args.get("offset", 0))
+        with self.lock:
+            playlists = [
+                self._simplified(playlist) for playlist in self.playlists.values()
+                if playlist["owner"] == user_id or user_id in playlist["followers"]
+            ]
+        return jsonify({
+            "items": playlists[offset:offset + limit],
+            "total": len(playlists),
+            "limit": limit,
+            "offset": offset,
+        })
+
+    def create_playlist(self, user_id):
+        if self._current_user() != user_id:
+            abort(403)
+        body = request.get_json(force=True)
+        with self.lock:
+            playlist_id = f"created-{next(self._ids)}"
+            playlist = self.playlists[playlist_id] = {
+                "id": playlist_id,
+                "name": body.get("name", ""),
+                "owner": user_id,
+                "public": body.get("public", True),
+                "collaborative": body.get("collaborative", False),
+                "items": [],
+                "followers": {user_id},
+                "version": 0,
+            }
+            return jsonify(self._simplified(playlist)), 201
+
+    # Playlists
+
+    def playlist(self, playlist_id):
+        self._current_user()
+        with self.lock:
+            return jsonify(self._simplified(self._playlist(playlist_id)))
+
+    def playlist_tracks(self, playlist_id):
+        self._current_user()
+        limit = min(int(request.args.get("limit", PAGE_LIMIT)), PAGE_LIMIT)
+        offset = int(request.args.get("offset", 0))
+        with self.lock:
+            items = self._playlist(playlist_id)["items"]
+            page = items[offset:offset + limit]
+            total = len(items)
+        return jsonify({
+            "items": [
+                {"added_at": added_at, "added_by": {"id": added_by}, "track": self._track(uri)}
+                for uri, added_at, added_by in page
+            ],
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+        })
+
+    def add_tracks(self, playlist_id):
+        user_id, playlist = self._editable_playlist(playlist_id)
+        body = request.get_json(force=True)
+        uris = body.get("uris", [])
+        if len(uris) > PAGE_LIMIT:
+            abort(400)
+        with self.lock:
+            items = playlist["items"]
+            position = body.get("position", len(items))
+            added_at = _now()
+            items[position:position] = [(uri, added_at, user_id) for uri in uris]
+            response = self._edited(playlist)
+        response.status_code = 201
+        return response
+
+    def remove_tracks(self, playlist_id):
+        user_id, playlist = self._editable_playlist(playlist_id)
+        body = request.get_json(force=True)
+        if len(body.get("tracks", [])) > PAGE_LIMIT:
+            abort(400)
+        removed = {track["uri"] for track in body.get("tracks", [])}
+        with self.lock:
+            playlist["items"] = [item for item in playlist["items"] if item[0] not in removed]
+            return self._edited(playlist)
+
+    def reorder_tracks(self, playlist_id):
+        user_id, playlist = self._editable_playlist(playlist_id)
+        body = request.get_json(force=True)
+        with self.lock:
+            items = playlist["items"]
+            if "uris" in body:
+                added_at = _now()
+                playlist["items"] = [(uri, added_at, user_id) for uri in body["uris"]]
+                return self._edited(playlist)
+
+            start, length = body["range_start"], body.get("range_length", 1)
+            insert_before = body["insert_before"]
+            block = items[start:start + length]
+            del items[start:start + length]
+            if insert_before > start:
+                insert_before -= length
+            items[insert_before:insert_before] = block
+            return self._edited(playlist)
+
+    def follow(self, playlist_id):
+        user_id = self._current_user()
+        with self.lock:
+            self._playlist(playlist_id)["followers"].add(user_id)
+        return "", 200
+
+    def unfollow(self, playlist_id):
+        user_id = self._current_user()
+        with self.lock:
+            self._playlist(playlist_id)["followers"].discard(user_id)
+        return "", 200
+
+    def follows(self, playlist_id):
+        user_id = self._current_user()
+        ids = request.args.get("ids")
+        ids = ids.split(",") if ids else [user_id]
+        with self.lock:
+            followers = self._playlist(playlist_id)["followers"]
+            return jsonify([follower in followers for follower in ids])
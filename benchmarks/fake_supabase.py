@@ -0,0 +1,304 @@
+"""
+Local stand-in for the Supabase REST API (PostgREST) with the tables and
+functions this project uses, kept in memory.
+
+Supports the subset of PostgREST that supabase-py sends for our queries:
+column selection, `eq` / `neq` / `in` / `lt` / `lte` / `gt` / `gte` / `is`
+filters, ordering, offset / limit, exact counts, inserts, upserts (merge or
+ignore duplicates), updates, deletes, and the RPCs from migrations/. Auth
+only supports deleting users.
+"""
+
+# Standard library imports
+import json
+from datetime import datetime
+from datetime import timezone
+from datetime import timedelta
+
+# Third party imports
+from flask import Response
+from flask import request
+
+# Local imports
+from benchmarks.fake_service import FakeService
+
+
+PRIMARY_KEYS = {
+    "spotify_tokens": ("user_id",),
+    "spotify_playlists": ("user_id",),
+    "spotify_follows": ("follower_id", "following_id"),
+    "playlist_update_jobs": ("run_id", "user_id"),
+    "cron_cursors": ("name",),
+}
+
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _column_defaults(table):
+    if table == "playlist_update_jobs":
+        return {
+            "status": "pending",
+            "attempts": 0,
+            "worker_id": None,
+            "lease_expires_at": None,
+            "next_attempt_at": _now().isoformat(),
+            "last_error": None,
+            "updated_at": _now().isoformat(),
+        }
+    return {}
+
+
+def _unquote(value):
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
+
+
+def _compare(row_value, operand):
+    # Compare numerically when both sides are numbers, otherwise as text
+    # (timestamps are stored as ISO strings in UTC, which sort correctly).
+    try:
+        return float(row_value) - float(operand)
+    except (TypeError, ValueError):
+        row_value = str(row_value)
+        return (row_value > operand) - (row_value < operand)
+
+
+def _matches(row, column, op, operand):
+    value = row.get(column)
+    if op == "is":
+        return value is None if operand == "null" else str(value).lower() == operand
+    if value is None:
+        return False
+    if op == "eq":
+        return str(value) == operand or (isinstance(value, bool) and str(value).lower() == operand)
+    if op == "neq":
+        return str(value) != operand
+    if op == "in":
+        return str(value) in {_unquote(v) for v in operand.strip("()").split(",")}
+    if op in ("lt", "lte", "gt", "gte"):
+        difference = _compare(value, operand)
+        return {
+            "lt": difference < 0, "lte": difference <= 0,
+            "gt": difference > 0, "gte": difference >= 0,
+        }[op]
+    raise ValueError(f"Unsupported filter: {op}")
+
+
+class FakeSupabase(FakeService):
+    """
+    Args:
+        tables (dict): Table name -> list of rows (see population.py)
+        **faults: Latency / 429 injection settings, see `FakeService`
+    """
+
+    def __init__(self, tables, **faults):
+        super().__init__("fake_supabase", **faults)
+        self.tables = {table: [] for table in PRIMARY_KEYS}
+        for table, rows in tables.items():
+            self.tables[table] = [dict(row) for row in rows]
+
+        self.rpcs = {
+            "claim_playlist_update_jobs": self.claim_playlist_update_jobs,
+            "claim_playlist_update_job": self.claim_playlist_update_job,
+            "claim_token_refresh": self.claim_token_refresh,
+        }
+
+        self.deleted_users = set()
+
+        route = self.app.add_url_rule
+        route("/auth/v1/admin/users/<user_id>", "delete_user", self.delete_user, methods=["DELETE"])
+        route("/rest/v1/rpc/<name>", "rpc", self.rpc, methods=["POST"])
+        route("/rest/v1/<table>", "select", self.select, methods=["GET"])
+        route("/rest/v1/<table>", "insert", self.insert, methods=["POST"])
+        route("/rest/v1/<table>", "update", self.update, methods=["PATCH"])
+        route("/rest/v1/<table>", "delete", self.delete, methods=["DELETE"])
+
+    # Helpers
+
+    def _rows(self, table):
+        if table not in self.tables:
+            raise KeyError(table)
+        return self.tables[table]
+
+    def _filtered(self, rows):
+        filters = [
+            (column, *value.split(".", 1))
+            for column, value in request.args.items(multi=True)
+            if column not in RESERVED_PARAMS
+        ]
+        return [
+            row for row in rows
+            if all(_matches(row, column, op, operand) for column, op, operand in filters)
+        ]
+
+    def _prefers(self, option):
+        return option in request.headers.get("Prefer", "")
+
+    def _json(self, data, status=200, headers=None):
+        return Response(json.dumps(data), status=status, headers=headers, mimetype="application/json")
+
+    def _written(self, rows, status):
+        if self._prefers("return=representation"):
+            return self._json(rows, status)
+        return Response(status=status if status != 200 else 204)
+
+    # Tables
+
+    def select(self, table):
+        with self.lock:
+            rows = self._filtered(self._rows(table))
+
+            for order in reversed(request.args.get("order", "").split(",")):
+                if not order:
+                    continue
+                column, _, direction = order.partition(".")
+                rows = sorted(
+                    rows,
+                    key=lambda row: (row.get(column) is None, str(row.get(column))),
+                    reverse=direction.startswith("desc"),
+                )
+
+            total = len(rows)
+            offset = int(request.args.get("offset", 0))
+            limit = request.args.get("limit")
+            rows = rows[offset:offset + int(limit)] if limit is not None else rows[offset:]
+
+            columns = request.args.get("select", "*")
+            if columns != "*":
+                names = [column.strip() for column in columns.split(",")]
+                rows = [{name: row.get(name) for name in names} for row in rows]
+            else:
+                rows = [dict(row) for row in rows]
+
+        headers = {}
+        if self._prefers("count="):
+            end = offset + len(rows) - 1
+            headers["Content-Range"] = f"{offset}-{end}/{total}" if rows else f"*/{total}"
+        return self._json(rows, headers=headers)
+
+    def insert(self, table):
+        body = request.get_json(force=True)
+        body = body if isinstance(body, list) else [body]
+        keys = tuple(request.args["on_conflict"].split(",")) if "on_conflict" in request.args else PRIMARY_KEYS[table]
+        merge = self._prefers("resolution=merge-duplicates")
+        ignore = self._prefers("resolution=ignore-duplicates")
+
+        written = []
+        with self.lock:
+            rows = self._rows(table)
+            existing = {tuple(str(row.get(key)) for key in keys): row for row in rows}
+            for new_row in body:
+                current = existing.get(tuple(str(new_row.get(key)) for key in keys))
+                if current is None:
+                    row = {**_column_defaults(table), **new_row}
+                    rows.append(row)
+                    existing[tuple(str(row.get(key)) for key in keys)] = row
+                    written.append(dict(row))
+                elif merge:
+                    current.update(new_row)
+                    written.append(dict(current))
+                elif not ignore:
+                    return self._json({
+                        "code": "23505",
+                        "message": f"duplicate key value violates unique constraint on {table}",
+                        "details": None,
+                        "hint": None,
+                    }, 409)
+        return self._written(written, 201)
+
+    def update(self, table):
+        body = request.get_json(force=True)
+        with self.lock:
+            rows = self._filtered(self._rows(table))
+            for row in rows:
+                row.update(body)
+            written = [dict(row) for row in rows]
+        return self._written(written, 200)
+
+    def delete(self, table):
+        with self.lock:
+            all_rows = self._rows(table)
+            removed = self._filtered(all_rows)
+            removed_ids = {id(row) for row in removed}
+            all_rows[:] = [row for row in all_rows if id(row) not in removed_ids]
+        return self._written(removed, 200)
+
+    # Auth
+
+    def delete_user(self, user_id):
+        with self.lock:
+            self.deleted_users.add(user_id)
+        return self._json({})
+
+    # Functions
+
+    def rpc(self, name):
+        function = self.rpcs.get(name)
+        if function is None:
+            return self._json({"code": "PGRST202", "message": f"Unknown function {name}"}, 404)
+        with self.lock:
+            return self._json(function(**request.get_json(force=True)))
+
+    def claim_playlist_update_jobs(self, p_run_id, p_worker_id, p_limit, p_lease_seconds, p_max_attempts):
+        jobs = [job for job in self.tables["playlist_update_jobs"] if job["run_id"] == p_run_id]
+        return self._claim_jobs(jobs, p_worker_id, p_limit, p_lease_seconds, p_max_attempts)
+
+    def claim_playlist_update_job(self, p_run_id, p_user_id, p_worker_id, p_lease_seconds, p_max_attempts):
+        jobs = [
+            job for job in self.tables["playlist_update_jobs"]
+            if job["run_id"] == p_run_id and job["user_id"] == p_user_id
+        ]
+        return self._claim_jobs(jobs, p_worker_id, 1, p_lease_seconds, p_max_attempts)
+
+    def _claim_jobs(self, jobs, worker_id, limit, lease_seconds, max_attempts):
+        now = _now()
+
+        def lease_expired(job):
+            return job["status"] == "running" and datetime.fromisoformat(job["lease_expires_at"]) < now
+
+        for job in jobs:
+            if lease_expired(job) and job["attempts"] >= max_attempts:
+                job.update({
+                    "status": "failed",
+                    "lease_expires_at": None,
+                    "last_error": f"lease expired after {job['attempts']} attempts",
+                    "updated_at": now.isoformat(),
+                })
+
+        due = [
+            job for job in jobs
+            if job["attempts"] < max_attempts and (
+                (job["status"] == "pending" and datetime.fromisoformat(job["next_attempt_at"]) <= now)
+                or lease_expired(job)
+            )
+        ]
+        due.sort(key=lambda job: job["next_attempt_at"])
+
+        claimed = []
+        for job in due[:limit]:
+            job.update({
+                "status": "running",
+                "worker_id": worker_id,
+                "attempts": job["attempts"] + 1,
+                "lease_expires_at": (now + timedelta(seconds=lease_seconds)).isoformat(),
+                "updated_at": now.isoformat(),
+            })
+            claimed.append(dict(job))
+        return claimed
+
+    def claim_token_refresh(self, p_user_id, p_access_token, p_lease_seconds):
+        now = _now()
+        for row in self.tables["spotify_tokens"]:
+            if row["user_id"] != p_user_id or row["access_token"] != p_access_token:
+                continue
+            locked_until = row.get("refresh_locked_until")
+            if locked_until and datetime.fromisoformat(locked_until) >= now:
+                return False
+            row["refresh_locked_until"] = (now + timedelta(seconds=p_lease_seconds)).isoformat()
+            return True
+        return False
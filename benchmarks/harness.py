@@ -0,0 +1,123 @@
+"""
+Run the Spotify and Supabase stand-ins in a child process and point this
+process at them.
+
+The stand-ins run in their own process so their CPU time and memory don't
+show up in the measurements of the code under test.
+"""
+
+# Standard library imports
+import os
+import sys
+import json
+import logging
+import multiprocessing
+from urllib.request import Request
+from urllib.request import urlopen
+
+# Local imports
+from benchmarks.fake_service import serve_in_thread
+
+
+# Any well-formed JWT works: the stand-in doesn't check it.
+FAKE_SERVICE_KEY = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.benchmark"
+
+
+def _serve(population, spotify_faults, supabase_faults, ports):
+    # Local imports
+    from benchmarks.fake_spotify import FakeSpotify
+    from benchmarks.fake_supabase import FakeSupabase
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    spotify = FakeSpotify(population["spotify"], **spotify_faults).make_server()
+    supabase = FakeSupabase(population["supabase"], **supabase_faults).make_server()
+    ports.put((spotify.server_port, supabase.server_port))
+    serve_in_thread(supabase)
+    spotify.serve_forever()
+
+
+class FakeServices:
+    """
+    Context manager that starts both stand-ins loaded with `population`.
+
+    Args:
+        population (dict): See `population.generate_population`
+        spotify_faults (dict): Latency / 429 settings of the Spotify stand-in
+        supabase_faults (dict): Latency / 429 settings of the Supabase stand-in
+    """
+
+    def __init__(self, population, spotify_faults=None, supabase_faults=None):
+        self.population = population
+        self.spotify_faults = spotify_faults or {}
+        self.supabase_faults = supabase_faults or {}
+        self.process = None
+        self.spotify_url = None
+        self.supabase_url = None
+
+    def __enter__(self):
+        context = multiprocessing.get_context("spawn")
+        ports = context.Queue()
+        self.process = context.Process(
+            target=_serve,
+            args=(self.population, self.spotify_faults, self.supabase_faults, ports),
+            daemon=True,
+        )
+        self.process.start()
+        spotify_port, supabase_port = ports.get(timeout=60)
+        self.spotify_url = f"http://127.0.0.1:{spotify_port}"
+        self.supabase_url = f"http://127.0.0.1:{supabase_port}"
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
+
+    def environment(self):
+        """Environment variables that point the app at the stand-ins."""
+        return {
+            "SPOTIFY_API_URL": f"{self.spotify_url}/v1",
+            "SPOTIFY_TOKEN_URL": f"{self.spotify_url}/api/token",
+            "SPOTIFY_CLIENT_ID": "benchmark",
+            "SPOTIFY_CLIENT_SECRET": "benchmark",
+            "SUPABASE_URL": self.supabase_url,
+            "SUPABASE_SERVICE_KEY": FAKE_SERVICE_KEY,
+        }
+
+    def configure(self):
+        """
+        Point this process at the stand-ins. Must run before the app's modules
+        are imported, since they read their settings at import time.
+        """
+        loaded = [name for name in ("utils", "spotify_client", "app") if name in sys.modules]
+        if loaded:
+            raise RuntimeError(f"Configure the stand-ins before importing {', '.join(loaded)}")
+        os.environ.update(self.environment())
+
+    def stats(self):
+        """Requests per endpoint (and injected 429s) seen by each stand-in."""
+        return {
+            "spotify": _get_json(f"{self.spotify_url}/_bench/stats"),
+            "supabase": _get_json(f"{self.supabase_url}/_bench/stats"),
+        }
+
+    def reset_stats(self):
+        for url in (self.spotify_url, self.supabase_url):
+            urlopen(Request(f"{url}/_bench/reset", method="POST")).close()
+
+
+def _get_json(url):
+    with urlopen(url) as response:
+        return json.load(response)
+
+
+def format_request_counts(stats):
+    """Table of request counts per endpoint, busiest first."""
+    lines = []
+    for service, counters in stats.items():
+        requests = counters["requests"]
+        throttled = counters["throttled"]
+        lines.append(f"{service}: {sum(requests.values())} requests, {sum(throttled.values())} throttled")
+        for endpoint, count in sorted(requests.items(), key=lambda item: -item[1]):
+            suffix = f" ({throttled[endpoint]} throttled)" if throttled.get(endpoint) else ""
+            lines.append(f"    {count:>8}  {endpoint}{suffix}")
+    return "\n".join(lines)
@@ -0,0 +1,311 @@
+"""
+Load test the app's endpoints against local Spotify and Supabase stand-ins.
+
+Sends a mix of `/create-follow`, `/webhook/user-created` and `/delete-user`
+requests from concurrent clients and reports throughput, p50 / p95 / p99
+latency and error rate per route. Onboarding is reported separately, from
+the webhook's response to the background onboarding finishing.
+
+A follow storm on a viral share link is modelled with `--viral-fraction`:
+that share of follows target the same (most followed) user.
+
+Save a baseline once, then compare later runs with the same settings against
+it; the run exits with 1 when a route got slower or less reliable than the
+baseline allows. Latencies depend on the machine, so record the baseline on
+the machine that runs the comparison:
+    python -m benchmarks.load_test --latency 0.01 --rate-limit 1000 \
+        --save-baseline benchmarks/baselines/load_test.json
+    python -m benchmarks.load_test --latency 0.01 --rate-limit 1000 \
+        --baseline benchmarks/baselines/load_test.json
+"""
+
+# Standard library imports
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import contextlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Local imports
+from benchmarks.bench_cron import add_fault_arguments
+from benchmarks.bench_cron import add_population_arguments
+from benchmarks.harness import FakeServices
+from benchmarks.harness import format_request_counts
+from benchmarks.population import describe
+from benchmarks.population import new_user_ids
+from benchmarks.population import generate_population
+from tracing import percentile
+
+
+ROUTES = {
+    "create-follow": ("POST", "/create-follow"),
+    "user-created": ("POST", "/webhook/user-created"),
+    "delete-user": ("DELETE", "/delete-user"),
+}
+
+# Settings that must match for a run to be compared with a baseline.
+CONFIG_KEYS = (
+    "users", "new_users", "mean_degree", "degree_distribution", "popularity_skew", "playlist_size", "seed",
+    "latency", "jitter", "throttle_rate", "retry_after", "db_latency", "rate_limit",
+    "requests", "concurrency", "mix", "viral_fraction",
+)
+
+# Samples a route needs before a percentile is compared with the baseline:
+# with fewer, the nearest-rank p99 is just the slowest request.
+MIN_SAMPLES = {"p50_ms": 1, "p95_ms": 20, "p99_ms": 100}
+
+
+def parse_mix(mix):
+    """"create-follow=8,user-created=1" -> {"create-follow": 8.0, "user-created": 1.0}"""
+    weights = {}
+    for part in mix.split(","):
+        route, _, weight = part.partition("=")
+        route = route.strip()
+        if route not in ROUTES:
+            raise ValueError(f"Unknown route in mix: {route} (expected one of {', '.join(ROUTES)})")
+        weights[route] = float(weight or 1)
+    return weights
+
+
+def plan_requests(population, args):
+    """
+    The requests of the run, in the order they are sent.
+
+    New users are onboarded once each and onboarded users are deleted once
+    each; when the run asks for more than there are, the same users are sent
+    again, like a webhook retry or a second click on "delete account".
+    Users set aside for deletion are never part of a follow.
+
+    Returns:
+        list: (route, json body) pairs
+    """
+    rng = random.Random(args.seed)
+    weights = parse_mix(args.mix)
+    routes = rng.choices(list(weights), weights=list(weights.values()), k=args.requests)
+
+    new_users = new_user_ids(population)
+    onboarded = [row["user_id"] for row in population["supabase"]["spotify_playlists"]]
+    deleted = onboarded[len(onboarded) - routes.count("delete-user"):] if "delete-user" in routes else []
+    followable = onboarded[:len(onboarded) - len(deleted)]
+    if "create-follow" in routes and len(followable) < 2:
+        raise ValueError("Not enough users left to follow each other, raise --users")
+    if ("user-created" in routes and not new_users) or ("delete-user" in routes and not deleted):
+        raise ValueError("No users to onboard or delete, raise --users / --new-users")
+
+    # The population makes the first user the most followed one.
+    viral_target = followable[0] if followable else None
+    counters = defaultdict(int)
+    planned = []
+    for route in routes:
+        if route == "create-follow":
+            follower = rng.choice(followable)
+            target = viral_target if rng.random() < args.viral_fraction else rng.choice(followable)
+            while target == follower:
+                target = rng.choice(followable)
+            body = {"user1": follower, "user2": target}
+        else:
+            users = new_users if route == "user-created" else deleted
+            body = {"user_id": users[counters[route] % len(users)]}
+            counters[route] += 1
+        planned.append((route, body))
+    return planned
+
+
+def summarize(latencies, errors, wall_time):
+    """Throughput, latency percentiles (ms) and error rate of one route."""
+    count = len(latencies)
+    return {
+        "requests": count,
+        "errors": errors,
+        "error_rate": round(errors / count, 4) if count else 0.0,
+        "throughput": round(count / wall_time, 2) if wall_time else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if count else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if count else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if count else None,
+        "max_ms": round(max(latencies) * 1000, 2) if count else None,
+    }
+
+
+def run_load_test(args):
+    population = generate_population(
+        users=args.users,
+        mean_degree=args.mean_degree,
+        degree_distribution=args.degree_distribution,
+        popularity_skew=args.popularity_skew,
+        playlist_size=args.playlist_size,
+        new_users=args.new_users,
+        seed=args.seed,
+    )
+    planned = plan_requests(population, args)
+    services = FakeServices(
+        population,
+        spotify_faults={
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "throttle_rate": args.throttle_rate,
+            "retry_after": args.retry_after,
+            "seed": args.seed,
+        },
+        supabase_faults={"latency": args.db_latency, "seed": args.seed},
+    )
+
+    with services:
+        services.configure()
+        if args.rate_limit:
+            os.environ["SPOTIFY_RATE_LIMIT"] = str(args.rate_limit)
+            os.environ["SPOTIFY_RATE_BURST"] = str(int(args.rate_limit * 2))
+
+        # Imported only now: the app reads its settings at import time.
+        # Local imports
+        import app as app_module
+
+        if args.quiet:
+            logging.getLogger("spotifriends").setLevel(logging.WARNING)
+
+        def send(request):
+            route, body = request
+            method, path = ROUTES[route]
+            started = time.perf_counter()
+            try:
+                response = app_module.app.test_client().open(path, method=method, json=body)
+                failed = response.status_code >= 400
+            except Exception:
+                failed = True
+            return route, time.perf_counter() - started, failed
+
+        with contextlib.ExitStack() as stack:
+            # The app prints progress to stdout; keep it out of the report.
+            if args.quiet:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                results = list(executor.map(send, planned))
+            wall_time = time.perf_counter() - started
+
+            # Let the onboardings queued by the webhook finish.
+            app_module.onboarding_tasks.shutdown(wait=True)
+
+        latencies, errors = defaultdict(list), defaultdict(int)
+        for route, latency, failed in results:
+            latencies[route].append(latency)
+            errors[route] += failed
+
+        onboarding_latencies, onboarding_errors = [], 0
+        for user_id in {body["user_id"] for route, body in planned if route == "user-created"}:
+            task = app_module.onboarding_tasks.get(user_id)
+            if task is None or task["status"] != "success":
+                onboarding_errors += 1
+            if task is not None and task["finished_at"] is not None:
+                onboarding_latencies.append(task["finished_at"] - task["submitted_at"])
+
+        routes = {route: summarize(latencies[route], errors[route], wall_time) for route in ROUTES if route in latencies}
+        if onboarding_latencies or onboarding_errors:
+            routes["onboarding"] = summarize(onboarding_latencies, onboarding_errors, wall_time)
+
+        return {
+            "config": {key: getattr(args, key) for key in CONFIG_KEYS},
+            "population": describe(population),
+            "wall_time": round(wall_time, 3),
+            "routes": routes,
+            "requests": services.stats(),
+        }
+
+
+def compare_with_baseline(report, baseline, tolerance, slack_ms):
+    """
+    Regressions of `report` against `baseline`: a route whose p50 / p95 / p99
+    grew by more than `tolerance` (and more than `slack_ms`, so that
+    millisecond noise on fast routes isn't a failure), whose throughput fell
+    by more than `tolerance`, or whose error rate went up.
+
+    Returns:
+        list: Descriptions of the regressions, empty if there are none
+    """
+    if report["config"] != baseline["config"]:
+        changed = sorted(
+            key for key in set(report["config"]) | set(baseline["config"])
+            if report["config"].get(key) != baseline["config"].get(key)
+        )
+        raise ValueError(f"The baseline was recorded with different settings: {', '.join(changed)}")
+
+    regressions = []
+    for route, expected in baseline["routes"].items():
+        actual = report["routes"].get(route)
+        if actual is None:
+            regressions.append(f"{route}: missing from this run")
+            continue
+        for key, min_samples in MIN_SAMPLES.items():
+            if expected["requests"] < min_samples:
+                continue
+            limit = max(expected[key] * (1 + tolerance), expected[key] + slack_ms)
+            if actual[key] > limit:
+                regressions.append(f"{route}: {key} {actual[key]:.1f} > {limit:.1f} (baseline {expected[key]:.1f})")
+        if actual["throughput"] < expected["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{route}: throughput {actual['throughput']:.1f}/s < baseline {expected['throughput']:.1f}/s"
+            )
+        if actual["error_rate"] > expected["error_rate"]:
+            regressions.append(
+                f"{route}: error rate {actual['error_rate']:.2%} > baseline {expected['error_rate']:.2%}"
+            )
+    return regressions
+
+
+def format_report(report):
+    config = report["config"]
+    lines = [
+        f"Population: {report['population']}",
+        f"{config['requests']} requests ({config['mix']}), concurrency {config['concurrency']}, "
+        f"viral fraction {config['viral_fraction']:g}",
+        f"Wall time: {report['wall_time']:.2f}s",
+        f"{'route':<14} {'requests':>8} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}",
+    ]
+    for route, stats in report["routes"].items():
+        lines.append(
+            f"{route:<14} {stats['requests']:>8} {stats['errors']:>7} {stats['throughput']:>8.1f} "
+            f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['max_ms']:>8.1f}"
+        )
+    lines.append(format_request_counts(report["requests"]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_population_arguments(parser)
+    add_fault_arguments(parser)
+    parser.add_argument("--new-users", type=int, default=50, help="Users waiting to be onboarded")
+    parser.add_argument("--requests", type=int, default=500, help="Total requests sent")
+    parser.add_argument("--concurrency", type=int, default=16, help="Clients sending requests at the same time")
+    parser.add_argument("--mix", default="create-follow=8,user-created=1,delete-user=1",
+                        help="Relative weights of the routes")
+    parser.add_argument("--viral-fraction", type=float, default=0.5,
+                        help="Share of follows that target the same user")
+    parser.add_argument("--baseline", default=None, help="Fail if this run regressed against this report")
+    parser.add_argument("--save-baseline", default=None, help="Write this run's report as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="Allowed relative slowdown / throughput drop against the baseline")
+    parser.add_argument("--slack-ms", type=float, default=5.0,
+                        help="Latency increase (ms) always allowed against the baseline")
+    parser.add_argument("--quiet", action="store_true", help="Only print the report")
+    args = parser.parse_args()
+
+    report = run_load_test(args)
+    print(format_report(report))
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_with_baseline(report, json.load(f), args.tolerance, args.slack_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,193 @@
+"""
+Synthetic user populations for the benchmarks.
+
+A population holds the rows of the Supabase tables and the matching Spotify
+state (users, tokens, top tracks, playlists and who follows them), generated
+deterministically from a seed.
+"""
+
+# Standard library imports
+import uuid
+import random
+from itertools import accumulate
+from datetime import datetime
+from datetime import timezone
+from datetime import timedelta
+
+
+DEGREE_DISTRIBUTIONS = ("fixed", "uniform", "powerlaw")
+
+
+def _timestamp(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def sample_degree(rng, distribution, mean, max_degree):
+    """Number of users someone follows, drawn from `distribution` with the given mean."""
+    if distribution == "fixed":
+        degree = mean
+    elif distribution == "uniform":
+        degree = rng.randint(0, 2 * mean)
+    elif distribution == "powerlaw":
+        # Pareto with shape 2 has mean 2 * scale: most users follow a few
+        # friends, a handful follow a lot.
+        degree = int(rng.paretovariate(2.0) * mean / 2)
+    else:
+        raise ValueError(f"Unknown degree distribution: {distribution}")
+    return max(0, min(int(degree), max_degree))
+
+
+def generate_population(
+    users=100,
+    mean_degree=5,
+    degree_distribution="powerlaw",
+    popularity_skew=1.0,
+    playlist_size=50,
+    recent_additions=2,
+    catalog_size=5000,
+    top_tracks=3,
+    new_users=0,
+    seed=0,
+):
+    """
+    Generate a population.
+
+    Args:
+        users (int): Number of users
+        mean_degree (int): Average number of users each user follows
+        degree_distribution (str): "fixed", "uniform" or "powerlaw"
+        popularity_skew (float): Zipf exponent of how likely a user is to be
+            followed (0 = everyone equally likely)
+        playlist_size (int): Average number of tracks in a My Top Tracks playlist
+        recent_additions (int): Maximum tracks a user added to their own
+            playlist this week
+        catalog_size (int): Number of distinct tracks
+        top_tracks (int): Top tracks per user
+        new_users (int): Extra users who have signed in with Spotify but
+            haven't been onboarded yet (no playlists or follows)
+        seed (int): Random seed
+
+    Returns:
+        dict: {"supabase": {table: rows}, "spotify": state of the fake Spotify}
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    expires_at = (now + timedelta(days=365)).isoformat()
+
+    catalog = {}
+    for i in range(catalog_size):
+        uri = f"spotify:track:{i:022d}"
+        catalog[uri] = {"uri": uri, "name": f"Track {i}", "artists": [{"name": f"Artist {i % 997}"}]}
+    track_uris = list(catalog)
+
+    tokens, playlist_rows, follows = [], [], []
+    spotify_users, playlists = {}, {}
+    user_ids = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(users + new_users)]
+
+    for i, user_id in enumerate(user_ids):
+        spotify_id = f"spotify-user-{i}"
+        email = f"user-{i}@example.com"
+        access_token = f"{spotify_id}-token"
+
+        tokens.append({
+            "user_id": user_id,
+            "email": email,
+            "access_token": access_token,
+            "refresh_token": f"{spotify_id}-refresh",
+            "expires_at": expires_at,
+            "spotify_id": spotify_id,
+        })
+        spotify_users[spotify_id] = {
+            "email": email,
+            "access_token": access_token,
+            "refresh_token": f"{spotify_id}-refresh",
+            "top_tracks": rng.sample(track_uris, top_tracks),
+        }
+        if i >= users:
+            continue
+
+        # My Top Tracks: past weeks' top tracks, followed by whatever the
+        # user added themselves, the last few of them this week.
+        size = rng.randint(0, 2 * playlist_size)
+        recent = rng.randint(0, min(recent_additions, size))
+        items = [
+            (uri, _timestamp(now - timedelta(days=rng.uniform(8, 365))), spotify_id)
+            for uri in rng.sample(track_uris, size - recent)
+        ]
+        items.sort(key=lambda item: item[1], reverse=True)
+        items += [
+            (uri, _timestamp(now - timedelta(days=rng.uniform(0, 6))), spotify_id)
+            for uri in rng.sample(track_uris, recent)
+        ]
+
+        individual_id = f"individual-{i}"
+        group_id = f"group-{i}"
+        playlists[individual_id] = {
+            "id": individual_id, "name": "My Top Tracks", "owner": spotify_id,
+            "public": True, "collaborative": False, "items": items, "followers": [spotify_id],
+        }
+        playlists[group_id] = {
+            "id": group_id, "name": "Friend Favorites", "owner": spotify_id,
+            "public": False, "collaborative": True, "items": [], "followers": [spotify_id],
+        }
+        playlist_rows.append({
+            "user_id": user_id,
+            "email": email,
+            "individual_playlist": individual_id,
+            "group_playlist": group_id,
+        })
+
+    # Follow graph: out-degrees from the chosen distribution, targets picked
+    # with Zipf popularity so a few users are followed by many.
+    cum_weights = list(accumulate(1 / (rank + 1) ** popularity_skew for rank in range(users)))
+    for i, user_id in enumerate(user_ids[:users]):
+        degree = sample_degree(rng, degree_distribution, mean_degree, users - 1)
+        followed = set()
+        while len(followed) < degree:
+            j = rng.choices(range(users), cum_weights=cum_weights)[0]
+            if j != i:
+                followed.add(j)
+
+        group_items = []
+        for j in sorted(followed):
+            follows.append({"follower_id": user_id, "following_id": user_ids[j]})
+            playlists[f"individual-{j}"]["followers"].append(f"spotify-user-{i}")
+
+            # Last week's friend favorites: some of each friend's tracks.
+            friend_top_tracks = spotify_users[f"spotify-user-{j}"]["top_tracks"]
+            for uri in rng.sample(friend_top_tracks, min(2, len(friend_top_tracks))):
+                group_items.append((uri, _timestamp(now - timedelta(days=7)), f"spotify-user-{j}"))
+        playlists[f"group-{i}"]["items"] = group_items
+
+    return {
+        "supabase": {
+            "spotify_tokens": tokens,
+            "spotify_playlists": playlist_rows,
+            "spotify_follows": follows,
+        },
+        "spotify": {
+            "catalog": catalog,
+            "users": spotify_users,
+            "playlists": playlists,
+        },
+    }
+
+
+def new_user_ids(population):
+    """Users of the population who haven't been onboarded yet."""
+    onboarded = {row["user_id"] for row in population["supabase"]["spotify_playlists"]}
+    return [
+        row["user_id"] for row in population["supabase"]["spotify_tokens"]
+        if row["user_id"] not in onboarded
+    ]
+
+
+def describe(population):
+    """Short summary of a population's size."""
+    playlists = population["spotify"]["playlists"].values()
+    return {
+        "users": len(population["supabase"]["spotify_playlists"]),
+        "new_users": len(new_user_ids(population)),
+        "follows": len(population["supabase"]["spotify_follows"]),
+        "playlist_items": sum(len(playlist["items"]) for playlist in playlists),
+    }
@@ -0,0 +1,225 @@
+"""
+Conditional-request cache for Spotify GET endpoints.
+
+Spotify sends an `ETag` with many of its responses. We keep the ETag and the
+raw body of those responses and send `If-None-Match` the next time the same
+resource is requested; when Spotify answers `304 Not Modified` the cached body
+is served instead, so an unchanged resource only costs a tiny round trip.
+
+Responses are scoped to the user they were fetched for (most endpoints, like
+"/me/top/tracks", answer differently per user), and stored in a pluggable
+backend: an in-memory LRU, or a SQLite file that survives process restarts.
+"""
+
+# Standard library imports
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Third party imports
+import requests
+
+
+# "memory", "sqlite:<path>" or "off".
+SPOTIFY_HTTP_CACHE = os.getenv("SPOTIFY_HTTP_CACHE", "memory")
+
+# Number of responses, and total bytes of their bodies, kept by the
+# in-memory store. Responses larger than SPOTIFY_HTTP_CACHE_MAX_ENTRY_BYTES
+# are not kept at all.
+SPOTIFY_HTTP_CACHE_SIZE = int(os.getenv("SPOTIFY_HTTP_CACHE_SIZE", "2048"))
+SPOTIFY_HTTP_CACHE_MAX_BYTES = int(os.getenv("SPOTIFY_HTTP_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+SPOTIFY_HTTP_CACHE_MAX_ENTRY_BYTES = int(os.getenv("SPOTIFY_HTTP_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+
+
+class MemoryCacheStore:
+    """
+    Least-recently-used store kept in process memory, bounded both by number
+    of responses and by the total size of their bodies.
+
+    Args:
+        max_entries (int): Number of responses kept before evicting the oldest
+        max_bytes (int): Total body bytes kept before evicting the oldest
+        max_entry_bytes (int): Bodies larger than this aren't stored
+    """
+
+    def __init__(self, max_entries=SPOTIFY_HTTP_CACHE_SIZE, max_bytes=SPOTIFY_HTTP_CACHE_MAX_BYTES,
+                 max_entry_bytes=SPOTIFY_HTTP_CACHE_MAX_ENTRY_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.size = 0  # Total bytes of the stored bodies
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous["body"])
+            if len(entry["body"]) > self.max_entry_bytes:
+                return
+
+            self._entries[key] = entry
+            self.size += len(entry["body"])
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted["body"])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class SQLiteCacheStore:
+    """
+    Store backed by a local SQLite file, shared by processes on the same host.
+
+    Args:
+        path (str): Path of the database file; created if it doesn't exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS http_cache ("
+                " key TEXT PRIMARY KEY,"
+                " etag TEXT NOT NULL,"
+                " content_type TEXT,"
+                " body BLOB NOT NULL,"
+                " stored_at REAL NOT NULL"
+                ")"
+            )
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, content_type, body FROM http_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        etag, content_type, body = row
+        return {"etag": etag, "content_type": content_type, "body": bytes(body)}
+
+    def set(self, key, entry):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO http_cache (key, etag, content_type, body, stored_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, entry["etag"], entry["content_type"], entry["body"], time.time()),
+            )
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM http_cache")
+
+
+class HTTPCache:
+    """
+    ETag cache in front of a store, counting how often it saved a download.
+
+    Args:
+        store: Backend with `get(key)` and `set(key, entry)`
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(url, params=None, scope=None):
+        """Cache key of a GET request made on behalf of `scope` (e.g. a user id)."""
+        url = requests.Request("GET", url, params=params).prepare().url
+        return f"{scope or ''} {url}"
+
+    def conditional_headers(self, key):
+        """
+        Look up the cached response for `key`.
+
+        Returns:
+            tuple: (cached entry or None, headers to send with the request)
+        """
+        entry = self.store.get(key)
+        if entry is None:
+            return None, {}
+        return entry, {"If-None-Match": entry["etag"]}
+
+    def resolve(self, key, entry, response):
+        """
+        Serve a 304 from the cached `entry`, and remember cacheable 200s.
+
+        Returns:
+            requests.Response: The response the caller should see
+        """
+        if response.status_code == 304 and entry is not None:
+            with self._lock:
+                self.hits += 1
+            return self._cached_response(entry, response)
+
+        with self._lock:
+            self.misses += 1
+        etag = response.headers.get("ETag")
+        if response.status_code == 200 and etag:
+            self.store.set(key, {
+                "etag": etag,
+                "content_type": response.headers.get("Content-Type"),
+                "body": response.content,
+            })
+        return response
+
+    @staticmethod
+    def _cached_response(entry, not_modified):
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = not_modified.url
+        response.request = not_modified.request
+        response.headers = not_modified.headers
+        response.headers["ETag"] = entry["etag"]
+        if entry["content_type"]:
+            response.headers["Content-Type"] = entry["content_type"]
+        response._content = entry["body"]
+        response.encoding = not_modified.encoding
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+def token_scope(access_token):
+    """Fallback cache scope for a token whose owner isn't known."""
+    if not access_token:
+        return None
+    return "token:" + hashlib.sha256(access_token.encode()).hexdigest()[:16]
+
+
+def build_http_cache(setting=SPOTIFY_HTTP_CACHE):
+    """
+    Create the cache described by a `SPOTIFY_HTTP_CACHE` setting.
+
+    Returns:
+        HTTPCache: The cache, or None if caching is turned off
+    """
+    if not setting or setting == "off":
+        return None
+    if setting == "memory":
+        return HTTPCache(MemoryCacheStore())
+    if setting.startswith("sqlite:"):
+        return HTTPCache(SQLiteCacheStore(setting[len("sqlite:"):]))
+    raise ValueError(f"Unknown SPOTIFY_HTTP_CACHE setting: {setting}")
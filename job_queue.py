@@ -0,0 +1,242 @@
+"""
+Durable run state for the weekly playlist update: a job queue backed by the
+`playlist_update_jobs` Supabase table (see migrations/002), and resume
+cursors for time-budgeted runs in `cron_cursors` (see migrations/003). The
+claim functions are defined in migrations/006 and 007.
+
+Each weekly run has one row per user. Workers claim batches of jobs with a
+lease; a job whose lease expires (e.g. the worker was killed) can be claimed
+again by another worker, and failed jobs are retried with exponential backoff,
+both until the job has been attempted JOB_MAX_ATTEMPTS times.
+A run can therefore be split across any number of cron invocations or CLI
+processes and resumed after a crash.
+"""
+
+# Standard library imports
+import os
+import uuid
+import logging
+from datetime import datetime
+from datetime import timezone
+from datetime import timedelta
+
+# Local imports
+from supabase_client import get_supabase
+
+
+logger = logging.getLogger("spotifriends")
+
+
+JOBS_TABLE = "playlist_update_jobs"
+CURSORS_TABLE = "cron_cursors"
+
+# Run whose jobs onboard new users (one per user, never repeated).
+ONBOARDING_RUN_ID = "onboarding"
+
+# How long a claimed job is reserved for its worker.
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))
+
+# Attempts before a job is marked as failed for the run.
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Base delay before retrying a failed job; doubles with every attempt.
+JOB_RETRY_BASE_SECONDS = int(os.getenv("JOB_RETRY_BASE_SECONDS", "60"))
+
+# Rows inserted per request when enqueueing a run.
+ENQUEUE_BATCH_SIZE = 500
+
+JOB_STATUSES = ("pending", "running", "succeeded", "failed")
+
+
+def current_run_id(now=None):
+    """The id of this week's run, e.g. "2025-W07"."""
+    now = now or datetime.now(timezone.utc)
+    return now.strftime("%G-W%V")
+
+
+def new_worker_id():
+    return f"worker-{uuid.uuid4().hex[:12]}"
+
+
+def enqueue_run(run_id, user_ids):
+    """
+    Create a pending job for every user in the run.
+
+    Jobs that already exist (e.g. from an earlier invocation) are left
+    untouched, so enqueueing is idempotent.
+
+    Returns:
+        int: Number of users submitted
+    """
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), ENQUEUE_BATCH_SIZE):
+        get_supabase().table(JOBS_TABLE).upsert(
+            [
+                {"run_id": run_id, "user_id": user_id, "status": "pending"}
+                for user_id in user_ids[start:start + ENQUEUE_BATCH_SIZE]
+            ],
+            on_conflict="run_id,user_id",
+            ignore_duplicates=True,
+        ).execute()
+
+    logger.info(f"Enqueued {len(user_ids)} users for run {run_id}")
+    return len(user_ids)
+
+
+def claim_jobs(run_id, worker_id, limit=10, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+    """
+    Atomically lease up to `limit` jobs that are due, or whose previous
+    lease has expired, and have been attempted fewer than `max_attempts`
+    times. Jobs whose lease expired on their last attempt (the worker
+    crashed or timed out, so `fail_job` never ran) are marked as failed.
+
+    Returns:
+        list: The claimed job rows
+    """
+    result = get_supabase().rpc(
+        "claim_playlist_update_jobs",
+        {
+            "p_run_id": run_id,
+            "p_worker_id": worker_id,
+            "p_limit": limit,
+            "p_lease_seconds": lease_seconds,
+            "p_max_attempts": max_attempts,
+        },
+    ).execute()
+    return result.data or []
+
+
+def claim_job(run_id, user_id, worker_id, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+    """
+    Atomically lease the job of one user in a run, on the same terms as
+    `claim_jobs`.
+
+    Returns:
+        dict: The claimed job row, or None if the job is held by another
+        worker, not due yet, finished or out of attempts
+    """
+    result = get_supabase().rpc(
+        "claim_playlist_update_job",
+        {
+            "p_run_id": run_id,
+            "p_user_id": user_id,
+            "p_worker_id": worker_id,
+            "p_lease_seconds": lease_seconds,
+            "p_max_attempts": max_attempts,
+        },
+    ).execute()
+    return result.data[0] if result.data else None
+
+
+def get_job(run_id, user_id):
+    """The job row of a user in a run, or None if there is none."""
+    result = get_supabase().table(JOBS_TABLE).select("*")\
+        .eq("run_id", run_id)\
+        .eq("user_id", user_id)\
+        .execute()
+    return result.data[0] if result.data else None
+
+
+def complete_job(job, worker_id):
+    """Mark a job as succeeded, unless another worker has stolen its lease."""
+    get_supabase().table(JOBS_TABLE).update({
+        "status": "succeeded",
+        "lease_expires_at": None,
+        "last_error": None,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }).eq("run_id", job["run_id"])\
+        .eq("user_id", job["user_id"])\
+        .eq("worker_id", worker_id)\
+        .execute()
+
+
+def fail_job(job, worker_id, error, max_attempts=JOB_MAX_ATTEMPTS):
+    """
+    Record a failed attempt. The job is retried after an exponential backoff
+    until it has been attempted `max_attempts` times.
+
+    Returns:
+        bool: True if the job will be retried
+    """
+    now = datetime.now(timezone.utc)
+    retry = job["attempts"] < max_attempts
+    update = {
+        "status": "pending" if retry else "failed",
+        "lease_expires_at": None,
+        "last_error": str(error)[:1000],
+        "updated_at": now.isoformat(),
+    }
+    if retry:
+        delay = JOB_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)
+        update["next_attempt_at"] = (now + timedelta(seconds=delay)).isoformat()
+
+    get_supabase().table(JOBS_TABLE).update(update)\
+        .eq("run_id", job["run_id"])\
+        .eq("user_id", job["user_id"])\
+        .eq("worker_id", worker_id)\
+        .execute()
+    return retry
+
+
+def reset_job(job):
+    """
+    Make a finished job (succeeded, or failed after `max_attempts`) due again
+    with a fresh set of attempts. Does nothing if its status has changed
+    since `job` was read.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    get_supabase().table(JOBS_TABLE).update({
+        "status": "pending",
+        "attempts": 0,
+        "worker_id": None,
+        "lease_expires_at": None,
+        "next_attempt_at": now,
+        "last_error": None,
+        "updated_at": now,
+    }).eq("run_id", job["run_id"])\
+        .eq("user_id", job["user_id"])\
+        .eq("status", job["status"])\
+        .execute()
+
+
+def get_run_status(run_id):
+    """
+    Count the jobs of a run by status.
+
+    Returns:
+        dict: status -> number of jobs
+    """
+    counts = {}
+    for status in JOB_STATUSES:
+        result = get_supabase().table(JOBS_TABLE)\
+            .select("user_id", count="exact")\
+            .eq("run_id", run_id)\
+            .eq("status", status)\
+            .limit(1)\
+            .execute()
+        counts[status] = result.count or 0
+    return counts
+
+
+def load_cursor(name):
+    """
+    Get the saved position of a time-budgeted run.
+
+    Returns:
+        dict: The cursor row (`run_id`, `last_user_id`, `completed_at`), or
+        None if the run has never saved one
+    """
+    result = get_supabase().table(CURSORS_TABLE).select("*").eq("name", name).execute()
+    return result.data[0] if result.data else None
+
+
+def save_cursor(name, run_id, last_user_id, completed=False):
+    """Persist how far a time-budgeted run got, so the next invocation resumes there."""
+    now = datetime.now(timezone.utc).isoformat()
+    get_supabase().table(CURSORS_TABLE).upsert({
+        "name": name,
+        "run_id": run_id,
+        "last_user_id": last_user_id,
+        "completed_at": now if completed else None,
+        "updated_at": now,
+    }).execute()
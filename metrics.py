@@ -0,0 +1,338 @@
+"""
+In-process metrics, exposed in the Prometheus text format by `/metrics`.
+
+Counts, status codes and latency histograms are recorded for every request the
+app handles (see app.py) and every request it sends to Spotify (see
+spotify_client) and Supabase (see `instrumented_http_client`). Requests are
+labeled by route or logical endpoint (top tracks, playlist items, token
+refresh, ...) rather than by url, so the number of series stays small.
+Recording a request is a regex match, a bisect and a few additions under a
+lock.
+"""
+
+# Standard library imports
+import re
+import time
+import bisect
+import threading
+from urllib.parse import urlsplit
+
+# Third party imports
+import httpx
+
+# Local imports
+from tracing import count_request
+
+
+# Upper bounds (seconds) of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A monotonically increasing count per combination of label values.
+
+    Args:
+        name (str): Metric name
+        documentation (str): Help text
+        labelnames (tuple): Names of the labels, in the order values are passed
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """
+    Observations bucketed by upper bound, with their count and sum, per
+    combination of label values.
+
+    Args:
+        name (str): Metric name
+        documentation (str): Help text
+        labelnames (tuple): Names of the labels, in the order values are passed
+        buckets (tuple): Sorted upper bounds of the buckets
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            return sum(series[0]) if series else 0
+
+    def samples(self):
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, [("le", _format_value(bound))])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class MetricsRegistry:
+    """The metrics of this process, rendered together by `/metrics`."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in self._metrics:
+            metric.clear()
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total",
+    "Requests handled by the app.",
+    ("route", "method", "status"),
+)
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Time the app took to handle a request.",
+    ("route", "method"),
+)
+SPOTIFY_REQUESTS = REGISTRY.counter(
+    "spotify_requests_total",
+    "Requests sent to Spotify, including retries of throttled ones.",
+    ("endpoint", "method", "status"),
+)
+SPOTIFY_LATENCY = REGISTRY.histogram(
+    "spotify_request_duration_seconds",
+    "Time from sending a request to Spotify to receiving its response.",
+    ("endpoint", "method"),
+)
+SPOTIFY_RATE_LIMIT_WAIT = REGISTRY.histogram(
+    "spotify_rate_limit_wait_seconds",
+    "Time a Spotify request waited for the rate limiter before being sent.",
+)
+SUPABASE_REQUESTS = REGISTRY.counter(
+    "supabase_requests_total",
+    "Requests sent to Supabase.",
+    ("table", "operation", "status"),
+)
+SUPABASE_LATENCY = REGISTRY.histogram(
+    "supabase_request_duration_seconds",
+    "Time from sending a request to Supabase to reading its whole response.",
+    ("table", "operation"),
+)
+
+
+# Logical names of the Spotify endpoints, matched against the url path with
+# the API version prefix removed. Anything else is counted as "other".
+SPOTIFY_ENDPOINTS = [
+    (re.compile(pattern), name) for pattern, name in (
+        (r"^/api/token$", "token_refresh"),
+        (r"^/me$", "current_user"),
+        (r"^/me/top/tracks$", "top_tracks"),
+        (r"^/me/playlists$", "current_user_playlists"),
+        (r"^/users/[^/]+/playlists$", "user_playlists"),
+        (r"^/playlists/[^/]+/(?:tracks|items)$", "playlist_items"),
+        (r"^/playlists/[^/]+/followers/contains$", "playlist_followers_contains"),
+        (r"^/playlists/[^/]+/followers$", "playlist_followers"),
+        (r"^/playlists/[^/]+$", "playlist"),
+    )
+]
+
+_API_VERSION_PREFIX = re.compile(r"^.*?/v1(?=/)")
+
+
+def spotify_endpoint(url):
+    """Logical name of the Spotify endpoint `url` belongs to."""
+    path = _API_VERSION_PREFIX.sub("", urlsplit(url).path, count=1).rstrip("/")
+    for pattern, name in SPOTIFY_ENDPOINTS:
+        if pattern.match(path):
+            return name
+    return "other"
+
+
+def record_spotify_request(method, url, status, seconds):
+    """
+    Record one request to Spotify.
+
+    Args:
+        method (str): HTTP method
+        url (str): Requested url
+        status (int | str): Response status code, or "error" if none came back
+        seconds (float): Time until the response (or the error)
+    """
+    endpoint = spotify_endpoint(url)
+    SPOTIFY_REQUESTS.inc(endpoint, method, str(status))
+    SPOTIFY_LATENCY.observe(seconds, endpoint, method)
+    count_request("spotify")
+
+
+def supabase_operation(request):
+    """
+    (table, operation) of a request to Supabase, e.g. ("spotify_tokens",
+    "select") or ("claim_token_refresh", "rpc").
+    """
+    path = request.url.path.rstrip("/")
+    if "/rest/v1/rpc/" in path:
+        return path.rsplit("/", 1)[-1], "rpc"
+    if "/rest/v1/" in path:
+        table = path.rsplit("/", 1)[-1]
+        if request.method == "POST":
+            prefer = request.headers.get("Prefer", "")
+            return table, "upsert" if "resolution=" in prefer else "insert"
+        return table, {
+            "GET": "select", "HEAD": "select", "PATCH": "update", "DELETE": "delete",
+        }.get(request.method, request.method.lower())
+    if "/auth/v1/" in path:
+        return "auth", request.method.lower()
+    return "other", request.method.lower()
+
+
+def record_supabase_request(table, operation, status, seconds):
+    SUPABASE_REQUESTS.inc(table, operation, str(status))
+    SUPABASE_LATENCY.observe(seconds, table, operation)
+    count_request("supabase")
+
+
+class _TimedStream(httpx.SyncByteStream):
+    """Response body that reports when it has been read and closed."""
+
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            on_close, self.on_close = self.on_close, None
+            if on_close:
+                on_close()
+
+
+class InstrumentedTransport(httpx.BaseTransport):
+    """
+    httpx transport that records every request to Supabase, from sending it
+    to the response body being read (i.e. the whole `.execute()` call).
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def handle_request(self, request):
+        table, operation = supabase_operation(request)
+        started = time.perf_counter()
+        try:
+            response = self.transport.handle_request(request)
+        except Exception:
+            record_supabase_request(table, operation, "error", time.perf_counter() - started)
+            raise
+
+        status = response.status_code
+        response.stream = _TimedStream(
+            response.stream,
+            lambda: record_supabase_request(table, operation, status, time.perf_counter() - started),
+        )
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+def instrumented_http_client(timeout=120, http2=True):
+    """
+    httpx client for supabase-py (`ClientOptions.httpx_client`) that records
+    every request, with the same settings supabase-py uses by default.
+    """
+    return httpx.Client(
+        transport=InstrumentedTransport(httpx.HTTPTransport(http2=http2)),
+        timeout=timeout,
+        follow_redirects=True,
+    )
@@ -0,0 +1,4 @@
+-- Store when each access token expires so the backend can refresh tokens
+-- proactively instead of probing /v1/me to check them.
+alter table spotify_tokens
+    add column if not exists expires_at timestamptz;
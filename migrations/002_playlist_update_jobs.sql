@@ -0,0 +1,53 @@
+-- One row per user per weekly playlist update run. Workers lease jobs with
+-- claim_playlist_update_jobs so several cron invocations / CLI processes can
+-- share a run, and a crashed run can be resumed.
+create table if not exists playlist_update_jobs (
+    run_id text not null,
+    user_id uuid not null,
+    status text not null default 'pending'
+        check (status in ('pending', 'running', 'succeeded', 'failed')),
+    attempts integer not null default 0,
+    worker_id text,
+    lease_expires_at timestamptz,
+    next_attempt_at timestamptz not null default now(),
+    last_error text,
+    updated_at timestamptz not null default now(),
+    primary key (run_id, user_id)
+);
+
+create index if not exists playlist_update_jobs_due_idx
+    on playlist_update_jobs (run_id, status, next_attempt_at);
+
+-- Lease up to p_limit jobs that are due, or whose lease has expired.
+-- SKIP LOCKED lets concurrent workers claim disjoint batches.
+create or replace function claim_playlist_update_jobs(
+    p_run_id text,
+    p_worker_id text,
+    p_limit integer,
+    p_lease_seconds integer
+)
+returns setof playlist_update_jobs
+language sql
+as $$
+    update playlist_update_jobs as jobs
+    set status = 'running',
+        worker_id = p_worker_id,
+        attempts = jobs.attempts + 1,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+        updated_at = now()
+    from (
+        select run_id, user_id
+        from playlist_update_jobs
+        where run_id = p_run_id
+          and (
+              (status = 'pending' and next_attempt_at <= now())
+              or (status = 'running' and lease_expires_at < now())
+          )
+        order by next_attempt_at
+        limit p_limit
+        for update skip locked
+    ) as due
+    where jobs.run_id = due.run_id
+      and jobs.user_id = due.user_id
+    returning jobs.*;
+$$;
@@ -0,0 +1,9 @@
+-- Where a time-budgeted cron invocation stopped, so the next invocation of
+-- the same run (and shard) resumes after the last user it started.
+create table if not exists cron_cursors (
+    name text primary key,
+    run_id text not null,
+    last_user_id uuid,
+    completed_at timestamptz,
+    updated_at timestamptz not null default now()
+);
@@ -0,0 +1,4 @@
+-- Store each user's Spotify profile id, which never changes, so it doesn't
+-- have to be looked up with a /v1/me call every time it is needed.
+alter table spotify_tokens
+    add column if not exists spotify_id text;
@@ -0,0 +1,25 @@
+-- Let one worker at a time refresh a user's access token. Other workers wait
+-- for the new token to be written instead of refreshing it a second time.
+alter table spotify_tokens
+    add column if not exists refresh_locked_until timestamptz;
+
+-- Take the refresh lease of a user's token if the token is still the one the
+-- caller read (nobody has refreshed it since) and no unexpired lease exists.
+create or replace function claim_token_refresh(
+    p_user_id uuid,
+    p_access_token text,
+    p_lease_seconds integer
+)
+returns boolean
+language sql
+as $$
+    with claimed as (
+        update spotify_tokens
+        set refresh_locked_until = now() + make_interval(secs => p_lease_seconds)
+        where user_id = p_user_id
+          and access_token = p_access_token
+          and (refresh_locked_until is null or refresh_locked_until < now())
+        returning 1
+    )
+    select exists (select 1 from claimed);
+$$;
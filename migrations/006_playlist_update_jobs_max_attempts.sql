@@ -0,0 +1,59 @@
+-- Stop re-claiming jobs whose worker crashed or timed out on every attempt.
+-- Such a job never reaches fail_job, so without a limit its expired lease
+-- was claimed again forever, using up every invocation's budget.
+--
+-- Replaces the function from 002 (dropped first, so PostgREST doesn't see
+-- two overloads).
+drop function if exists claim_playlist_update_jobs(text, text, integer, integer);
+
+-- Mark jobs whose lease expired after p_max_attempts attempts as failed,
+-- then lease up to p_limit jobs that are due, or whose lease has expired,
+-- and have attempts left. SKIP LOCKED lets concurrent workers claim
+-- disjoint batches.
+create or replace function claim_playlist_update_jobs(
+    p_run_id text,
+    p_worker_id text,
+    p_limit integer,
+    p_lease_seconds integer,
+    p_max_attempts integer
+)
+returns setof playlist_update_jobs
+language plpgsql
+as $$
+begin
+    update playlist_update_jobs
+    set status = 'failed',
+        lease_expires_at = null,
+        last_error = coalesce(last_error || ' / ', '')
+            || 'lease expired after ' || attempts || ' attempts',
+        updated_at = now()
+    where run_id = p_run_id
+      and status = 'running'
+      and lease_expires_at < now()
+      and attempts >= p_max_attempts;
+
+    return query
+    update playlist_update_jobs as jobs
+    set status = 'running',
+        worker_id = p_worker_id,
+        attempts = jobs.attempts + 1,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+        updated_at = now()
+    from (
+        select run_id, user_id
+        from playlist_update_jobs
+        where run_id = p_run_id
+          and attempts < p_max_attempts
+          and (
+              (status = 'pending' and next_attempt_at <= now())
+              or (status = 'running' and lease_expires_at < now())
+          )
+        order by next_attempt_at
+        limit p_limit
+        for update skip locked
+    ) as due
+    where jobs.run_id = due.run_id
+      and jobs.user_id = due.user_id
+    returning jobs.*;
+end;
+$$;
@@ -0,0 +1,45 @@
+-- Lease one user's job of a run (e.g. the onboarding of a new user), with
+-- the same rules as claim_playlist_update_jobs: the job must be due, or its
+-- lease expired, and have attempts left; a job whose lease expired on its
+-- last attempt is marked as failed instead. Returns no row if the job is
+-- held by another worker, finished or out of attempts.
+create or replace function claim_playlist_update_job(
+    p_run_id text,
+    p_user_id uuid,
+    p_worker_id text,
+    p_lease_seconds integer,
+    p_max_attempts integer
+)
+returns setof playlist_update_jobs
+language plpgsql
+as $$
+begin
+    update playlist_update_jobs
+    set status = 'failed',
+        lease_expires_at = null,
+        last_error = coalesce(last_error || ' / ', '')
+            || 'lease expired after ' || attempts || ' attempts',
+        updated_at = now()
+    where run_id = p_run_id
+      and user_id = p_user_id
+      and status = 'running'
+      and lease_expires_at < now()
+      and attempts >= p_max_attempts;
+
+    return query
+    update playlist_update_jobs as jobs
+    set status = 'running',
+        worker_id = p_worker_id,
+        attempts = jobs.attempts + 1,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+        updated_at = now()
+    where jobs.run_id = p_run_id
+      and jobs.user_id = p_user_id
+      and jobs.attempts < p_max_attempts
+      and (
+          (jobs.status = 'pending' and jobs.next_attempt_at <= now())
+          or (jobs.status = 'running' and jobs.lease_expires_at < now())
+      )
+    returning jobs.*;
+end;
+$$;
@@ -0,0 +1,185 @@
+"""
+Process-wide rate limiter for Spotify Web API calls.
+
+Combines three mechanisms:
+    - a token bucket capping the sustained request rate,
+    - a pause honoring the `Retry-After` header of 429 responses,
+    - an AIMD (additive increase, multiplicative decrease) cap on the number
+      of requests in flight, which shrinks when Spotify throttles us and
+      slowly grows back while requests succeed.
+
+The limiter is thread-safe and can be used from threads (`slot`) as well as
+from asyncio code (`async_slot`).
+"""
+
+# Standard library imports
+import os
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+from contextlib import asynccontextmanager
+
+
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", "20"))  # requests / second
+SPOTIFY_RATE_BURST = int(os.getenv("SPOTIFY_RATE_BURST", "40"))
+SPOTIFY_MAX_CONCURRENCY = int(os.getenv("SPOTIFY_MAX_CONCURRENCY", "16"))
+
+# How long a waiter sleeps before re-checking when blocked on concurrency.
+_POLL_INTERVAL = 0.05
+
+
+class RateLimiter:
+    """
+    Token bucket + Retry-After + AIMD concurrency limiter.
+
+    Args:
+        rate (float): Sustained requests per second
+        burst (int): Maximum number of tokens the bucket can hold
+        max_concurrency (int): Upper bound for requests in flight
+        min_concurrency (int): Lower bound the AIMD cap can shrink to
+        decrease_factor (float): Multiplier applied to the cap on throttling
+    """
+
+    def __init__(
+        self,
+        rate=SPOTIFY_RATE_LIMIT,
+        burst=SPOTIFY_RATE_BURST,
+        max_concurrency=SPOTIFY_MAX_CONCURRENCY,
+        min_concurrency=1,
+        decrease_factor=0.5,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.decrease_factor = decrease_factor
+
+        self._lock = threading.Condition()
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._concurrency = float(max_concurrency)
+        self._in_flight = 0
+
+        self.requests = 0
+        self.throttled = 0
+        self.retried = 0
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def _try_acquire(self):
+        """
+        Take a slot if one is available.
+
+        Returns:
+            float: 0 if acquired, otherwise how long to wait before retrying
+        """
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+
+        if self._in_flight >= int(self._concurrency):
+            return _POLL_INTERVAL
+
+        self._refill(now)
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+
+        self._tokens -= 1
+        self._in_flight += 1
+        self.requests += 1
+        return 0
+
+    def acquire(self):
+        """Block the calling thread until a request may be sent."""
+        with self._lock:
+            while True:
+                wait = self._try_acquire()
+                if wait == 0:
+                    return
+                self._lock.wait(timeout=wait)
+
+    async def acquire_async(self):
+        """Wait, without blocking the event loop, until a request may be sent."""
+        while True:
+            with self._lock:
+                wait = self._try_acquire()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def release(self, throttled=False, retry_after=None):
+        """
+        Return a slot and adapt to the outcome of the request.
+
+        Args:
+            throttled (bool): Whether Spotify answered 429
+            retry_after (float): Seconds Spotify asked us to wait (optional)
+        """
+        with self._lock:
+            self._in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self._concurrency = max(
+                    self.min_concurrency, self._concurrency * self.decrease_factor
+                )
+                if retry_after:
+                    self._blocked_until = max(
+                        self._blocked_until, time.monotonic() + retry_after
+                    )
+            else:
+                # Additive increase: roughly +1 after a full window of successes.
+                self._concurrency = min(
+                    self.max_concurrency, self._concurrency + 1 / self._concurrency
+                )
+            self._lock.notify_all()
+
+    def record_retry(self):
+        with self._lock:
+            self.retried += 1
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold a slot for the duration of a request. The caller reports the
+        outcome through the yielded dict, e.g. `outcome["throttled"] = True`.
+        """
+        self.acquire()
+        outcome = {"throttled": False, "retry_after": None}
+        try:
+            yield outcome
+        finally:
+            self.release(outcome["throttled"], outcome["retry_after"])
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """Async version of `slot`."""
+        await self.acquire_async()
+        outcome = {"throttled": False, "retry_after": None}
+        try:
+            yield outcome
+        finally:
+            self.release(outcome["throttled"], outcome["retry_after"])
+
+    def stats(self):
+        """Counters describing how much we've been throttled."""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "retried": self.retried,
+                "concurrency_limit": int(self._concurrency),
+                "in_flight": self._in_flight,
+            }
+
+
+def parse_retry_after(value, default=1.0):
+    """Parse a `Retry-After` header given in seconds."""
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return default
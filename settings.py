@@ -0,0 +1,30 @@
+"""
+Process-wide setup that has to happen before any other module of the app is
+imported: loading the .env file and configuring logging.
+
+Most modules read their settings from the environment at import time, so
+every entry point (app.py, update_group_playlists.py, utils.py) imports this
+module before its other local imports.
+"""
+
+# Standard library imports
+import sys
+import logging
+
+# Third party imports
+from dotenv import load_dotenv
+
+
+# Loads .env file.
+load_dotenv()
+
+# Configure basic logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+
+#Disable logging from the Supabase library
+logging.getLogger("supabase").setLevel(logging.WARNING)
+logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -0,0 +1,223 @@
+"""
+Shared HTTP client for the Spotify Web API.
+
+Every Spotify call in this project goes through one pooled `requests.Session`
+so that keep-alive connections to api.spotify.com and accounts.spotify.com are
+reused across calls instead of paying a new TCP+TLS handshake per request.
+GET responses can additionally be revalidated with their ETag (see http_cache).
+"""
+
+# Standard library imports
+import os
+import time
+import threading
+
+# Third party imports
+import requests
+from requests.adapters import HTTPAdapter
+
+# Local imports
+from http_cache import token_scope
+from http_cache import build_http_cache
+from metrics import SPOTIFY_RATE_LIMIT_WAIT
+from metrics import record_spotify_request
+from rate_limiter import RateLimiter
+from rate_limiter import parse_retry_after
+
+
+# Overridable so the client can be pointed at a local stand-in (see benchmarks/).
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1")
+SPOTIFY_TOKEN_URL = os.getenv("SPOTIFY_TOKEN_URL", "https://accounts.spotify.com/api/token")
+
+# Number of distinct hosts to keep pools for, and connections kept per host.
+SPOTIFY_POOL_CONNECTIONS = int(os.getenv("SPOTIFY_POOL_CONNECTIONS", "4"))
+SPOTIFY_POOL_MAXSIZE = int(os.getenv("SPOTIFY_POOL_MAXSIZE", "32"))
+
+# Seconds to wait for a connection / a response before giving up.
+SPOTIFY_TIMEOUT = float(os.getenv("SPOTIFY_TIMEOUT", "30"))
+
+# How many times a throttled (429) request is retried before giving up.
+SPOTIFY_MAX_RETRIES = int(os.getenv("SPOTIFY_MAX_RETRIES", "3"))
+
+
+class SpotifyClient:
+    """
+    Thin wrapper around a pooled `requests.Session` for Spotify calls.
+
+    Args:
+        base_url (str): Prefix used for relative paths such as "/me"
+        pool_connections (int): Number of per-host connection pools to cache
+        pool_maxsize (int): Maximum number of connections kept per host
+        timeout (float): Default request timeout in seconds
+        limiter (RateLimiter): Rate limiter shared by all requests (optional)
+        max_retries (int): Retries for requests throttled with a 429
+        cache (HTTPCache): ETag cache for GET requests (optional)
+    """
+
+    def __init__(
+        self,
+        base_url=SPOTIFY_API_URL,
+        pool_connections=SPOTIFY_POOL_CONNECTIONS,
+        pool_maxsize=SPOTIFY_POOL_MAXSIZE,
+        timeout=SPOTIFY_TIMEOUT,
+        limiter=None,
+        max_retries=SPOTIFY_MAX_RETRIES,
+        cache=None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.cache = cache
+
+        # Called with the rejected access token when Spotify answers 401; it
+        # should return a fresh token (or None) so the request can be retried.
+        self.unauthorized_handler = None
+
+        # Called with an access token to get a stable id of its owner (e.g.
+        # the user id), so cached responses outlive token refreshes.
+        self.cache_scope_resolver = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @staticmethod
+    def build_headers(access_token=None, json_body=True, extra=None):
+        """
+        Build the request headers shared by all Spotify calls.
+
+        Args:
+            access_token (str): Spotify OAuth access token (optional)
+            json_body (bool): Whether to send a JSON content type
+            extra (dict): Additional headers to merge in (optional)
+
+        Returns:
+            dict: Request headers
+        """
+        headers = {}
+        if access_token:
+            headers["Authorization"] = f"Bearer {access_token}"
+        if json_body:
+            headers["Content-Type"] = "application/json"
+        if extra:
+            headers.update(extra)
+        return headers
+
+    def url(self, path):
+        """Resolve a relative API path (e.g. "/me") against the base url."""
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method, path, access_token=None, headers=None, cache=True, **kwargs):
+        """
+        Send a request through the pooled session.
+
+        Args:
+            method (str): HTTP method
+            path (str): Relative API path or absolute url
+            access_token (str): Spotify OAuth access token (optional)
+            headers (dict): Headers to send in addition to the defaults
+            cache (bool): Whether a GET may be served from the ETag cache
+            **kwargs: Passed through to `requests.Session.request`
+
+        Returns:
+            requests.Response: The raw response; callers check the status
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        url = self.url(path)
+        cache = cache and method == "GET" and self.cache is not None
+        response = self._fetch(method, url, access_token, headers, kwargs, cache)
+
+        # Fallback for tokens that expired earlier than we expected: refresh
+        # once and replay the request with the new token.
+        if response.status_code == 401 and access_token and self.unauthorized_handler:
+            new_token = self.unauthorized_handler(access_token)
+            if new_token and new_token != access_token:
+                response = self._fetch(method, url, new_token, headers, kwargs, cache)
+        return response
+
+    def _fetch(self, method, url, access_token, headers, kwargs, cache):
+        """`_send`, revalidating the cached response of a GET if there is one."""
+        if not cache:
+            return self._send(method, url, access_token, headers, kwargs)
+
+        key = self.cache.key(url, kwargs.get("params"), self.cache_scope(access_token))
+        entry, conditional = self.cache.conditional_headers(key)
+        response = self._send(method, url, access_token, {**conditional, **(headers or {})}, kwargs)
+        return self.cache.resolve(key, entry, response)
+
+    def cache_scope(self, access_token):
+        """Whose cache entries a request made with `access_token` may use."""
+        scope = None
+        if access_token and self.cache_scope_resolver:
+            scope = self.cache_scope_resolver(access_token)
+        return f"user:{scope}" if scope else token_scope(access_token)
+
+    def _send(self, method, url, access_token, headers, kwargs):
+        """
+        Send a request through the rate limiter, retrying when Spotify
+        throttles us with a 429 and honoring its `Retry-After` header.
+        Every attempt is recorded in the metrics.
+        """
+        for attempt in range(self.max_retries + 1):
+            queued = time.perf_counter()
+            with self.limiter.slot() as outcome:
+                started = time.perf_counter()
+                SPOTIFY_RATE_LIMIT_WAIT.observe(started - queued)
+                try:
+                    response = self.session.request(
+                        method,
+                        url,
+                        headers=self.build_headers(access_token, extra=headers),
+                        **kwargs,
+                    )
+                except Exception:
+                    record_spotify_request(method, url, "error", time.perf_counter() - started)
+                    raise
+                record_spotify_request(method, url, response.status_code, time.perf_counter() - started)
+
+                if response.status_code == 429:
+                    outcome["throttled"] = True
+                    outcome["retry_after"] = parse_retry_after(
+                        response.headers.get("Retry-After"), default=2 ** attempt
+                    )
+
+            if response.status_code != 429 or attempt == self.max_retries:
+                return response
+            self.limiter.record_retry()
+        return response
+
+    def get(self, path, access_token=None, **kwargs):
+        return self.request("GET", path, access_token, **kwargs)
+
+    def post(self, path, access_token=None, **kwargs):
+        return self.request("POST", path, access_token, **kwargs)
+
+    def put(self, path, access_token=None, **kwargs):
+        return self.request("PUT", path, access_token, **kwargs)
+
+    def delete(self, path, access_token=None, **kwargs):
+        return self.request("DELETE", path, access_token, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_spotify_client():
+    """Return the process-wide `SpotifyClient`, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SpotifyClient(cache=build_http_cache())
+    return _client
@@ -0,0 +1,38 @@
+"""
+The process-wide Supabase client, shared by the app and the cron.
+
+The client is created on first use rather than at import time: importing
+supabase-py and building a client take a few hundred milliseconds, which
+every serverless cold start would otherwise pay before serving its first
+request, including requests that never touch the database.
+"""
+
+# Standard library imports
+import os
+import threading
+
+# Local imports
+from metrics import instrumented_http_client
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_supabase():
+    """Return the process-wide Supabase client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Third party imports
+                from supabase import create_client
+                from supabase import ClientOptions
+
+                # Requests go through an instrumented HTTP client so
+                # `/metrics` can report them.
+                _client = create_client(
+                    os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"),
+                    options=ClientOptions(httpx_client=instrumented_http_client()),
+                )
+    return _client
@@ -0,0 +1,68 @@
+# Standard library imports
+import time
+import threading
+import unittest
+
+# Local imports
+from background import BackgroundTasks
+
+
+def wait_until_finished(tasks, key, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        task = tasks.get(key)
+        if task["status"] in ("success", "error"):
+            return task
+        time.sleep(0.01)
+    raise AssertionError(f"Task {key} did not finish")
+
+
+class TestBackgroundTasks(unittest.TestCase):
+
+    def setUp(self):
+        self.tasks = BackgroundTasks(max_workers=2)
+        self.addCleanup(self.tasks.shutdown)
+
+    def test_result_is_recorded(self):
+        task, created = self.tasks.submit("user-1", lambda: {"group_playlist_id": "g1"})
+        self.assertTrue(created)
+        self.assertIn(task["status"], ("queued", "running", "success"))
+
+        task = wait_until_finished(self.tasks, "user-1")
+        self.assertEqual(task["status"], "success")
+        self.assertEqual(task["result"], {"group_playlist_id": "g1"})
+
+    def test_errors_are_recorded(self):
+        def fail():
+            raise Exception("boom")
+
+        self.tasks.submit("user-1", fail)
+        task = wait_until_finished(self.tasks, "user-1")
+        self.assertEqual((task["status"], task["error"]), ("error", "boom"))
+
+    def test_duplicate_submissions_are_ignored_while_running(self):
+        release = threading.Event()
+        calls = []
+
+        def onboard():
+            calls.append(1)
+            release.wait(5)
+
+        _, first = self.tasks.submit("user-1", onboard)
+        _, second = self.tasks.submit("user-1", onboard)
+        release.set()
+        wait_until_finished(self.tasks, "user-1")
+
+        self.assertEqual((first, second), (True, False))
+        self.assertEqual(len(calls), 1)
+
+        # Once finished, the same key can be submitted again.
+        _, third = self.tasks.submit("user-1", onboard)
+        self.assertTrue(third)
+
+    def test_unknown_key(self):
+        self.assertIsNone(self.tasks.get("nobody"))
+
+
+if __name__ == '__main__':
+    unittest.main()
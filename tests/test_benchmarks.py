@@ -0,0 +1,133 @@
+# Standard library imports
+import os
+import sys
+import json
+import tempfile
+import unittest
+import subprocess
+
+# Local imports
+from benchmarks.load_test import compare_with_baseline
+from benchmarks import bench_import
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestCronBenchmark(unittest.TestCase):
+
+    def test_cron_runs_against_stand_ins(self):
+        # Runs in a fresh interpreter: the app reads its settings at import time.
+        with tempfile.TemporaryDirectory() as directory:
+            report_path = os.path.join(directory, "report.json")
+            subprocess.run(
+                [
+                    sys.executable, "-m", "benchmarks.bench_cron",
+                    "--users", "15", "--mean-degree", "3", "--concurrency", "4",
+                    "--rate-limit", "1000", "--throttle-rate", "0.02", "--retry-after", "0",
+                    "--quiet", "--json", report_path,
+                ],
+                cwd=ROOT, check=True, capture_output=True, timeout=120,
+            )
+            with open(report_path) as f:
+                report = json.load(f)
+
+        self.assertEqual(report["summary"]["succeeded"], 15)
+        spotify = report["requests"]["spotify"]["requests"]
+        self.assertGreaterEqual(spotify["GET /v1/me/top/tracks"], 15)
+        self.assertIn("POST /v1/playlists/<playlist_id>/tracks", spotify)
+        self.assertIn("GET /rest/v1/<table>", report["requests"]["supabase"]["requests"])
+
+
+class TestLoadTest(unittest.TestCase):
+
+    def route(self, p50, p95, p99, throughput=10.0, error_rate=0.0, requests=200):
+        return {
+            "requests": requests, "error_rate": error_rate, "throughput": throughput,
+            "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+        }
+
+    def report(self, **routes):
+        return {"config": {"requests": 200}, "routes": routes}
+
+    def test_flags_slower_routes_and_more_errors(self):
+        baseline = self.report(**{"create-follow": self.route(100, 200, 300)})
+        run = self.report(**{"create-follow": self.route(110, 400, 300, error_rate=0.01)})
+
+        regressions = compare_with_baseline(run, baseline, tolerance=0.5, slack_ms=5)
+
+        self.assertEqual(len(regressions), 2)
+        self.assertIn("p95_ms", regressions[0])
+        self.assertIn("error rate", regressions[1])
+
+    def test_small_samples_and_fast_routes_are_not_noise(self):
+        baseline = self.report(**{
+            "user-created": self.route(1, 2, 3),
+            "delete-user": self.route(100, 150, 300, requests=50),
+        })
+        run = self.report(**{
+            "user-created": self.route(4, 6, 7),
+            "delete-user": self.route(100, 150, 900, requests=50),
+        })
+
+        self.assertEqual(compare_with_baseline(run, baseline, tolerance=0.5, slack_ms=5), [])
+
+    def test_refuses_baselines_with_other_settings(self):
+        baseline = self.report()
+        run = {"config": {"requests": 100}, "routes": {}}
+
+        with self.assertRaises(ValueError):
+            compare_with_baseline(run, baseline, tolerance=0.5, slack_ms=5)
+
+    def test_load_test_against_stand_ins(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline_path = os.path.join(directory, "baseline.json")
+            arguments = [
+                sys.executable, "-m", "benchmarks.load_test",
+                "--users", "20", "--new-users", "5", "--requests", "60", "--concurrency", "4",
+                "--rate-limit", "1000", "--quiet",
+            ]
+            subprocess.run(
+                arguments + ["--save-baseline", baseline_path],
+                cwd=ROOT, check=True, capture_output=True, timeout=120,
+            )
+            with open(baseline_path) as f:
+                report = json.load(f)
+
+        routes = report["routes"]
+        self.assertEqual(sum(routes[route]["requests"] for route in ("create-follow", "user-created", "delete-user")), 60)
+        for stats in routes.values():
+            self.assertEqual(stats["errors"], 0)
+            self.assertLessEqual(stats["p50_ms"], stats["p99_ms"])
+        self.assertEqual(routes["onboarding"]["requests"], min(routes["user-created"]["requests"], 5))
+        self.assertIn("DELETE /auth/v1/admin/users/<user_id>", report["requests"]["supabase"]["requests"])
+
+
+
+class TestImportBenchmark(unittest.TestCase):
+
+    def report(self, import_ms, deferred_loaded=()):
+        return {
+            "config": {"python": "3.12.1"},
+            "import_ms": {"median": import_ms},
+            "first_request_ms": {"median": import_ms + 10},
+            "deferred_loaded": list(deferred_loaded),
+        }
+
+    def test_flags_slower_cold_starts_and_eager_imports(self):
+        baseline = self.report(300)
+
+        self.assertEqual(bench_import.compare_with_baseline(self.report(390), baseline, 0.25, 20), [])
+        regressions = bench_import.compare_with_baseline(self.report(600, ["supabase"]), baseline, 0.25, 20)
+        self.assertEqual(len(regressions), 3)
+        self.assertIn("supabase", regressions[-1])
+
+    def test_cold_start_defers_the_database_and_the_cron(self):
+        report = bench_import.run_benchmark(runs=1)
+
+        self.assertEqual(report["deferred_loaded"], [])
+        self.assertIn("utils", [name for name, _ in report["slowest_imports"]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# Standard library imports
+import threading
+import unittest
+from unittest.mock import patch
+
+# Local imports
+import app
+
+
+class TestCreateFollow(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.app.test_client()
+
+    def post(self, add_top_tracks):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def follow_playlist(access_token, playlist_id, public=True):
+            # Both directions have to be in flight at the same time to get past this.
+            barrier.wait()
+
+        with patch.object(app, "get_user_access_token", side_effect=lambda user_id: f"token-{user_id}"), \
+                patch.object(app, "get_custom_playlists", side_effect=lambda user_id: {"individual_playlist": f"p-{user_id}"}), \
+                patch.object(app, "check_playlist_following", return_value=False), \
+                patch.object(app, "follow_playlist", side_effect=follow_playlist), \
+                patch.object(app, "add_top_tracks_to_follower", side_effect=add_top_tracks), \
+                patch.object(app, "follow_user") as follow_user:
+            response = self.client.post("/create-follow", json={"user1": "a", "user2": "b"})
+        return response, follow_user
+
+    def test_directions_run_concurrently(self):
+        response, follow_user = self.post(add_top_tracks=None)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["user1_follows_user2"], {"status": "followed"})
+        self.assertEqual(response.json["user2_follows_user1"], {"status": "followed"})
+        self.assertEqual(
+            sorted(call.args for call in follow_user.call_args_list), [("a", "b"), ("b", "a")]
+        )
+
+    def test_errors_are_reported_per_direction(self):
+        def add_top_tracks(user_id, follower_id):
+            if follower_id == "b":
+                raise Exception("boom")
+
+        response, follow_user = self.post(add_top_tracks)
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json["user1_follows_user2"], {"status": "followed"})
+        self.assertEqual(response.json["user2_follows_user1"]["status"], "error")
+        follow_user.assert_called_once_with("a", "b")
+
+
+if __name__ == '__main__':
+    unittest.main()
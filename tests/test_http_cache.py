@@ -0,0 +1,84 @@
+# Standard library imports
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# Third party imports
+import requests
+
+# Local imports
+from http_cache import HTTPCache
+from http_cache import MemoryCacheStore
+from http_cache import SQLiteCacheStore
+from http_cache import build_http_cache
+from spotify_client import SpotifyClient
+
+
+def make_response(status_code, body=b"", etag=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body
+    if etag:
+        response.headers["ETag"] = etag
+    if body:
+        response.headers["Content-Type"] = "application/json"
+    return response
+
+
+class TestHTTPCache(unittest.TestCase):
+
+    def setUp(self):
+        self.client = SpotifyClient(
+            base_url="https://api.example.com/v1", cache=HTTPCache(MemoryCacheStore())
+        )
+        self.client.cache_scope_resolver = {"token-1": "user-1", "token-2": "user-1"}.get
+
+    def test_not_modified_is_served_from_cache(self):
+        responses = [make_response(200, b'{"id": "me"}', etag='"v1"'), make_response(304)]
+        with patch.object(self.client.session, "request", side_effect=responses) as request:
+            self.client.get("/me", "token-1")
+            # A refreshed token of the same user still revalidates the entry.
+            response = self.client.get("/me", "token-2")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"id": "me"})
+        self.assertNotIn("If-None-Match", request.call_args_list[0].kwargs["headers"])
+        self.assertEqual(request.call_args_list[1].kwargs["headers"]["If-None-Match"], '"v1"')
+        self.assertEqual(self.client.cache.stats(), {"hits": 1, "misses": 1})
+
+    def test_entries_are_scoped_per_user(self):
+        responses = [make_response(200, b"{}", etag='"v1"')] + [make_response(200, b"{}")] * 2
+        with patch.object(self.client.session, "request", side_effect=responses) as request:
+            self.client.get("/me/top/tracks", "token-1", params={"limit": 50})
+            self.client.get("/me/top/tracks", "token-3", params={"limit": 50})
+            self.client.post("/me/top/tracks", "token-1")
+
+        for call in request.call_args_list[1:]:
+            self.assertNotIn("If-None-Match", call.kwargs["headers"])
+
+    def test_lru_and_sqlite_stores(self):
+        store = MemoryCacheStore(max_entries=2)
+        for key in ("a", "b", "a", "c"):
+            store.set(key, {"etag": key, "content_type": None, "body": b""})
+        self.assertIsNone(store.get("b"))
+        self.assertEqual(store.get("a")["etag"], "a")
+
+        store = MemoryCacheStore(max_bytes=10, max_entry_bytes=6)
+        for key, body in (("a", b"1234"), ("b", b"1234"), ("c", b"1234"), ("d", b"1234567")):
+            store.set(key, {"etag": key, "content_type": None, "body": body})
+        self.assertIsNone(store.get("a"))
+        self.assertIsNone(store.get("d"))
+        self.assertEqual(store.size, 8)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.db")
+            SQLiteCacheStore(path).set("k", {"etag": '"v1"', "content_type": "application/json", "body": b"{}"})
+            self.assertEqual(SQLiteCacheStore(path).get("k")["body"], b"{}")
+            self.assertIsInstance(build_http_cache(f"sqlite:{path}").store, SQLiteCacheStore)
+
+        self.assertIsNone(build_http_cache("off"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# Standard library imports
+import unittest
+from datetime import datetime
+from datetime import timezone
+from unittest.mock import Mock
+from unittest.mock import patch
+
+# Local imports
+import utils
+import job_queue
+import update_group_playlists
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.supabase = Mock()
+        patcher = patch.object(job_queue, "get_supabase", return_value=self.supabase)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def update_sent(self):
+        return self.supabase.table.return_value.update.call_args.args[0]
+
+    def test_run_id_is_iso_week(self):
+        self.assertEqual(job_queue.current_run_id(datetime(2025, 1, 1, tzinfo=timezone.utc)), "2025-W01")
+
+    def test_failed_job_is_retried_with_backoff(self):
+        job = {"run_id": "2025-W01", "user_id": "user-1", "attempts": 2}
+        self.assertTrue(job_queue.fail_job(job, "worker", Exception("boom"), max_attempts=3))
+
+        update = self.update_sent()
+        self.assertEqual(update["status"], "pending")
+        self.assertEqual(update["last_error"], "boom")
+        retry_at = datetime.fromisoformat(update["next_attempt_at"])
+        delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+        self.assertAlmostEqual(delay, job_queue.JOB_RETRY_BASE_SECONDS * 2, delta=5)
+
+    def test_job_fails_after_max_attempts(self):
+        job = {"run_id": "2025-W01", "user_id": "user-1", "attempts": 3}
+        self.assertFalse(job_queue.fail_job(job, "worker", Exception("boom"), max_attempts=3))
+        self.assertEqual(self.update_sent()["status"], "failed")
+
+    def test_claims_are_limited_to_max_attempts(self):
+        job_queue.claim_jobs("2025-W01", "worker", limit=5, max_attempts=3)
+
+        name, params = self.supabase.rpc.call_args.args
+        self.assertEqual(name, "claim_playlist_update_jobs")
+        self.assertEqual(params["p_max_attempts"], 3)
+
+    def test_reset_job_gets_fresh_attempts(self):
+        job_queue.reset_job({"run_id": "onboarding", "user_id": "user-1", "status": "failed"})
+
+        update = self.update_sent()
+        self.assertEqual((update["status"], update["attempts"]), ("pending", 0))
+        query = self.supabase.table.return_value.update.return_value
+        query.eq.return_value.eq.return_value.eq.assert_called_once_with("status", "failed")
+
+    def test_updates_are_guarded_by_worker(self):
+        job_queue.complete_job({"run_id": "2025-W01", "user_id": "user-1"}, "worker-a")
+        query = self.supabase.table.return_value.update.return_value
+        query.eq.return_value.eq.return_value.eq.assert_called_once_with("worker_id", "worker-a")
+
+
+class TestQueueWorker(unittest.TestCase):
+
+    def test_worker_drains_claimed_batches(self):
+        index = utils.UserTableIndex([{"user_id": "user-1"}, {"user_id": "user-2"}], [])
+        batches = [
+            [{"run_id": "run", "user_id": "user-1", "attempts": 1}],
+            [{"run_id": "run", "user_id": "user-2", "attempts": 1}],
+            [],
+        ]
+
+        def fake_sync(user_id):
+            if user_id == "user-2":
+                raise Exception("boom")
+            return True
+
+        with patch.object(utils.UserTableIndex, "load", return_value=index), \
+                patch.object(update_group_playlists, "enqueue_run") as enqueue, \
+                patch.object(update_group_playlists, "claim_jobs", side_effect=batches), \
+                patch.object(update_group_playlists, "complete_job") as complete, \
+                patch.object(update_group_playlists, "fail_job") as fail, \
+                patch.object(update_group_playlists, "get_run_status", return_value={}), \
+                patch.object(update_group_playlists, "sync_user_playlists", side_effect=fake_sync):
+            summary = update_group_playlists.run_queue_worker("run", concurrency=2)
+
+        self.assertEqual(list(enqueue.call_args.args[1]), ["user-1", "user-2"])
+        self.assertEqual((summary["succeeded"], summary["failed"]), (1, 1))
+        self.assertEqual(complete.call_args.args[0]["user_id"], "user-1")
+        self.assertEqual(fail.call_args.args[0]["user_id"], "user-2")
+
+
+if __name__ == '__main__':
+    unittest.main()
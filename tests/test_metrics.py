@@ -0,0 +1,102 @@
+# Standard library imports
+import unittest
+from unittest.mock import Mock
+from unittest.mock import patch
+
+# Third party imports
+import httpx
+
+# Local imports
+import app
+import metrics
+import job_queue
+from metrics import MetricsRegistry
+from metrics import InstrumentedTransport
+from metrics import spotify_endpoint
+from spotify_client import SpotifyClient
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.REGISTRY.clear()
+
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("latency_seconds", "Latency.", ("endpoint",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, "top_tracks")
+        histogram.observe(0.5, "top_tracks")
+        histogram.observe(3.0, "top_tracks")
+
+        lines = registry.render().splitlines()
+
+        self.assertIn("# TYPE latency_seconds histogram", lines)
+        self.assertIn('latency_seconds_bucket{endpoint="top_tracks",le="0.1"} 1', lines)
+        self.assertIn('latency_seconds_bucket{endpoint="top_tracks",le="1.0"} 2', lines)
+        self.assertIn('latency_seconds_bucket{endpoint="top_tracks",le="+Inf"} 3', lines)
+        self.assertIn('latency_seconds_sum{endpoint="top_tracks"} 3.55', lines)
+        self.assertIn('latency_seconds_count{endpoint="top_tracks"} 3', lines)
+
+    def test_spotify_endpoints_are_labeled_without_ids(self):
+        self.assertEqual(spotify_endpoint("https://api.spotify.com/v1/me/top/tracks"), "top_tracks")
+        self.assertEqual(spotify_endpoint("https://api.spotify.com/v1/playlists/abc/tracks"), "playlist_items")
+        self.assertEqual(
+            spotify_endpoint("http://127.0.0.1:5000/v1/playlists/abc/followers/contains"),
+            "playlist_followers_contains",
+        )
+        self.assertEqual(spotify_endpoint("https://accounts.spotify.com/api/token"), "token_refresh")
+        self.assertEqual(spotify_endpoint("https://api.spotify.com/v1/browse/new-releases"), "other")
+
+    def test_spotify_client_records_every_attempt(self):
+        client = SpotifyClient(base_url="https://api.example.com/v1", max_retries=1)
+        throttled = Mock(status_code=429, headers={"Retry-After": "0"})
+        ok = Mock(status_code=200, headers={})
+        with patch.object(client.session, "request", side_effect=[throttled, ok]):
+            client.get("/me/top/tracks", "token")
+
+        self.assertEqual(metrics.SPOTIFY_REQUESTS.value("top_tracks", "GET", "429"), 1)
+        self.assertEqual(metrics.SPOTIFY_REQUESTS.value("top_tracks", "GET", "200"), 1)
+        self.assertEqual(metrics.SPOTIFY_LATENCY.count("top_tracks", "GET"), 2)
+        self.assertEqual(metrics.SPOTIFY_RATE_LIMIT_WAIT.count(), 2)
+
+    def test_supabase_requests_are_recorded_by_table_and_operation(self):
+        class Body(httpx.SyncByteStream):
+            def __iter__(self):
+                yield b"[]"
+
+        def handler(request):
+            # Streamed like the responses of a real transport.
+            return httpx.Response(200, stream=Body())
+
+        client = httpx.Client(transport=InstrumentedTransport(httpx.MockTransport(handler)))
+        client.get("https://db.example.com/rest/v1/spotify_tokens", params={"select": "*"})
+        client.post(
+            "https://db.example.com/rest/v1/spotify_follows",
+            json={}, headers={"Prefer": "resolution=merge-duplicates"},
+        )
+        client.post("https://db.example.com/rest/v1/rpc/claim_token_refresh", json={})
+
+        self.assertEqual(metrics.SUPABASE_REQUESTS.value("spotify_tokens", "select", "200"), 1)
+        self.assertEqual(metrics.SUPABASE_REQUESTS.value("spotify_follows", "upsert", "200"), 1)
+        self.assertEqual(metrics.SUPABASE_LATENCY.count("claim_token_refresh", "rpc"), 1)
+
+    def test_metrics_route(self):
+        client = app.app.test_client()
+        with patch.object(app, "get_custom_playlists", return_value=None), \
+                patch.object(job_queue, "get_job", return_value=None):
+            client.get("/webhook/user-created/nobody")
+        with patch.object(app, "METRICS_TOKEN", "secret"):
+            self.assertEqual(client.get("/metrics").status_code, 401)
+            response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        self.assertIn("# TYPE spotify_request_duration_seconds histogram", response.text)
+        self.assertIn(
+            'http_requests_total{route="/webhook/user-created/<user_id>",method="GET",status="',
+            response.text,
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+# Standard library imports
+import unittest
+from unittest.mock import Mock
+from unittest.mock import patch
+
+# Local imports
+import app
+import job_queue
+
+
+PLAYLISTS = {"individual_playlist": "individual-1", "group_playlist": "group-1"}
+
+
+class TestOnboarding(unittest.TestCase):
+
+    def setUp(self):
+        self.client = app.app.test_client()
+        for target, name, value in (
+            (job_queue, "enqueue_run", None),
+            (job_queue, "complete_job", None),
+            (job_queue, "fail_job", True),
+        ):
+            patcher = patch.object(target, name, return_value=value)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def job(self, status, **fields):
+        return {"run_id": job_queue.ONBOARDING_RUN_ID, "user_id": "user-1", "status": status,
+                "attempts": 1, "last_error": None, **fields}
+
+    def test_retried_webhook_does_not_onboard_again(self):
+        with patch.object(job_queue, "get_job", return_value=self.job("running")), \
+                patch.object(job_queue, "claim_job", return_value=None), \
+                patch.object(app.onboarding_tasks, "submit") as submit:
+            response = self.client.post("/webhook/user-created", json={"user_id": "user-1"})
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json["status"], "running")
+        self.enqueue_run.assert_called_once_with(job_queue.ONBOARDING_RUN_ID, ["user-1"])
+        submit.assert_not_called()
+
+    def test_webhook_reports_finished_onboarding(self):
+        with patch.object(job_queue, "get_job", return_value=self.job("succeeded")), \
+                patch.object(job_queue, "claim_job", return_value=None):
+            response = self.client.post("/webhook/user-created", json={"user_id": "user-1"})
+
+        self.assertEqual(response.json["status"], "success")
+
+    def test_claimed_webhook_onboards_in_background(self):
+        job = self.job("running")
+        with patch.object(job_queue, "get_job", return_value=self.job("pending", attempts=0)), \
+                patch.object(job_queue, "claim_job", return_value=job), \
+                patch.object(app.onboarding_tasks, "submit", return_value=({"status": "queued"}, True)) as submit:
+            response = self.client.post("/webhook/user-created", json={"user_id": "user-1"})
+
+        self.assertEqual(response.json["status"], "queued")
+        self.assertEqual(submit.call_args.args[:3], ("user-1", app.run_onboarding_job, job))
+
+    def test_webhook_restarts_failed_onboarding(self):
+        failed = self.job("failed", attempts=3, last_error="boom")
+        with patch.object(job_queue, "get_job", return_value=failed), \
+                patch.object(job_queue, "reset_job") as reset_job, \
+                patch.object(job_queue, "claim_job", return_value=self.job("running")), \
+                patch.object(app.onboarding_tasks, "submit", return_value=({"status": "queued"}, True)) as submit:
+            response = self.client.post("/webhook/user-created", json={"user_id": "user-1"})
+
+        reset_job.assert_called_once_with(failed)
+        submit.assert_called_once()
+        self.assertEqual(response.json["status"], "queued")
+
+    def test_webhook_errors_are_json(self):
+        response = self.client.post("/webhook/user-created", json={})
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json["status"], "error")
+
+    def test_status_is_success_only_with_both_playlists(self):
+        with patch.object(app, "get_custom_playlists", return_value={"individual_playlist": "individual-1"}), \
+                patch.object(job_queue, "get_job", return_value=self.job("running")):
+            response = self.client.get("/webhook/user-created/user-1")
+
+        self.assertEqual(response.json["status"], "running")
+
+        with patch.object(app, "get_custom_playlists", return_value=PLAYLISTS):
+            response = self.client.get("/webhook/user-created/user-1")
+
+        self.assertEqual(response.json["status"], "success")
+        self.assertEqual(response.json["group_playlist_id"], "group-1")
+
+    def test_status_only_reports_abandoned_onboarding(self):
+        with patch.object(app, "get_custom_playlists", return_value=None), \
+                patch.object(job_queue, "get_job", return_value=self.job("running")), \
+                patch.object(job_queue, "claim_job") as claim_job, \
+                patch.object(app, "onboard_user") as onboard_user:
+            response = self.client.get("/webhook/user-created/user-1")
+
+        claim_job.assert_not_called()
+        onboard_user.assert_not_called()
+        self.assertEqual(response.json["status"], "running")
+
+    def test_failed_onboarding_is_retried_by_the_queue(self):
+        job = {"run_id": job_queue.ONBOARDING_RUN_ID, "user_id": "user-1", "attempts": 1}
+        error = Exception("boom")
+        with patch.object(app, "onboard_user", side_effect=error):
+            with self.assertRaises(Exception):
+                app.run_onboarding_job(job, "worker")
+
+        self.fail_job.assert_called_once_with(job, "worker", error)
+        self.complete_job.assert_not_called()
+
+    def test_sweep_drains_due_onboardings(self):
+        jobs = [{"run_id": job_queue.ONBOARDING_RUN_ID, "user_id": f"user-{i}", "attempts": 1} for i in range(3)]
+        with patch.object(job_queue, "claim_jobs", side_effect=[jobs[:2], jobs[2:], []]), \
+                patch.object(app, "onboard_user", side_effect=[{}, Exception("boom"), {}]):
+            response = self.client.get("/cron/onboarding")
+
+        self.assertEqual(response.json["succeeded"], 2)
+        self.assertEqual(response.json["failed"], 1)
+
+    def test_onboarding_creates_only_missing_playlists(self):
+        supabase = Mock()
+        supabase.table.return_value.select.return_value.eq.return_value.execute.return_value.data = [
+            {"email": "user@example.com"}
+        ]
+        with patch.object(app, "get_supabase", return_value=supabase), \
+                patch.object(app, "get_custom_playlists",
+                             side_effect=[{"individual_playlist": "individual-1"}, PLAYLISTS]), \
+                patch.object(app, "get_user_access_token", return_value="token"), \
+                patch.object(app, "create_and_save_playlist") as create, \
+                patch.object(app, "clear_playlist"), \
+                patch.object(app, "get_user_top_tracks", return_value=[]), \
+                patch.object(app, "add_tracks_to_playlist"):
+            result = app.onboard_user("user-1")
+
+        create.assert_called_once_with("user-1", "user@example.com", "token", playlist_type="group")
+        self.assertEqual(result["group_playlist_id"], "group-1")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,287 @@
+# Standard library imports
+import time
+import random
+import unittest
+from datetime import datetime
+from datetime import timedelta
+from unittest.mock import Mock
+from unittest.mock import patch
+
+# Local imports
+import utils
+from utils import plan_playlist_sync
+
+
+def apply_operations(current, operations):
+    """Simulate Spotify applying the planned edits."""
+    current = list(current)
+    for operation in operations:
+        if operation[0] == "remove":
+            current = [uri for uri in current if uri not in operation[1]]
+        elif operation[0] == "insert":
+            _, position, uris = operation
+            current[position:position] = uris
+        elif operation[0] == "move":
+            _, start, length, insert_before = operation
+            block = current[start:start + length]
+            del current[start:start + length]
+            if insert_before > start:
+                insert_before -= length
+            current[insert_before:insert_before] = block
+    return current
+
+
+class TestPlanPlaylistSync(unittest.TestCase):
+
+    def test_unchanged_playlist_needs_no_writes(self):
+        self.assertEqual(plan_playlist_sync(["a", "b", "c"], ["a", "b", "c"]), [])
+
+    def test_prepend(self):
+        operations = plan_playlist_sync(["a", "b", "c"], ["x", "y", "a", "b", "c"])
+        self.assertEqual(operations, [("insert", 0, ["x", "y"])])
+
+    def test_move_to_top(self):
+        operations = plan_playlist_sync(["a", "b", "c", "d"], ["c", "a", "b", "d"])
+        self.assertEqual(operations, [("move", 2, 1, 0)])
+
+    def test_remove_and_insert(self):
+        operations = plan_playlist_sync(["a", "old", "b"], ["a", "b", "new"])
+        self.assertEqual(operations, [("remove", ["old"]), ("insert", 2, ["new"])])
+
+    def test_duplicates_are_collapsed(self):
+        current = ["a", "b", "a"]
+        operations = plan_playlist_sync(current, ["a", "b"])
+        self.assertEqual(apply_operations(current, operations), ["a", "b"])
+
+    def test_random_playlists_converge(self):
+        rng = random.Random(0)
+        pool = [f"spotify:track:{i}" for i in range(30)]
+        for _ in range(200):
+            current = rng.sample(pool, rng.randint(0, 20))
+            desired = rng.sample(pool, rng.randint(0, 20))
+            operations = plan_playlist_sync(current, desired)
+            self.assertEqual(apply_operations(current, operations), desired)
+
+
+class TestSyncPlaylist(unittest.TestCase):
+
+    def test_writes_are_guarded_with_snapshots(self):
+        client = Mock()
+        client.get.return_value = Mock(json=Mock(return_value={"snapshot_id": "s0"}))
+        client.delete.return_value = Mock(json=Mock(return_value={"snapshot_id": "s1"}))
+        client.post.return_value = Mock(json=Mock(return_value={"snapshot_id": "s2"}))
+
+        with patch.object(utils, "get_spotify_client", return_value=client):
+            summary = utils.sync_playlist(
+                "owner", "playlist", ["new", "a"],
+                insert_access_tokens={"new": "friend"},
+                current_uris=["a", "old"],
+            )
+
+        self.assertEqual(summary, {"removed": 1, "inserted": 1, "moved": 0, "requests": 2})
+        self.assertEqual(client.delete.call_args.kwargs["json"]["snapshot_id"], "s0")
+        self.assertEqual(client.post.call_args.args[1], "friend")
+        self.assertEqual(client.post.call_args.kwargs["json"], {"uris": ["new"], "position": 0})
+
+    def test_guarded_removal_chunks_are_chained(self):
+        # Earlier chunks take longer, so chunks sent at the same time would
+        # finish out of order.
+        def delete(path, access_token, json):
+            time.sleep(0.01 * (3 - int(json["tracks"][0]["uri"].split(":")[-1]) // 100))
+            return Mock(json=Mock(return_value={"snapshot_id": json["snapshot_id"] + "+"}))
+
+        client = Mock()
+        client.delete.side_effect = delete
+        uris = [f"spotify:track:{i}" for i in range(250)]
+
+        with patch.object(utils, "get_spotify_client", return_value=client):
+            snapshot_id = utils.remove_tracks_from_playlist("token", "playlist", uris, "s0")
+
+        sent = [call.kwargs["json"]["snapshot_id"] for call in client.delete.call_args_list]
+        self.assertEqual(sent, ["s0", "s0+", "s0++"])
+        self.assertEqual(snapshot_id, "s0+++")
+
+    def test_unguarded_removal_chunks_have_no_final_snapshot(self):
+        client = Mock()
+        client.delete.return_value = Mock(json=Mock(return_value={"snapshot_id": "s"}))
+        uris = [f"spotify:track:{i}" for i in range(250)]
+
+        with patch.object(utils, "get_spotify_client", return_value=client):
+            snapshot_id = utils.remove_tracks_from_playlist("token", "playlist", uris)
+
+        self.assertEqual(client.delete.call_count, 3)
+        self.assertIsNone(snapshot_id)
+
+    def test_plan_packs_inserts_by_token_and_limit(self):
+        friend_uris = [f"friend:{i}" for i in range(150)]
+        client = Mock()
+
+        with patch.object(utils, "get_spotify_client", return_value=client):
+            plan = utils.plan_playlist_update(
+                "owner", "playlist", ["mine", *friend_uris],
+                insert_access_tokens=dict.fromkeys(friend_uris, "friend"),
+                contents=("s0", []),
+            )
+
+        self.assertEqual(
+            [(write[1], len(write[2]), write[3]) for write in plan["writes"]],
+            [(0, 1, "owner"), (1, 100, "friend"), (101, 50, "friend")],
+        )
+        self.assertEqual((plan["inserted"], plan["requests"]), (151, 3))
+        self.assertEqual(client.method_calls, [])
+
+    def test_unchanged_playlist_is_planned_without_writes(self):
+        plan = utils.plan_playlist_update("owner", "playlist", ["a", "b"], contents=("s0", ["a", "b"]))
+
+        self.assertEqual((plan["writes"], plan["requests"]), ([], 0))
+
+
+class TestChunkedWrites(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Mock()
+        self.client.post.return_value = Mock(json=Mock(return_value={"snapshot_id": "s"}))
+        self.client.delete.return_value = Mock(json=Mock(return_value={"snapshot_id": "s"}))
+        patcher = patch.object(utils, "get_spotify_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(utils.invalidate_playlist_cache)
+
+    def test_add_sends_every_chunk_in_order(self):
+        uris = [f"spotify:track:{i}" for i in range(250)]
+        utils.add_tracks_to_playlist("token", "playlist", uris, position=0)
+
+        bodies = [call.kwargs["json"] for call in self.client.post.call_args_list]
+        self.assertEqual([body["position"] for body in bodies], [0, 100, 200])
+        self.assertEqual(sum((body["uris"] for body in bodies), []), uris)
+
+    def test_clear_reads_every_page(self):
+        pages = [
+            [{"track": {"uri": f"spotify:track:{i}"}} for i in range(100)],
+            [{"track": {"uri": f"spotify:track:{i}"}} for i in range(100, 130)],
+        ]
+        self.client.get.side_effect = [Mock(json=Mock(return_value={"snapshot_id": "s0"}))] + [
+            Mock(status_code=200, json=Mock(return_value={"items": page})) for page in pages
+        ]
+
+        self.assertTrue(utils.clear_playlist("token", "playlist"))
+
+        removed = [
+            track["uri"]
+            for call in self.client.delete.call_args_list
+            for track in call.kwargs["json"]["tracks"]
+        ]
+        self.assertEqual(self.client.delete.call_count, 2)
+        self.assertEqual(sorted(removed), sorted(f"spotify:track:{i}" for i in range(130)))
+
+
+class TestPlaylistCache(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Mock()
+        self.snapshot = "s0"
+        self.page_reads = 0
+
+        def get(path, access_token, params=None, cache=True):
+            if path == "/playlists/playlist":
+                return Mock(json=Mock(return_value={"snapshot_id": self.snapshot}))
+            # Pages are cached by snapshot only, not by the ETag cache.
+            assert not cache
+            self.page_reads += 1
+            items = [{"track": {"uri": uri}} for uri in ("a", "b", "c")]
+            return Mock(status_code=200, json=Mock(return_value={"items": items}))
+
+        self.client.get.side_effect = get
+        patcher = patch.object(utils, "get_spotify_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        utils.invalidate_playlist_cache()
+        self.addCleanup(utils.invalidate_playlist_cache)
+
+    def test_items_are_reread_only_when_snapshot_changes(self):
+        self.assertEqual(utils.get_playlist_track_uris("token", "playlist"), ["a", "b", "c"])
+        self.assertEqual(len(utils.get_playlist_tracks("token", "playlist")), 3)
+        self.assertEqual(self.page_reads, 1)
+
+        self.snapshot = "s1"
+        utils.get_playlist_track_uris("token", "playlist")
+        self.assertEqual(self.page_reads, 2)
+
+    def test_own_writes_update_or_invalidate(self):
+        self.client.delete.return_value = Mock(json=Mock(return_value={"snapshot_id": "s1"}))
+        self.client.post.return_value = Mock(json=Mock(return_value={"snapshot_id": "s2"}))
+        utils.get_playlist_track_uris("token", "playlist")
+
+        # Our removal is applied to the cached items instead of re-reading them.
+        utils.remove_tracks_from_playlist("token", "playlist", ["b"], "s0")
+        self.snapshot = "s1"
+        self.assertEqual(utils.get_playlist_track_uris("token", "playlist"), ["a", "c"])
+        self.assertEqual(self.page_reads, 1)
+
+        # Added tracks aren't known in full, so the entry is dropped.
+        utils.add_tracks_to_playlist("token", "playlist", ["d"])
+        self.snapshot = "s2"
+        utils.get_playlist_track_uris("token", "playlist")
+        self.assertEqual(self.page_reads, 2)
+
+
+    def test_cache_is_bounded_by_items(self):
+        with patch.object(utils, "PLAYLIST_CACHE_MAX_ITEMS", 3):
+            utils.get_playlist_track_uris("token", "playlist")
+            utils._cache_playlist_items("other", "s0", [{"track": {"uri": "x"}}])
+            # The oldest playlist made room for the new one.
+            utils.get_playlist_track_uris("token", "playlist")
+            self.assertEqual(self.page_reads, 2)
+
+        utils.invalidate_playlist_cache()
+        with patch.object(utils, "PLAYLIST_CACHE_MAX_ITEMS", 2):
+            utils.get_playlist_track_uris("token", "playlist")
+            utils.get_playlist_track_uris("token", "playlist")
+            # Too large to cache at all.
+            self.assertEqual(self.page_reads, 4)
+        self.assertEqual(utils._playlist_cache_items, 0)
+
+
+class TestRecentAdditions(unittest.TestCase):
+
+    def setUp(self):
+        utils.invalidate_playlist_cache()
+        now = datetime.now()
+        # 250 tracks; the last 20 were added this week, every other one by "me".
+        self.items = [
+            {
+                "added_at": (now - timedelta(days=30 if i < 230 else 1, minutes=-i)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "added_by": {"id": "me" if i % 2 else "friend"},
+                "track": {"name": f"t{i}", "artists": [{"name": "a"}], "uri": f"spotify:track:{i}"},
+            }
+            for i in range(250)
+        ]
+        self.client = Mock()
+
+        def get(path, access_token, params=None, cache=True):
+            if path == "/playlists/playlist":
+                return Mock(json=Mock(return_value={"snapshot_id": "s0", "tracks": {"total": 250}}))
+            offset, limit = params["offset"], params["limit"]
+            return Mock(json=Mock(return_value={"items": self.items[offset:offset + limit]}))
+
+        self.client.get.side_effect = get
+        patcher = patch.object(utils, "get_spotify_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_only_the_last_page(self):
+        additions = utils.get_recent_additions_by_user("token", "playlist", spotify_id="me")
+
+        self.assertEqual([track["uri"] for track in additions], [f"spotify:track:{i}" for i in (249, 247, 245)])
+        self.assertEqual(self.client.get.call_count, 2)
+        self.assertEqual(self.client.get.call_args.kwargs["params"], {"offset": 150, "limit": 100})
+
+    def test_stops_at_a_page_without_recent_additions(self):
+        additions = utils.get_recent_additions_by_user("token", "playlist", limit=50, spotify_id="me")
+
+        self.assertEqual(len(additions), 10)
+        self.assertEqual(self.client.get.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
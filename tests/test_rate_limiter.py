@@ -0,0 +1,100 @@
+# Standard library imports
+import time
+import asyncio
+import unittest
+from unittest.mock import Mock
+from unittest.mock import patch
+
+# Local imports
+from rate_limiter import RateLimiter
+from rate_limiter import parse_retry_after
+from spotify_client import SpotifyClient
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_token_bucket_limits_rate(self):
+        limiter = RateLimiter(rate=50, burst=1, max_concurrency=10)
+
+        start = time.monotonic()
+        for _ in range(6):
+            with limiter.slot():
+                pass
+        elapsed = time.monotonic() - start
+
+        # One token is available immediately, the other five take 1/50s each.
+        self.assertGreaterEqual(elapsed, 0.09)
+
+    def test_throttling_shrinks_concurrency_and_blocks(self):
+        limiter = RateLimiter(rate=1000, burst=100, max_concurrency=8)
+
+        with limiter.slot() as outcome:
+            outcome["throttled"] = True
+            outcome["retry_after"] = 0.1
+
+        self.assertEqual(limiter.stats()["concurrency_limit"], 4)
+        self.assertEqual(limiter.stats()["throttled"], 1)
+
+        start = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+        limiter.release()
+
+    def test_successes_grow_concurrency_back(self):
+        limiter = RateLimiter(rate=1000, burst=1000, max_concurrency=4, min_concurrency=1)
+        limiter.acquire()
+        limiter.release(throttled=True)
+        self.assertEqual(limiter.stats()["concurrency_limit"], 2)
+
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release()
+        self.assertEqual(limiter.stats()["concurrency_limit"], 4)
+
+    def test_async_slot(self):
+        limiter = RateLimiter(rate=1000, burst=10, max_concurrency=2)
+
+        async def request():
+            async with limiter.async_slot():
+                await asyncio.sleep(0.01)
+                return limiter.stats()["in_flight"]
+
+        async def main():
+            return await asyncio.gather(*(request() for _ in range(6)))
+
+        self.assertLessEqual(max(asyncio.run(main())), 2)
+        self.assertEqual(limiter.stats()["requests"], 6)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("3"), 3.0)
+        self.assertEqual(parse_retry_after(None, default=2), 2)
+
+
+class TestClientRetries(unittest.TestCase):
+
+    def test_retries_throttled_requests(self):
+        client = SpotifyClient(limiter=RateLimiter(rate=1000, burst=100), max_retries=2)
+        throttled = Mock(status_code=429, headers={"Retry-After": "0"})
+        ok = Mock(status_code=200, headers={})
+
+        with patch.object(client.session, "request", side_effect=[throttled, ok]) as request:
+            response = client.get("/me", "token")
+
+        self.assertIs(response, ok)
+        self.assertEqual(request.call_count, 2)
+        self.assertEqual(client.limiter.stats()["retried"], 1)
+        self.assertEqual(client.limiter.stats()["throttled"], 1)
+
+    def test_gives_up_after_max_retries(self):
+        client = SpotifyClient(limiter=RateLimiter(rate=1000, burst=100), max_retries=1)
+        throttled = Mock(status_code=429, headers={"Retry-After": "0"})
+
+        with patch.object(client.session, "request", return_value=throttled) as request:
+            response = client.get("/me", "token")
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(request.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
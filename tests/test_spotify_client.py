@@ -0,0 +1,48 @@
+# Standard library imports
+import unittest
+from unittest.mock import Mock
+from unittest.mock import patch
+
+# Local imports
+from spotify_client import SpotifyClient
+from spotify_client import get_spotify_client
+
+
+class TestSpotifyClient(unittest.TestCase):
+
+    def setUp(self):
+        self.client = SpotifyClient(base_url="https://api.example.com/v1")
+
+    def test_build_headers(self):
+        headers = SpotifyClient.build_headers("abc")
+        self.assertEqual(headers["Authorization"], "Bearer abc")
+        self.assertEqual(headers["Content-Type"], "application/json")
+
+        # Extra headers override the defaults.
+        headers = SpotifyClient.build_headers(
+            extra={"Content-Type": "application/x-www-form-urlencoded"}
+        )
+        self.assertNotIn("Authorization", headers)
+        self.assertEqual(headers["Content-Type"], "application/x-www-form-urlencoded")
+
+    def test_url_resolution(self):
+        self.assertEqual(self.client.url("/me"), "https://api.example.com/v1/me")
+        self.assertEqual(self.client.url("me/top/tracks"), "https://api.example.com/v1/me/top/tracks")
+        self.assertEqual(self.client.url("https://other.com/x"), "https://other.com/x")
+
+    def test_requests_share_one_session(self):
+        with patch.object(self.client.session, "request", return_value=Mock(status_code=200)) as request:
+            self.client.get("/me", "abc")
+            self.client.post("/users/1/playlists", "abc", json={})
+
+        self.assertEqual(request.call_count, 2)
+        method, url = request.call_args_list[0].args
+        self.assertEqual((method, url), ("GET", "https://api.example.com/v1/me"))
+        self.assertEqual(request.call_args_list[0].kwargs["timeout"], self.client.timeout)
+
+    def test_shared_client_is_singleton(self):
+        self.assertIs(get_spotify_client(), get_spotify_client())
+
+
+if __name__ == '__main__':
+    unittest.main()
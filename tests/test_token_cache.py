@@ -0,0 +1,150 @@
+# Standard library imports
+import time
+import threading
+import unittest
+from datetime import datetime
+from datetime import timezone
+from unittest.mock import Mock
+from unittest.mock import patch
+
+# Local imports
+import utils
+
+
+def token_row(access_token, expires_at, spotify_id="spotify-1"):
+    return {
+        "user_id": "user-1",
+        "access_token": access_token,
+        "refresh_token": "refresh",
+        "expires_at": datetime.fromtimestamp(expires_at, tz=timezone.utc).isoformat(),
+        "spotify_id": spotify_id,
+    }
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        utils.clear_token_cache()
+        self.supabase = Mock()
+        patcher = patch.object(utils, "get_supabase", return_value=self.supabase)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(utils.clear_token_cache)
+
+    def set_row(self, row):
+        query = self.supabase.table.return_value.select.return_value.eq.return_value
+        query.execute.return_value = Mock(data=[row])
+
+    def test_valid_token_is_cached(self):
+        self.set_row(token_row("valid", time.time() + 3600))
+
+        with patch.object(utils, "refresh_access_token") as refresh:
+            self.assertEqual(utils.get_user_access_token("user-1"), "valid")
+            self.assertEqual(utils.get_user_access_token("user-1"), "valid")
+
+        refresh.assert_not_called()
+        self.assertEqual(self.supabase.table.call_count, 1)
+
+    def test_token_near_expiry_is_refreshed(self):
+        self.set_row(token_row("stale", time.time() + 10))
+
+        new_tokens = {"access_token": "fresh", "expires_in": 3600}
+        with patch.object(utils, "refresh_access_token", return_value=new_tokens):
+            self.assertEqual(utils.get_user_access_token("user-1"), "fresh")
+
+        update = self.supabase.table.return_value.update.call_args.args[0]
+        self.assertEqual(update["access_token"], "fresh")
+        self.assertIn("expires_at", update)
+
+    def test_unauthorized_fallback_refreshes_owner(self):
+        self.set_row(token_row("revoked", time.time() + 3600))
+        utils.get_user_access_token("user-1")
+
+        new_tokens = {"access_token": "fresh", "expires_in": 3600}
+        with patch.object(utils, "refresh_access_token", return_value=new_tokens):
+            self.assertEqual(utils.refresh_unauthorized_token("revoked"), "fresh")
+            self.assertIsNone(utils.refresh_unauthorized_token("unknown"))
+
+        self.assertEqual(utils.get_user_access_token("user-1"), "fresh")
+
+    def test_concurrent_refreshes_are_coalesced(self):
+        self.set_row(token_row("stale", time.time() + 10))
+
+        def slow_refresh(*args):
+            time.sleep(0.1)
+            return {"access_token": "fresh", "expires_in": 3600}
+
+        tokens = []
+        with patch.object(utils, "refresh_access_token", side_effect=slow_refresh) as refresh:
+            threads = [
+                threading.Thread(target=lambda: tokens.append(utils.get_user_access_token("user-1")))
+                for _ in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(tokens, ["fresh"] * 5)
+        refresh.assert_called_once()
+        self.supabase.table.return_value.update.assert_called_once()
+        # The write only replaces the token that was refreshed.
+        self.supabase.table.return_value.update.return_value.eq.return_value.eq.assert_called_once_with(
+            "access_token", "stale"
+        )
+
+    def test_waits_for_refresh_by_another_worker(self):
+        # The row is read once before the refresh and then polled.
+        query = self.supabase.table.return_value.select.return_value.eq.return_value
+        query.execute.side_effect = [
+            Mock(data=[token_row("stale", time.time() + 10)]),
+            Mock(data=[token_row("stale", time.time() + 10)]),
+            Mock(data=[token_row("theirs", time.time() + 3600)]),
+        ]
+        self.supabase.rpc.return_value.execute.return_value = Mock(data=False)
+
+        with patch.object(utils, "refresh_access_token") as refresh, \
+                patch.object(utils, "TOKEN_REFRESH_POLL_SECONDS", 0.01):
+            self.assertEqual(utils.get_user_access_token("user-1"), "theirs")
+            self.assertEqual(utils.get_user_access_token("user-1"), "theirs")
+
+        refresh.assert_not_called()
+        self.supabase.table.return_value.update.assert_not_called()
+
+    def test_failed_refresh_releases_lease(self):
+        self.set_row(token_row("stale", time.time() + 10))
+        self.supabase.rpc.return_value.execute.return_value = Mock(data=True)
+
+        with patch.object(utils, "refresh_access_token", side_effect=Exception("invalid_grant")):
+            with self.assertRaises(Exception):
+                utils.get_user_access_token("user-1")
+
+        update = self.supabase.table.return_value.update
+        update.assert_called_once_with({"refresh_locked_until": None})
+        update.return_value.eq.return_value.eq.assert_called_once_with("access_token", "stale")
+
+    def test_first_refresh_saves_spotify_id(self):
+        self.set_row(token_row("stale", time.time() + 10, spotify_id=None))
+
+        new_tokens = {"access_token": "fresh", "expires_in": 3600}
+        with patch.object(utils, "refresh_access_token", return_value=new_tokens), \
+                patch.object(utils, "get_user_profile", return_value={"id": "spotify-1"}) as profile:
+            utils.get_user_access_token("user-1")
+            self.assertEqual(utils.get_spotify_user_id("user-1"), "spotify-1")
+
+        profile.assert_called_once_with("fresh")
+        update = self.supabase.table.return_value.update.call_args.args[0]
+        self.assertEqual(update["spotify_id"], "spotify-1")
+
+    def test_spotify_id_comes_from_prefetched_rows(self):
+        index = utils.UserTableIndex([token_row("valid", time.time() + 3600)], [])
+        with utils.prefetched_user_tables(index), \
+                patch.object(utils, "get_user_profile") as profile:
+            self.assertEqual(utils.get_spotify_user_id("user-1", "valid"), "spotify-1")
+
+        profile.assert_not_called()
+        self.supabase.table.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
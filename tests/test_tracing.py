@@ -0,0 +1,86 @@
+# Standard library imports
+import asyncio
+import unittest
+import contextvars
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+
+# Local imports
+import utils
+import update_group_playlists
+from tracing import RunReport
+from tracing import stage
+from tracing import count_request
+from tracing import percentile
+
+
+class TestRunReport(unittest.TestCase):
+
+    def test_stages_record_time_and_requests(self):
+        report = RunReport()
+        with report.trace("user-1"):
+            with stage("token"):
+                count_request("supabase")
+            for _ in range(2):
+                with stage("fan_in"):
+                    count_request("spotify")
+                    # Work handed to another thread counts when it runs in a
+                    # copy of this context.
+                    with ThreadPoolExecutor(max_workers=1) as executor:
+                        executor.submit(contextvars.copy_context().run, count_request, "spotify").result()
+        count_request("spotify")  # Outside the run's users: not counted.
+
+        summary = report.summary()
+
+        self.assertEqual(summary["users"], 1)
+        self.assertEqual(summary["requests"], {"spotify": 4, "supabase": 1})
+        self.assertEqual(summary["stages"]["fan_in"]["count"], 2)
+        self.assertEqual(summary["stages"]["fan_in"]["spotify"], 4)
+        self.assertEqual(summary["stages"]["token"]["supabase"], 1)
+        self.assertEqual(set(summary["slowest_users"][0]["stages"]), {"token", "fan_in"})
+
+    def test_failures_are_counted_by_type_and_reraised(self):
+        report = RunReport(slowest=1)
+        for user_id, error in (("a", KeyError), ("b", KeyError), ("c", ValueError)):
+            with self.assertRaises(error), report.trace(user_id):
+                raise error()
+        with report.trace("d"):
+            pass
+
+        summary = report.summary()
+
+        self.assertEqual(summary["failures"], {"KeyError": 2, "ValueError": 1})
+        self.assertEqual(len(summary["slowest_users"]), 1)
+
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3, 1, 2], 99), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_stage_is_a_noop_outside_a_trace(self):
+        with stage("token"):
+            count_request("spotify")
+
+    def test_cron_summary_includes_the_report(self):
+        users = [{"user_id": f"user-{i}", "email": f"user-{i}@example.com"} for i in range(4)]
+        index = utils.UserTableIndex(users, [])
+
+        def fake_custom_playlists(user_id):
+            if user_id == "user-3":
+                raise ConnectionError("boom")
+            return None
+
+        with patch.object(utils.UserTableIndex, "load", return_value=index), \
+                patch.object(update_group_playlists, "get_custom_playlists", side_effect=fake_custom_playlists):
+            summary = asyncio.run(update_group_playlists.run_update_playlists_async(concurrency=2))
+
+        report = summary["report"]
+        self.assertEqual(report["users"], 4)
+        self.assertEqual(report["stages"]["playlists"]["users"], 4)
+        self.assertEqual(report["failures"], {"ConnectionError": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,349 @@
+# Standard library imports
+import os
+import json
+import time
+import asyncio
+import threading
+import contextvars
+import unittest
+from unittest.mock import Mock
+from unittest.mock import patch
+
+# Local imports
+import utils
+import update_group_playlists
+
+
+USERS = [{"user_id": f"user-{i}", "email": f"user-{i}@example.com"} for i in range(10)]
+
+
+def prefetch(users=USERS, playlists=()):
+    index = utils.UserTableIndex(users, playlists)
+    return patch.object(utils.UserTableIndex, "load", return_value=index)
+
+
+class TestAsyncEngine(unittest.TestCase):
+
+    def test_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        in_flight = []
+        peak = []
+
+        def fake_update(i, user, report=None):
+            with lock:
+                in_flight.append(user["user_id"])
+                peak.append(len(in_flight))
+            time.sleep(0.02)
+            with lock:
+                in_flight.remove(user["user_id"])
+            return True
+
+        with prefetch(), \
+                patch.object(update_group_playlists, "update_user_playlists", side_effect=fake_update) as update:
+            asyncio.run(update_group_playlists.run_update_playlists_async(concurrency=3))
+
+        self.assertEqual(update.call_count, len(USERS))
+        self.assertLessEqual(max(peak), 3)
+        self.assertGreater(max(peak), 1)
+
+    def test_failures_are_isolated(self):
+        # A user whose update raises inside is logged and reported as failed,
+        # without stopping the other users.
+        def fake_custom_playlists(user_id):
+            if user_id == "user-3":
+                raise Exception("boom")
+            return None
+
+        with prefetch(), \
+                patch.object(update_group_playlists, "get_custom_playlists", side_effect=fake_custom_playlists):
+            with self.assertLogs("spotifriends", level="INFO") as logs:
+                asyncio.run(update_group_playlists.run_update_playlists_async(concurrency=4))
+
+        self.assertTrue(any("Updated 9/10 users successfully" in line for line in logs.output))
+
+
+class TestSharding(unittest.TestCase):
+
+    def test_shards_partition_users(self):
+        users = [{"user_id": f"user-{i}"} for i in range(200)]
+        shards = [update_group_playlists.get_shard_users(users, shard, 4) for shard in range(4)]
+
+        seen = [user["user_id"] for shard in shards for user in shard]
+        self.assertEqual(sorted(seen), sorted(user["user_id"] for user in users))
+        self.assertTrue(all(shards))
+
+    def test_assignment_is_stable(self):
+        self.assertEqual(
+            update_group_playlists.user_shard("37e96704-ec5a-4324-b0e3-af03672831f6", 8),
+            update_group_playlists.user_shard("37e96704-ec5a-4324-b0e3-af03672831f6", 8),
+        )
+        with self.assertRaises(ValueError):
+            update_group_playlists.get_shard_users(USERS, 2, 2)
+
+    def test_shard_reports_counts(self):
+        with prefetch(), patch.object(update_group_playlists, "update_user_playlists", return_value=True):
+            summary = update_group_playlists.run_update_playlists_concurrently(2, shard=1, num_shards=3)
+
+        expected = len(update_group_playlists.get_shard_users(USERS, 1, 3))
+        summary.pop("report")
+        self.assertEqual(
+            summary,
+            {"shard": 1, "of": 3, "users": expected, "succeeded": expected, "failed": 0, "remaining": 0},
+        )
+
+
+class TestRunBudget(unittest.TestCase):
+
+    def run_with_budget(self, cursor, concurrency):
+        calls = []
+
+        def fake_update(i, user, report=None):
+            calls.append(user["user_id"])
+            # The budget runs out while the third user is being updated.
+            if len(calls) == 3:
+                time.sleep(0.2)
+            return True
+
+        with prefetch(), \
+                patch.object(update_group_playlists, "CRON_BUDGET_MARGIN", 0), \
+                patch.object(update_group_playlists, "load_cursor", return_value=cursor), \
+                patch.object(update_group_playlists, "save_cursor") as save, \
+                patch.object(update_group_playlists, "update_user_playlists", side_effect=fake_update):
+            summary = update_group_playlists.run_update_playlists_concurrently(
+                concurrency, time_budget=0.1
+            )
+        return calls, summary, save
+
+    def test_stops_and_saves_cursor(self):
+        calls, summary, save = self.run_with_budget(None, concurrency=1)
+
+        self.assertEqual(calls, ["user-0", "user-1", "user-2"])
+        self.assertEqual(summary["remaining"], 7)
+        name, run_id, last_user_id = save.call_args.args
+        self.assertEqual(last_user_id, "user-2")
+        self.assertFalse(save.call_args.kwargs["completed"])
+
+    def test_resumes_after_cursor(self):
+        cursor = {"run_id": update_group_playlists.current_run_id(), "last_user_id": "user-6", "completed_at": None}
+        calls, summary, save = self.run_with_budget(cursor, concurrency=2)
+
+        self.assertEqual(calls, ["user-7", "user-8", "user-9"])
+        self.assertTrue(save.call_args.kwargs["completed"])
+
+    def test_cursor_is_saved_while_running(self):
+        cursor = {"run_id": update_group_playlists.current_run_id(), "last_user_id": None, "completed_at": None}
+        with patch.object(update_group_playlists, "CRON_CHECKPOINT_USERS", 2):
+            calls, summary, save = self.run_with_budget(cursor, concurrency=1)
+
+        checkpoints = [call.args[2] for call in save.call_args_list[:-1]]
+        self.assertEqual(checkpoints, ["user-1"])
+        self.assertEqual(save.call_args.args[2], "user-2")
+
+    def test_checkpoint_waits_for_users_in_progress(self):
+        users = [{"user_id": f"user-{i}"} for i in range(3)]
+        with patch.object(update_group_playlists, "CRON_CHECKPOINT_USERS", 1), \
+                patch.object(update_group_playlists, "load_cursor", return_value=None), \
+                patch.object(update_group_playlists, "save_cursor") as save:
+            budget = update_group_playlists.RunBudget(time_budget=100)
+            budget.user_finished(users, 1)
+            save.assert_not_called()
+            budget.user_finished(users, 0)
+
+        self.assertEqual(save.call_args.args[2], "user-1")
+
+    def test_checkpoint_is_written_outside_the_lock(self):
+        users = [{"user_id": f"user-{i}"} for i in range(3)]
+        writing, release = threading.Event(), threading.Event()
+
+        def slow_save(*args, **kwargs):
+            writing.set()
+            release.wait(5)
+
+        with patch.object(update_group_playlists, "CRON_CHECKPOINT_USERS", 1), \
+                patch.object(update_group_playlists, "load_cursor", return_value=None), \
+                patch.object(update_group_playlists, "save_cursor", side_effect=slow_save) as save:
+            budget = update_group_playlists.RunBudget(time_budget=100)
+            writer = threading.Thread(target=budget.user_finished, args=(users, 0))
+            writer.start()
+            writing.wait(5)
+            # Doesn't wait for the write in flight, nor start a second one.
+            budget.user_finished(users, 1)
+            release.set()
+            writer.join()
+
+        save.assert_called_once()
+
+    def test_budget_defaults_to_function_max_duration(self):
+        with open(os.path.join(os.path.dirname(__file__), "..", "vercel.json")) as f:
+            build, = json.load(f)["builds"]
+        self.assertEqual(build["config"]["maxDuration"], update_group_playlists.FUNCTION_MAX_DURATION)
+
+    def test_completed_run_does_nothing(self):
+        cursor = {"run_id": update_group_playlists.current_run_id(), "last_user_id": "user-9", "completed_at": "now"}
+        calls, summary, save = self.run_with_budget(cursor, concurrency=2)
+
+        self.assertEqual(calls, [])
+        save.assert_not_called()
+
+
+class TestTopTracksMemo(unittest.TestCase):
+
+    def test_computed_once_per_user_within_run(self):
+        with patch.object(utils, "_get_top_tracks_and_recs", return_value=["uri:1"]) as compute:
+            with utils.top_tracks_memo():
+                threads = [
+                    threading.Thread(
+                        target=contextvars.copy_context().run,
+                        args=(utils.get_top_tracks_and_recs, "user-1", "token"),
+                    )
+                    for _ in range(5)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(utils.get_top_tracks_and_recs("user-2", "token"), ["uri:1"])
+
+                # Threads outside the run (e.g. requests) don't use its memo.
+                other = threading.Thread(target=utils.get_top_tracks_and_recs, args=("user-1", "token"))
+                other.start()
+                other.join()
+
+            # Outside of a run nothing is memoized.
+            utils.get_top_tracks_and_recs("user-1", "token")
+
+        self.assertEqual(compute.call_count, 4)
+
+    def test_failure_is_not_memoized(self):
+        outcomes = [Exception("Spotify returned 502"), ["uri:1"]]
+        with patch.object(utils, "_get_top_tracks_and_recs", side_effect=outcomes) as compute:
+            with utils.top_tracks_memo():
+                with self.assertRaises(Exception):
+                    utils.get_top_tracks_and_recs("user-1", "token")
+                self.assertEqual(utils.get_top_tracks_and_recs("user-1", "token"), ["uri:1"])
+                self.assertEqual(utils.get_top_tracks_and_recs("user-1", "token"), ["uri:1"])
+
+        self.assertEqual(compute.call_count, 2)
+
+
+class TestUserTableIndex(unittest.TestCase):
+
+    def test_lookups_use_prefetched_rows(self):
+        playlists = [
+            {"user_id": "user-1", "individual_playlist": "p1", "group_playlist": "g1"},
+            {"user_id": "user-2", "individual_playlist": "p2", "group_playlist": "g2"},
+        ]
+        with prefetch(playlists=playlists), patch.object(utils, "get_supabase") as get_supabase:
+            with utils.prefetched_user_tables():
+                self.assertEqual(utils.get_custom_playlists("user-2")["group_playlist"], "g2")
+                self.assertIsNone(utils.get_custom_playlists("user-3"))
+                owners = utils.get_users_by_individual_playlists(["p2", "unknown", "p1", "p2"])
+
+        get_supabase.assert_not_called()
+        self.assertEqual([owner["user_id"] for owner in owners], ["user-2", "user-1"])
+
+    def test_index_is_only_seen_within_the_run(self):
+        playlists = [{"user_id": "user-1", "individual_playlist": "p1", "group_playlist": "g1"}]
+        seen = {}
+
+        def lookup(name):
+            seen[name] = utils.get_custom_playlists("user-1")
+
+        with prefetch(playlists=playlists), patch.object(utils, "get_supabase") as get_supabase:
+            get_supabase.return_value.table.return_value.select.return_value.eq.return_value\
+                .execute.return_value = Mock(data=[])
+            with utils.prefetched_user_tables():
+                # e.g. a request handled while the cron runs
+                other = threading.Thread(target=lookup, args=("other thread",))
+                worker = threading.Thread(target=contextvars.copy_context().run, args=(lookup, "run worker"))
+                for thread in (other, worker):
+                    thread.start()
+                    thread.join()
+
+        self.assertIsNone(seen["other thread"])
+        self.assertEqual(seen["run worker"]["group_playlist"], "g1")
+
+    def test_select_all_paginates(self):
+        pages = [Mock(data=[{"user_id": i} for i in range(2)]), Mock(data=[{"user_id": 2}])]
+        with patch.object(utils, "get_supabase") as get_supabase:
+            query = get_supabase.return_value.table.return_value.select.return_value.order.return_value
+            query.range.return_value.execute.side_effect = pages
+            rows = utils.select_all("spotify_tokens", page_size=2)
+
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(query.range.call_args_list[1].args, (2, 3))
+
+
+class TestPlaylistPlans(unittest.TestCase):
+
+    def setUp(self):
+        playlists = {"group_playlist": "group", "individual_playlist": "mine"}
+        contents = {"group": ("g0", ["old", "a"]), "mine": ("m0", ["a", "b"])}
+        for name, value in (
+            ("get_custom_playlists", Mock(return_value=playlists)),
+            ("get_user_access_token", Mock(side_effect=lambda user_id: f"token-{user_id}")),
+            ("get_top_tracks_and_recs", Mock(side_effect=lambda user_id, token: {"user-1": ["a", "b"], "user-2": ["c"]}[user_id])),
+            ("get_followed_user_ids", Mock(return_value=["user-2"])),
+            ("get_playlist_snapshot_and_uris", Mock(side_effect=lambda token, playlist_id: contents[playlist_id])),
+        ):
+            patcher = patch.object(update_group_playlists, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_plan_reads_both_playlists_before_any_write(self):
+        with patch.object(utils, "get_spotify_client") as client:
+            plans = update_group_playlists.plan_user_playlists("user-1")
+
+        client.assert_not_called()
+        group, mine = plans
+        self.assertEqual((group["kind"], group["snapshot_id"]), ("group", "g0"))
+        self.assertEqual(
+            group["writes"],
+            [("remove", ["old"]), ("insert", 1, ["b"], "token-user-1"), ("insert", 2, ["c"], "token-user-2")],
+        )
+        self.assertEqual((mine["writes"], mine["requests"]), ([], 0))
+
+    def test_execute_skips_unchanged_and_duplicate_plans(self):
+        plans = update_group_playlists.plan_user_playlists("user-1")
+        stale = dict(plans[0], writes=[("remove", ["a"])])
+
+        with patch.object(update_group_playlists, "apply_playlist_plan", return_value={"requests": 3}) as apply:
+            with self.assertLogs("spotifriends", level="WARNING"):
+                requests = update_group_playlists.execute_playlist_plans([stale, *plans])
+
+        apply.assert_called_once_with(plans[0])
+        self.assertEqual(requests, 3)
+
+
+class TestFollowGraph(unittest.TestCase):
+
+    def setUp(self):
+        follows = [
+            {"follower_id": "user-1", "following_id": "user-2"},
+            {"follower_id": "user-1", "following_id": "user-3"},
+            {"follower_id": "user-2", "following_id": "user-1"},
+        ]
+        self.index = utils.UserTableIndex(USERS, [], follows)
+
+    def test_adjacency_list(self):
+        with utils.prefetched_user_tables(self.index):
+            self.assertEqual(utils.get_followed_user_ids("user-1"), ["user-2", "user-3"])
+            self.assertEqual(utils.get_followed_user_ids("user-4"), [])
+
+    def test_reconcile_adds_and_removes_edges(self):
+        with patch.object(update_group_playlists, "get_user_access_token", return_value="token"), \
+                patch.object(update_group_playlists, "get_followed_user_ids_from_spotify", return_value=["user-2", "user-4"]), \
+                patch.object(update_group_playlists, "get_supabase") as get_supabase:
+            added, removed = update_group_playlists.reconcile_user_follows("user-1", self.index)
+
+        supabase = get_supabase.return_value
+        self.assertEqual((added, removed), (1, 1))
+        supabase.table.return_value.upsert.assert_called_once_with(
+            [{"follower_id": "user-1", "following_id": "user-4"}]
+        )
+        delete = supabase.table.return_value.delete.return_value.eq.return_value
+        delete.in_.assert_called_once_with("following_id", ["user-3"])
+
+
+if __name__ == '__main__':
+    unittest.main()
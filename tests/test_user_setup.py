@@ -73,6 +73,20 @@ class TestUserCreationWebhook(unittest.TestCase):
     def setUp(self):
         pass
 
+    def wait_for_onboarding(self, timeout=30):
+        """Poll the onboarding status endpoint until the user is onboarded."""
+        status_url = f"{self.webhook_url}/{self.test_user_id}"
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status = requests.get(status_url).json()
+            if status["status"] not in ("queued", "running"):
+                break
+            time.sleep(0.5)
+
+        self.assertEqual(status["status"], "success")
+        self.assertIn("individual_playlist_id", status)
+        self.assertIn("group_playlist_id", status)
+
     @pytest.mark.run(order=1)
     def test_user_created_webhook(self):
 
@@ -91,8 +105,9 @@ class TestUserCreationWebhook(unittest.TestCase):
             self.webhook_url, json=payload, headers={"Content-Type": "application/json"}
         )
 
-        # Assert response is successful
-        self.assertEqual(response.status_code, 200)
+        # The webhook queues the onboarding and responds right away.
+        self.assertEqual(response.status_code, 202)
+        self.wait_for_onboarding()
 
         # Give Spotify API a moment to create the playlists
         time.sleep(2)
@@ -140,8 +155,9 @@ class TestUserCreationWebhook(unittest.TestCase):
             self.webhook_url, json=payload, headers={"Content-Type": "application/json"}
         )
 
-        # Assert response is successful
-        self.assertEqual(response.status_code, 200)
+        # The webhook queues the onboarding and responds right away.
+        self.assertEqual(response.status_code, 202)
+        self.wait_for_onboarding()
 
         # Give Spotify API a moment to create the playlists
         time.sleep(2)
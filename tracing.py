@@ -0,0 +1,222 @@
+"""
+Timing spans for the stages of the weekly cron, and the run report built
+from them.
+
+Each user updated by a run gets a `UserTrace`; the code updating the user
+wraps its stages in `stage(name)`, which records how long the stage took and
+how many Spotify and Supabase requests it sent (counted by the hooks in
+metrics.py). `RunReport` collects the traces of a run and summarizes where
+its time went: per-stage totals and percentiles, the slowest users, failures
+by exception type and the total number of requests.
+
+Both are tracked in context variables, so `stage` is a no-op outside a traced
+user and work handed to other threads is only counted when it runs in a copy
+of the caller's context (see `contextvars.copy_context`).
+"""
+
+# Standard library imports
+import os
+import math
+import time
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+
+
+# Number of slowest users listed in a run report.
+REPORT_SLOWEST_USERS = int(os.getenv("CRON_REPORT_SLOWEST_USERS", "10"))
+
+SERVICES = ("spotify", "supabase")
+
+# Request counters of the enclosing run, user and stage.
+_counters = contextvars.ContextVar("request_counters", default=())
+_trace = contextvars.ContextVar("user_trace", default=None)
+
+
+class RequestCounter:
+    """Number of requests sent to each service, safe to share between threads."""
+
+    def __init__(self):
+        self.counts = dict.fromkeys(SERVICES, 0)
+        self._lock = threading.Lock()
+
+    def add(self, service):
+        with self._lock:
+            self.counts[service] = self.counts.get(service, 0) + 1
+
+
+def count_request(service):
+    """Count a request to `service` for the run, user and stage in progress."""
+    for counter in _counters.get():
+        counter.add(service)
+
+
+@contextmanager
+def counting(counter):
+    """Count the requests sent in this context (and copies of it) in `counter`."""
+    token = _counters.set(_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _counters.reset(token)
+
+
+class UserTrace:
+    """
+    Stage timings and request counts of updating one user.
+
+    Args:
+        user_id (str): The user being updated
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.stages = {}
+        self.requests = RequestCounter()
+        self.seconds = None
+        self.error = None
+
+    def record(self, name, seconds, counter):
+        stage = self.stages.setdefault(name, {"seconds": 0.0, "count": 0, **dict.fromkeys(SERVICES, 0)})
+        stage["seconds"] += seconds
+        stage["count"] += 1
+        for service, count in counter.counts.items():
+            stage[service] += count
+
+
+@contextmanager
+def stage(name):
+    """
+    Time the enclosed stage of the user being traced. Entering the same stage
+    again (e.g. once per followed user) adds up.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    with counting(RequestCounter()) as counter:
+        try:
+            yield
+        finally:
+            trace.record(name, time.perf_counter() - started, counter)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of `values` (p in 0-100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+class RunReport:
+    """
+    Collects the `UserTrace`s of one run.
+
+    Args:
+        slowest (int): Number of slowest users listed in the summary
+    """
+
+    def __init__(self, slowest=REPORT_SLOWEST_USERS):
+        self.slowest = slowest
+        self.traces = []
+        self.requests = RequestCounter()
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def trace(self, user_id):
+        """
+        Trace the update of `user_id` in the enclosed block. Exceptions are
+        recorded by type and re-raised.
+        """
+        trace = UserTrace(user_id)
+        token = _trace.set(trace)
+        started = time.perf_counter()
+        try:
+            with counting(self.requests), counting(trace.requests):
+                yield trace
+        except Exception as e:
+            trace.error = type(e).__name__
+            raise
+        finally:
+            _trace.reset(token)
+            trace.seconds = time.perf_counter() - started
+            with self._lock:
+                self.traces.append(trace)
+
+    def summary(self):
+        """
+        Where the run's time went.
+
+        Returns:
+            dict: Per-stage totals and percentiles (seconds) across users,
+                the slowest users, failures by exception type and the number
+                of Spotify / Supabase requests sent while updating users
+        """
+        with self._lock:
+            traces = list(self.traces)
+
+        stages = {}
+        for trace in traces:
+            for name, recorded in trace.stages.items():
+                stages.setdefault(name, []).append(recorded)
+
+        def seconds(value):
+            return round(value, 3) if value is not None else None
+
+        stage_summaries = {}
+        for name, recorded in stages.items():
+            durations = [entry["seconds"] for entry in recorded]
+            stage_summaries[name] = {
+                "users": len(recorded),
+                "count": sum(entry["count"] for entry in recorded),
+                "total": seconds(sum(durations)),
+                "p50": seconds(percentile(durations, 50)),
+                "p95": seconds(percentile(durations, 95)),
+                "p99": seconds(percentile(durations, 99)),
+                "max": seconds(max(durations)),
+                **{service: sum(entry[service] for entry in recorded) for service in SERVICES},
+            }
+
+        slowest = sorted(traces, key=lambda trace: trace.seconds, reverse=True)[:self.slowest]
+        return {
+            "users": len(traces),
+            "wall_time": seconds(time.perf_counter() - self.started),
+            "stages": stage_summaries,
+            "slowest_users": [
+                {
+                    "user_id": trace.user_id,
+                    "seconds": seconds(trace.seconds),
+                    "error": trace.error,
+                    "stages": {name: seconds(entry["seconds"]) for name, entry in trace.stages.items()},
+                }
+                for trace in slowest
+            ],
+            "failures": dict(Counter(trace.error for trace in traces if trace.error)),
+            "requests": dict(self.requests.counts),
+        }
+
+
+def format_summary(summary):
+    """Human-readable table of a `RunReport.summary()`."""
+    lines = [
+        f"{summary['users']} users in {summary['wall_time']:.1f}s, "
+        f"{summary['requests']['spotify']} Spotify and {summary['requests']['supabase']} Supabase requests",
+        f"{'stage':<18} {'total s':>9} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'max s':>8} {'spotify':>8} {'supabase':>9}",
+    ]
+    for name, stats in sorted(summary["stages"].items(), key=lambda item: -item[1]["total"]):
+        lines.append(
+            f"{name:<18} {stats['total']:>9.2f} {stats['p50']:>8.3f} {stats['p95']:>8.3f} "
+            f"{stats['p99']:>8.3f} {stats['max']:>8.3f} {stats['spotify']:>8} {stats['supabase']:>9}"
+        )
+    if summary["failures"]:
+        lines.append(f"Failures: {summary['failures']}")
+    for user in summary["slowest_users"]:
+        stages = ", ".join(f"{name} {value:.2f}s" for name, value in user["stages"].items())
+        error = f" ({user['error']})" if user["error"] else ""
+        lines.append(f"  slow: {user['user_id']} {user['seconds']:.2f}s{error}: {stages}")
+    return "\n".join(lines)
@@ -3,133 +3,777 @@ This script is intended to be ran weekly to update user playlists with the
 the top tracks and recommendations of those they follow.
 """
 
+import asyncio
+import hashlib
+import contextvars
 import logging
+import argparse
 import os
+import time
+import threading
 import traceback
-import sys
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 
-from utils import get_user_access_token, add_top_tracks_to_follower, get_custom_playlists, get_all_followed_playlists, get_user_profile, clear_playlist, get_top_tracks_and_recs, get_playlist_track_uris, add_tracks_to_playlist
+# Loads the .env file and configures logging, before the modules below read
+# their settings.
+import settings
+from utils import UserTableIndex, plan_playlist_update, apply_playlist_plan, top_tracks_memo, prefetched_user_tables, get_followed_user_ids, get_followed_user_ids_from_spotify, get_user_access_token, get_custom_playlists, get_playlist_snapshot_and_uris, get_top_tracks_and_recs
 
-from supabase import create_client, Client
+from spotify_client import get_spotify_client
+from tracing import RunReport, RequestCounter, counting, stage, format_summary
+from job_queue import claim_jobs, complete_job, fail_job, enqueue_run, new_worker_id, current_run_id, get_run_status, load_cursor, save_cursor
 
-from dotenv import load_dotenv
+from supabase_client import get_supabase
 
-load_dotenv()  # Loads .env file
+RED = '\033[91m'
+GREEN = '\033[92m'
+YELLOW = '\033[93m'
+RESET = '\033[0m'  # Resets the color
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+logger = logging.getLogger("spotifriends")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+# Number of users the cron updates at the same time (1 runs sequentially).
+CRON_CONCURRENCY = int(os.getenv("CRON_CONCURRENCY", "8"))
 
-# Configure basic logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)],
-)
+# Where the cron learns who follows whom:
+#   "graph"   - the `spotify_follows` table (one bulk read per run)
+#   "spotify" - each user's followed playlists on Spotify (slow, per-user calls)
+FOLLOW_SOURCE = os.getenv("CRON_FOLLOW_SOURCE", "graph")
 
+# How long Vercel lets one invocation run before killing it; must match the
+# `maxDuration` of the app's build in vercel.json (`functions` can't be used
+# together with `builds`).
+FUNCTION_MAX_DURATION = float(os.getenv("FUNCTION_MAX_DURATION_SECONDS", "300"))
 
-#Disable logging from the Supabase library
-logging.getLogger("supabase").setLevel(logging.WARNING)
+# Wall-clock budget of one cron invocation (0 = unlimited), and how long
+# before the end of it we stop starting new users.
+CRON_TIME_BUDGET = float(os.getenv("CRON_TIME_BUDGET_SECONDS", FUNCTION_MAX_DURATION))
+CRON_BUDGET_MARGIN = float(os.getenv("CRON_BUDGET_MARGIN_SECONDS", "60"))
 
-RED = '\033[91m'
-GREEN = '\033[92m'
-YELLOW = '\033[93m'
-RESET = '\033[0m'  # Resets the color
+# How often a time-budgeted run saves its cursor while it runs (after this
+# many users or seconds, whichever comes first), so an invocation killed
+# before its final save loses at most this much progress.
+CRON_CHECKPOINT_USERS = int(os.getenv("CRON_CHECKPOINT_USERS", "25"))
+CRON_CHECKPOINT_SECONDS = float(os.getenv("CRON_CHECKPOINT_SECONDS", "15"))
 
-logger = logging.getLogger("spotifriends")
 
-def run_update_playlists():
-
-    # Get all user id's.
-    spotify_users = supabase.table("spotify_tokens").select("user_id", "email").execute()
-
-    logger.info("Iterating through all users...")
-    for i, user in enumerate(spotify_users.data):
-
-        try: 
-            logger.info(f"Updating user playlists ({i}) {user["email"]} {user["user_id"]}")
-            user_id = user["user_id"]
-
-            # if user_id != "37e96704-ec5a-4324-b0e3-af03672831f6":
-            #     continue
-
-            # Testing code to only run this script on my profile.
-            # if user_id != "37e96704-ec5a-4324-b0e3-af03672831f6":
-            #     logger.info("skipping for now...")
-            #     continue
-
-            # Ensure we have playlists made for this user.
-            user_playlists = get_custom_playlists(user_id)
-            if user_playlists is None:
-                logger.info(f"{YELLOW}SKIPPING{RESET}: We don't have playlists made for: {user_id}")
-                continue
-
-            # Get the user's access token.
-            access_token = get_user_access_token(user_id)
-
-            # Clear their previous list of recommendations.
-            clear_playlist(access_token, user_playlists["group_playlist"])
-
-            # Identify all other profiles this user follows:
-            profile_id = get_user_profile(access_token)["id"]
-            all_playlists = get_all_followed_playlists(profile_id, access_token)
-            all_playlist_ids = [playlist["id"] for playlist in all_playlists]
-
-            # Find the subset of playlists that represent another user whom they follow.
-            result = supabase.table('spotify_playlists')\
-                .select('user_id, individual_playlist')\
-                .in_('individual_playlist', all_playlist_ids)\
-                .execute()
-
-            # For each followed user, add their top tracks and recs to the individual users group playlist.
-            for followed_user in result.data:
-                followed_id = followed_user["user_id"]
-
-                # We don't need to add the recommend the top tracks of the user
-                # to themselves.
-                if followed_id == user_id:
-                    continue
-
-                # Note: user_id "follows" followed_id
-                logger.info(f"Adding top tracks of {followed_id} to the user.")
-                add_top_tracks_to_follower(followed_id, user_id)
-                logger.info("Successfully added songs")
-
-            # Get the current user's top tracks and recs.
-            user_top_uris = get_top_tracks_and_recs(user_id, access_token)
-            user_playlist_id = user_playlists["individual_playlist"]
-
-            # Order the uri's so the most recent are at the top.
-            prev_uris = get_playlist_track_uris(access_token, user_playlist_id)
-            prev_uris = [uri for uri in prev_uris if uri not in user_top_uris]
-            all_uris = user_top_uris + prev_uris
-
-            # Save the individual user's top tracks to their top tracks playlist.
-            if len(all_uris) > 0:
-                clear_playlist(access_token, user_playlist_id)
-                add_tracks_to_playlist(access_token, user_playlist_id, all_uris)
-                logger.info(f"Adding top tracks to user's own playlist {user_id}")
-            else:
-                logger.info(f"Couldn't find any top tracks to for user {user_id}")
+def map_in_context(executor, function, items):
+    """
+    `executor.map` that runs each call in a copy of the caller's context, so
+    the workers see the run's prefetched tables, top tracks memo and request
+    counters (see `prefetched_user_tables` and tracing).
+    """
+    context = contextvars.copy_context()
+    return executor.map(lambda item: context.copy().run(function, item), items)
+
+
+def update_user_playlists(i, user, report=None):
+    """
+    Update the Friend Favorites and My Top Tracks playlists of a single user.
 
-            # Also, add their top tracks to the top of the friend favorites.
-            if len(user_top_uris) > 0:
-                add_tracks_to_playlist(access_token, user_playlists["group_playlist"], user_top_uris, position=0)
+    Failures are logged and swallowed so one user can't break the whole run.
+    With a `report`, the timings of the update's stages are added to it.
 
+    Returns:
+        bool: False if updating the user failed
+    """
+    user_id = user["user_id"]
+
+    try: 
+        logger.info(f"Updating user playlists ({i}) {user["email"]} {user["user_id"]}")
+
+        # Testing code to only run this script on my profile.
+        # if user_id != "37e96704-ec5a-4324-b0e3-af03672831f6":
+        #     logger.info("skipping for now...")
+        #     return True
+
+        with report.trace(user_id) if report else nullcontext():
+            updated = sync_user_playlists(user_id)
+        if updated:
             logger.info(f"{GREEN}SUCCESS:{RESET} added the top tracks for {user_id} !!!")
+        return True
+
+    except Exception as e:
+
+        logger.info(f"{RED}ERROR:{RESET} Failed updating playlists for user {user_id}: {str(e)}")
+        logger.info(traceback.format_exc())
+        return False
+
+
+def plan_user_playlists(user_id):
+    """
+    Planning phase of updating a user: every read needed to rebuild their
+    Friend Favorites and My Top Tracks playlists, and the writes that would
+    bring each playlist up to date (see `plan_playlist_update`). Nothing is
+    written to either playlist.
+
+    Returns:
+        list: One plan per playlist, tagged with its "kind" ("group" or
+            "individual"), or None if the user has no playlists yet
+    """
+
+    # Ensure we have playlists made for this user.
+    with stage("playlists"):
+        user_playlists = get_custom_playlists(user_id)
+    if user_playlists is None:
+        logger.info(f"{YELLOW}SKIPPING{RESET}: We don't have playlists made for: {user_id}")
+        return None
+
+    # Get the user's access token.
+    with stage("token"):
+        access_token = get_user_access_token(user_id)
+
+    # Get the current user's top tracks and recs.
+    with stage("top_tracks"):
+        user_top_uris = get_top_tracks_and_recs(user_id, access_token)
+
+    # Identify all other profiles this user follows:
+    with stage("follow_discovery"):
+        if FOLLOW_SOURCE == "spotify":
+            followed_ids = get_followed_user_ids_from_spotify(access_token, user_id)
+        else:
+            followed_ids = get_followed_user_ids(user_id)
+
+    # The user's own top tracks go at the top of their friend favorites,
+    # followed by the top tracks and recs of each user they follow. Those
+    # are added with the friend's token so they show up as added by them.
+    group_uris = list(user_top_uris)
+    insert_access_tokens = {}
+    for followed_id in followed_ids:
+
+        # We don't need to add the recommend the top tracks of the user
+        # to themselves.
+        if followed_id == user_id:
+            continue
+
+        # Note: user_id "follows" followed_id
+        logger.info(f"Adding top tracks of {followed_id} to the user.")
+        with stage("fan_in"):
+            followed_access_token = get_user_access_token(followed_id)
+            for uri in get_top_tracks_and_recs(followed_id, followed_access_token):
+                if uri not in group_uris:
+                    insert_access_tokens[uri] = followed_access_token
+                    group_uris.append(uri)
+
+    # Read both playlists (the snapshot_id comes with the tracks, so
+    # applying the plans needs no further reads).
+    with stage("playlist_reads"):
+        group_playlist_id = user_playlists["group_playlist"]
+        group_contents = get_playlist_snapshot_and_uris(access_token, group_playlist_id)
+        user_playlist_id = user_playlists["individual_playlist"]
+        user_snapshot, prev_uris = get_playlist_snapshot_and_uris(access_token, user_playlist_id)
+
+    # Replace their previous list of recommendations, only touching the
+    # tracks that changed since last week.
+    plans = [{"kind": "group", **plan_playlist_update(
+        access_token, group_playlist_id, group_uris,
+        insert_access_tokens=insert_access_tokens, contents=group_contents,
+    )}]
+
+    # Order the uri's so the most recent are at the top.
+    all_uris = user_top_uris + [uri for uri in prev_uris if uri not in user_top_uris]
+
+    # Save the individual user's top tracks to their top tracks playlist.
+    if len(all_uris) > 0:
+        plans.append({"kind": "individual", **plan_playlist_update(
+            access_token, user_playlist_id, all_uris, contents=(user_snapshot, prev_uris),
+        )})
+        logger.info(f"Adding top tracks to user's own playlist {user_id}")
+    else:
+        logger.info(f"Couldn't find any top tracks to for user {user_id}")
+
+    return plans
+
+
+def merge_playlist_plans(plans):
+    """
+    The plans worth applying: plans without writes are dropped, and if
+    several plans target the same playlist only the last one is kept (it
+    was planned against the same contents and supersedes the others).
+
+    Returns:
+        list: Plans in their original order
+    """
+    latest = {}
+    for plan in plans:
+        if plan["playlist_id"] in latest:
+            logger.warning(f"Playlist {plan['playlist_id']} was planned more than once; applying the last plan")
+        latest[plan["playlist_id"]] = plan
+    return [plan for plan in latest.values() if plan["writes"]]
+
+
+def execute_playlist_plans(plans):
+    """
+    Execution phase of updating a user: apply the writes of their plans.
+
+    Returns:
+        int: Number of write requests sent
+    """
+    requests = 0
+    for plan in merge_playlist_plans(plans):
+        with stage(f"{plan['kind']}_writes"):
+            requests += apply_playlist_plan(plan)["requests"]
+    return requests
+
+
+def sync_user_playlists(user_id):
+    """
+    Rebuild a user's Friend Favorites and My Top Tracks playlists: plan
+    every playlist first, then apply the plans.
+
+    Errors are raised to the caller. Each stage is timed when the user is
+    traced (see tracing).
+
+    Returns:
+        bool: False if the user was skipped because they have no playlists yet
+    """
+    plans = plan_user_playlists(user_id)
+    if plans is None:
+        return False
+
+    execute_playlist_plans(plans)
+    return True
+
+
+def get_spotify_users(index=None):
+    """Get the user id and email of every user with saved Spotify tokens."""
+    if index is not None:
+        return list(index.tokens.values())
+    return get_supabase().table("spotify_tokens").select("user_id", "email").execute().data
+
+
+def user_shard(user_id, num_shards):
+    """
+    Deterministically assign a user to one of `num_shards` shards.
+
+    Uses a stable hash (unlike `hash()`, which is salted per process) so every
+    invocation agrees on the assignment.
+    """
+    digest = hashlib.sha1(user_id.encode()).hexdigest()
+    return int(digest, 16) % num_shards
+
+
+def get_shard_users(spotify_users, shard=0, num_shards=1):
+    """Keep only the users that belong to `shard` out of `num_shards`."""
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"Invalid shard {shard} of {num_shards}")
+    if num_shards == 1:
+        return list(spotify_users)
+    return [user for user in spotify_users if user_shard(user["user_id"], num_shards) == shard]
+
+
+class RunBudget:
+    """
+    Wall-clock budget and resume cursor for one invocation of the cron.
+
+    With a budget, the invocation stops starting new users shortly before
+    the budget runs out and saves the last user it started. The next
+    invocation of the same weekly run (and shard) continues after it.
+    Without a budget every invocation is a full run and no cursor is kept.
+
+    The cursor is also saved while the run goes (see `user_finished`), in
+    case the invocation is killed before it gets to the final save.
+
+    Args:
+        shard (int): Which shard of the users this invocation updates
+        num_shards (int): Number of shards the users are split into
+        time_budget (float): Seconds this invocation may run (None = unlimited)
+        margin (float): Stop starting users this many seconds before the end
+            (defaults to CRON_BUDGET_MARGIN)
+    """
+
+    def __init__(self, shard=0, num_shards=1, time_budget=None, margin=None):
+        self.name = f"update-playlists:{shard}/{num_shards}"
+        self.run_id = current_run_id()
+        self.enabled = bool(time_budget)
+        self.deadline = None
+        self.cursor = None
+        self._finished = set()
+        self._done = 0
+        self._saved = 0
+        self._saved_at = time.monotonic()
+        self._saving = False  # A checkpoint write is in flight
+        self._lock = threading.Lock()
+
+        if self.enabled:
+            margin = CRON_BUDGET_MARGIN if margin is None else margin
+            self.deadline = time.monotonic() + max(time_budget - margin, 0)
+            self.cursor = load_cursor(self.name)
+            if self.cursor is not None and self.cursor["run_id"] != self.run_id:
+                self.cursor = None  # Last week's cursor; start over.
+
+    @property
+    def already_complete(self):
+        return self.cursor is not None and self.cursor.get("completed_at") is not None
+
+    def remaining_users(self, spotify_users):
+        """Users still to update this run, in a stable (user_id) order."""
+        users = sorted(spotify_users, key=lambda user: user["user_id"])
+        if self.cursor is not None and self.cursor.get("last_user_id"):
+            users = [user for user in users if user["user_id"] > self.cursor["last_user_id"]]
+        return users
+
+    def exhausted(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def user_finished(self, users, i):
+        """
+        Record that `users[i]` is done (updated or failed) and checkpoint the
+        cursor every CRON_CHECKPOINT_USERS users or CRON_CHECKPOINT_SECONDS.
+        Users can finish out of order, so the checkpoint is the last user
+        before the first one still in progress.
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._finished.add(i)
+            while self._done in self._finished:
+                self._finished.discard(self._done)
+                self._done += 1
+
+            due = (
+                self._done - self._saved >= CRON_CHECKPOINT_USERS
+                or time.monotonic() - self._saved_at >= CRON_CHECKPOINT_SECONDS
+            )
+            if self._saving or self._done <= self._saved or not due:
+                return
+            # Written outside the lock, one checkpoint at a time, so workers
+            # finishing users don't wait on the round trip.
+            self._saving = True
+            done, last_user_id = self._done, users[self._done - 1]["user_id"]
+
+        saved = False
+        try:
+            save_cursor(self.name, self.run_id, last_user_id)
+            saved = True
+        except Exception as e:
+            # Not fatal: the next checkpoint (or the final save) retries.
+            logger.info(f"Couldn't checkpoint the cursor of {self.name}: {str(e)}")
+        finally:
+            with self._lock:
+                self._saving = False
+                if saved:
+                    self._saved = done
+                    self._saved_at = time.monotonic()
+
+    def save(self, users, results):
+        """
+        Save the cursor after an invocation. `results` holds None for the
+        users that weren't started because the budget ran out.
+        """
+        if not self.enabled:
+            return
+
+        started = next((i for i, result in enumerate(results) if result is None), len(results))
+        if started > 0:
+            last_user_id = users[started - 1]["user_id"]
+        else:
+            last_user_id = self.cursor.get("last_user_id") if self.cursor else None
+
+        save_cursor(self.name, self.run_id, last_user_id, completed=started == len(users))
+
+
+def log_spotify_stats():
+    client = get_spotify_client()
+    logger.info(f"Spotify rate limiter: {client.limiter.stats()}")
+    if client.cache is not None:
+        logger.info(f"Spotify HTTP cache: {client.cache.stats()}")
+
+
+def log_run_report(report):
+    """Log where the run's time went, and return it for the run's summary."""
+    summary = report.summary()
+    logger.info(f"Run report:\n{format_summary(summary)}")
+    return summary
+
+
+def summarize_run(results, shard, num_shards, report=None):
+    finished = [result for result in results if result is not None]
+    summary = {
+        "shard": shard,
+        "of": num_shards,
+        "users": len(finished),
+        "succeeded": sum(1 for result in finished if result),
+        "failed": sum(1 for result in finished if not result),
+        "remaining": len(results) - len(finished),
+    }
+    logger.info(f"Updated {summary['succeeded']}/{summary['users']} users successfully (shard {shard + 1}/{num_shards})")
+    if summary["remaining"]:
+        logger.info(f"{YELLOW}OUT OF TIME:{RESET} {summary['remaining']} users left for the next invocation")
+    log_spotify_stats()
+    if report is not None:
+        summary["report"] = log_run_report(report)
+    return summary
+
+
+def run_update_playlists(shard=0, num_shards=1, time_budget=None):
+    """
+    Update the playlists of every user in the shard, one user at a time.
+
+    Returns:
+        dict: Success and failure counts for the shard
+    """
+    budget = RunBudget(shard, num_shards, time_budget)
+    if budget.already_complete:
+        logger.info(f"Run {budget.run_id} is already complete for shard {shard + 1}/{num_shards}")
+        return summarize_run([], shard, num_shards)
+
+    with prefetched_user_tables() as index, top_tracks_memo():
+
+        # Get all user id's.
+        spotify_users = budget.remaining_users(
+            get_shard_users(get_spotify_users(index), shard, num_shards)
+        )
+
+        logger.info("Iterating through all users...")
+        report = RunReport()
+        results = []
+        for i, user in enumerate(spotify_users):
+            if budget.exhausted():
+                results.append(None)
+            else:
+                results.append(update_user_playlists(i, user, report))
+                budget.user_finished(spotify_users, i)
+
+    budget.save(spotify_users, results)
+    return summarize_run(results, shard, num_shards, report)
+
+
+async def run_update_playlists_async(concurrency=CRON_CONCURRENCY, shard=0, num_shards=1, time_budget=None):
+    """
+    Update the playlists of every user in the shard, with up to
+    `concurrency` users in flight at once.
+
+    The per-user work is blocking (requests + supabase), so each user runs on
+    a worker thread while asyncio bounds how many are in progress.
+
+    Returns:
+        dict: Success and failure counts for the shard
+    """
+    budget = await asyncio.to_thread(RunBudget, shard, num_shards, time_budget)
+    if budget.already_complete:
+        logger.info(f"Run {budget.run_id} is already complete for shard {shard + 1}/{num_shards}")
+        return summarize_run([], shard, num_shards)
+
+    index = await asyncio.to_thread(UserTableIndex.load)
+    spotify_users = budget.remaining_users(
+        get_shard_users(get_spotify_users(index), shard, num_shards)
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    report = RunReport()
+
+    def update_and_checkpoint(i, user):
+        result = update_user_playlists(i, user, report)
+        budget.user_finished(spotify_users, i)
+        return result
+
+    with prefetched_user_tables(index), top_tracks_memo(), \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        async def update(i, user):
+            # The semaphore wakes waiters in order, so the users that get
+            # started before the budget runs out are a prefix of the list.
+            async with semaphore:
+                if budget.exhausted():
+                    return None
+                return await loop.run_in_executor(
+                    executor, contextvars.copy_context().run, update_and_checkpoint, i, user,
+                )
+
+        logger.info(f"Iterating through all users ({concurrency} at a time)...")
+        results = await asyncio.gather(
+            *(update(i, user) for i, user in enumerate(spotify_users))
+        )
+
+    await asyncio.to_thread(budget.save, spotify_users, results)
+    return summarize_run(results, shard, num_shards, report)
+
+
+def run_queue_worker(run_id=None, concurrency=CRON_CONCURRENCY, batch_size=None, enqueue=True, time_budget=None):
+    """
+    Work through the durable job queue of a weekly run until no jobs are due.
+
+    Any number of workers can run this at the same time: jobs are leased in
+    batches, failures are retried with backoff, and jobs left behind by a
+    crashed worker are picked up once their lease expires.
+
+    Args:
+        run_id (str): The run to work on (defaults to this week's run)
+        concurrency (int): Maximum number of users updated at the same time
+        batch_size (int): Number of jobs leased per claim
+        enqueue (bool): Whether to (idempotently) create the run's jobs first
+        time_budget (float): Stop claiming jobs once this many seconds (minus
+            CRON_BUDGET_MARGIN) have passed; None = unlimited
+
+    Returns:
+        dict: What this worker processed, and the status counts of the run
+    """
+    run_id = run_id or current_run_id()
+    worker_id = new_worker_id()
+    concurrency = max(concurrency, 1)
+    batch_size = batch_size or concurrency * 2
+    deadline = time.monotonic() + max(time_budget - CRON_BUDGET_MARGIN, 0) if time_budget else None
+    report = RunReport()
+
+    def process(job):
+        user_id = job["user_id"]
+        try:
+            logger.info(f"Updating user playlists (attempt {job['attempts']}) {user_id}")
+            with report.trace(user_id):
+                updated = sync_user_playlists(user_id)
+            if updated:
+                logger.info(f"{GREEN}SUCCESS:{RESET} added the top tracks for {user_id} !!!")
+            complete_job(job, worker_id)
+            return True
 
         except Exception as e:
 
             logger.info(f"{RED}ERROR:{RESET} Failed updating playlists for user {user_id}: {str(e)}")
             logger.info(traceback.format_exc())
+            fail_job(job, worker_id, e)
+            return False
+
+    results = []
+    with prefetched_user_tables() as index, top_tracks_memo(), \
+            ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        if enqueue:
+            enqueue_run(run_id, index.tokens.keys())
+
+        logger.info(f"Worker {worker_id} processing run {run_id}...")
+        while deadline is None or time.monotonic() < deadline:
+            jobs = claim_jobs(run_id, worker_id, limit=batch_size)
+            if not jobs:
+                break
+            results.extend(map_in_context(executor, process, jobs))
+
+    summary = {
+        "run_id": run_id,
+        "worker_id": worker_id,
+        "processed": len(results),
+        "succeeded": sum(1 for result in results if result),
+        "failed": sum(1 for result in results if not result),
+        "run_status": get_run_status(run_id),
+    }
+    logger.info(f"Queue worker finished: {summary}")
+    log_spotify_stats()
+    summary["report"] = log_run_report(report)
+    return summary
+
+
+def reconcile_user_follows(user_id, index):
+    """
+    Bring the `spotify_follows` edges of one user in line with the
+    playlists they actually follow on Spotify.
+
+    Returns:
+        tuple: (number of edges added, number of edges removed)
+    """
+    access_token = get_user_access_token(user_id)
+    actual = set(get_followed_user_ids_from_spotify(access_token, user_id)) - {user_id}
+    recorded = set(index.following.get(user_id, []))
+
+    added = actual - recorded
+    removed = recorded - actual
+
+    if added:
+        get_supabase().table("spotify_follows").upsert([
+            {"follower_id": user_id, "following_id": following_id}
+            for following_id in added
+        ]).execute()
+    if removed:
+        get_supabase().table("spotify_follows").delete()\
+            .eq("follower_id", user_id)\
+            .in_("following_id", list(removed))\
+            .execute()
+
+    return len(added), len(removed)
+
+
+def reconcile_follow_graph(concurrency=CRON_CONCURRENCY):
+    """
+    Periodic job that repairs drift between `spotify_follows` and Spotify,
+    e.g. users who unfollowed a friend's playlist from the Spotify app.
+
+    Returns:
+        dict: Counts of users checked, failed, and edges added / removed
+    """
+    with prefetched_user_tables() as index:
+        user_ids = [user_id for user_id in index.tokens if user_id in index.playlists]
+
+        def reconcile(user_id):
+            try:
+                return reconcile_user_follows(user_id, index)
+            except Exception as e:
+                logger.info(f"{RED}ERROR:{RESET} Failed reconciling follows for user {user_id}: {str(e)}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            results = list(map_in_context(executor, reconcile, user_ids))
+
+    succeeded = [result for result in results if result is not None]
+    summary = {
+        "users": len(results),
+        "failed": len(results) - len(succeeded),
+        "added": sum(added for added, _ in succeeded),
+        "removed": sum(removed for _, removed in succeeded),
+    }
+    logger.info(f"Reconciled follow graph: {summary}")
+    return summary
+
+
+def plan_update_playlists(concurrency=CRON_CONCURRENCY, shard=0, num_shards=1):
+    """
+    Plan the update of every user in the shard without writing to any
+    playlist (`--dry-run`).
+
+    Planning reads exactly what a real run reads, so besides the planned
+    writes this counts the reads it sent, and their sum is the number of
+    requests a run would send now. Expired tokens are still refreshed.
+
+    Returns:
+        dict: Users planned, skipped and failed, playlists with and without
+            changes, the changes per playlist, and the predicted requests
+    """
+    reads = RequestCounter()
+
+    with counting(reads), prefetched_user_tables() as index, top_tracks_memo(), \
+            ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        spotify_users = get_shard_users(get_spotify_users(index), shard, num_shards)
+
+        def plan(user):
+            try:
+                return plan_user_playlists(user["user_id"])
+            except Exception as e:
+                logger.info(f"{RED}ERROR:{RESET} Failed planning playlists for user {user['user_id']}: {str(e)}")
+                return e
+
+        results = list(map_in_context(executor, plan, spotify_users))
+
+    plans = [plan for result in results if isinstance(result, list) for plan in result]
+    changed = merge_playlist_plans(plans)
+    writes = sum(plan["requests"] for plan in changed)
+    return {
+        "users": len(spotify_users),
+        "skipped": sum(1 for result in results if result is None),
+        "failed": sum(1 for result in results if isinstance(result, Exception)),
+        "playlists": len(plans),
+        "unchanged": len(plans) - len(changed),
+        "changes": [
+            {key: plan[key] for key in ("kind", "playlist_id", "removed", "inserted", "moved", "requests")}
+            for plan in changed
+        ],
+        "requests": {
+            "reads": dict(reads.counts),
+            "writes": writes,
+            "total": sum(reads.counts.values()) + writes,
+        },
+    }
+
+
+def format_plan(summary):
+    """Human-readable version of a `plan_update_playlists` summary."""
+    requests = summary["requests"]
+    lines = [
+        f"{summary['users']} users ({summary['skipped']} skipped, {summary['failed']} failed), "
+        f"{summary['playlists']} playlists ({summary['unchanged']} unchanged)",
+    ]
+    for change in summary["changes"]:
+        lines.append(
+            f"  {change['kind']:<10} {change['playlist_id']}: -{change['removed']} +{change['inserted']} "
+            f"~{change['moved']} ({change['requests']} requests)"
+        )
+    lines.append(
+        f"Predicted requests: {requests['total']} ({requests['writes']} Spotify writes; reads: "
+        f"{requests['reads']['spotify']} Spotify, {requests['reads']['supabase']} Supabase)"
+    )
+    return "\n".join(lines)
+
+
+def run_update_playlists_concurrently(concurrency=CRON_CONCURRENCY, shard=0, num_shards=1, time_budget=None):
+    """
+    Run the async engine, or fall back to the sequential path when
+    `concurrency` is 1.
+
+    Args:
+        concurrency (int): Maximum number of users updated at the same time
+        shard (int): Which shard of the users to update (0-based)
+        num_shards (int): Number of shards the users are split into
+        time_budget (float): Seconds this invocation may run before it saves a
+            cursor for the next one to resume from (None = unlimited)
+
+    Returns:
+        dict: Success and failure counts for the shard
+    """
+    if concurrency <= 1:
+        return run_update_playlists(shard, num_shards, time_budget)
+    else:
+        return asyncio.run(run_update_playlists_async(concurrency, shard, num_shards, time_budget))
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=CRON_CONCURRENCY,
+        help="Number of users to update at the same time (1 runs sequentially)",
+    )
+    parser.add_argument(
+        "--shard",
+        type=int,
+        default=0,
+        help="Which shard of the users to update (0-based)",
+    )
+    parser.add_argument(
+        "--of",
+        dest="num_shards",
+        type=int,
+        default=1,
+        help="Number of shards the users are split into",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=None,
+        help="Seconds to run before saving a cursor to resume from (default: unlimited)",
+    )
+    parser.add_argument(
+        "--queue",
+        action="store_true",
+        help="Work through the durable job queue instead of all users in memory",
+    )
+    parser.add_argument(
+        "--run-id",
+        default=None,
+        help="Job queue run to work on (defaults to this week's run)",
+    )
+    parser.add_argument(
+        "--reconcile-follows",
+        action="store_true",
+        help="Repair spotify_follows against Spotify instead of updating playlists",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the planned playlist changes and predicted request count without writing them",
+    )
+    args = parser.parse_args()
 
     try:
-        run_update_playlists()
+        if args.reconcile_follows:
+            reconcile_follow_graph(args.concurrency)
+        elif args.dry_run:
+            print(format_plan(plan_update_playlists(args.concurrency, args.shard, args.num_shards)))
+        elif args.queue:
+            run_queue_worker(args.run_id, args.concurrency, time_budget=args.time_budget)
+        else:
+            run_update_playlists_concurrently(
+                args.concurrency, args.shard, args.num_shards, args.time_budget
+            )
     except Exception as e:
-        logger.info(f"An error occurred updating playlists for user={user_id}: {str(e)}")
+        logger.info(f"An error occurred updating playlists: {str(e)}")
         logger.info(traceback.format_exc())
-
-
@@ -1,52 +1,146 @@
-from supabase import create_client, Client
 from datetime import datetime
 import logging
 import requests
 import base64
 from urllib.parse import urlencode
 import os
-import sys
+import time
+import threading
+import contextvars
+from collections import Counter
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
-from dotenv import load_dotenv
+# Loads the .env file and configures logging, before the modules below read
+# their settings.
+import settings
 
-load_dotenv()  # Loads .env file
-
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 import requests
 import json
 
+from spotify_client import SPOTIFY_API_URL
+from spotify_client import SPOTIFY_TOKEN_URL
+from spotify_client import SpotifyClient
+from spotify_client import get_spotify_client
+from supabase_client import get_supabase
+
 
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-
 USER_PLAYLISTS = {
     "individual": "My Top Tracks",
     "group": "Friend Favorites"
 }
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+logger = logging.getLogger("spotifriends")
 
+# Rows fetched per request when bulk-loading a table.
+SUPABASE_PAGE_SIZE = 1000
 
-# Configure basic logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)],
-)
 
-logger = logging.getLogger("spotifriends")
+def select_all(table, columns="*", page_size=SUPABASE_PAGE_SIZE, order_by="user_id"):
+    """
+    Read every row of a Supabase table using paginated selects.
 
-#Disable logging from the Supabase library
-logging.getLogger("supabase").setLevel(logging.WARNING)
-logging.getLogger("httpx").setLevel(logging.WARNING)
+    Args:
+        table (str): Table name
+        columns (str): Columns to select
+        page_size (int): Rows fetched per request
+        order_by (str): Column giving the pages a stable order
 
-def refresh_access_token(client_id, client_secret, refresh_token):
+    Returns:
+        list: All rows of the table
+    """
+    rows = []
+    offset = 0
+    while True:
+        page = get_supabase().table(table).select(columns)\
+            .order(order_by)\
+            .range(offset, offset + page_size - 1)\
+            .execute()
+        rows.extend(page.data)
+        if len(page.data) < page_size:
+            break
+        offset += page_size
+    return rows
+
+
+class UserTableIndex:
+    """
+    In-memory index of the `spotify_tokens`, `spotify_playlists` and
+    `spotify_follows` tables.
+
+    Loaded once at the start of a cron run so per-user lookups don't each
+    need a database round trip.
+    """
+
+    def __init__(self, tokens, playlists, follows=()):
+        self.tokens = {}
+        for row in tokens:
+            self.tokens.setdefault(row["user_id"], row)
+
+        self.playlists = {}
+        self.individual_playlist_owners = {}
+        for row in playlists:
+            self.playlists.setdefault(row["user_id"], row)
+            if row.get("individual_playlist"):
+                self.individual_playlist_owners.setdefault(row["individual_playlist"], row["user_id"])
+
+        # Adjacency list of the follow graph: follower_id -> [following_id]
+        self.following = {}
+        for row in follows:
+            followed = self.following.setdefault(row["follower_id"], [])
+            if row["following_id"] not in followed:
+                followed.append(row["following_id"])
+
+    @classmethod
+    def load(cls, page_size=SUPABASE_PAGE_SIZE):
+        tokens = select_all(
+            "spotify_tokens",
+            "user_id, email, access_token, refresh_token, expires_at, spotify_id",
+            page_size=page_size,
+        )
+        playlists = select_all("spotify_playlists", "*", page_size=page_size)
+        follows = select_all(
+            "spotify_follows",
+            "follower_id, following_id",
+            page_size=page_size,
+            order_by="follower_id",
+        )
+        logger.info(
+            f"Prefetched {len(tokens)} token rows, {len(playlists)} playlist rows "
+            f"and {len(follows)} follow edges"
+        )
+        return cls(tokens, playlists, follows)
+
+
+# The index in use during a cron run, or None outside of one. It is a
+# context variable, so requests handled by other threads while a run is in
+# progress keep reading the database; the run's workers see it by running
+# in copies of its context (see `contextvars.copy_context`).
+_user_index = contextvars.ContextVar("user_index", default=None)
 
-    url = "https://accounts.spotify.com/api/token"
+
+@contextmanager
+def prefetched_user_tables(index=None):
+    """
+    Serve token and playlist lookups from a bulk-loaded `UserTableIndex`
+    within this block (and copies of its context).
+    """
+    index = index or UserTableIndex.load()
+    token = _user_index.set(index)
+    try:
+        yield index
+    finally:
+        _user_index.reset(token)
+
+
+def refresh_access_token(client_id, client_secret, refresh_token):
 
     credentials = f"{client_id}:{client_secret}"
     encoded_credentials = base64.b64encode(credentials.encode()).decode()
@@ -59,7 +153,7 @@ def refresh_access_token(client_id, client_secret, refresh_token):
         "refresh_token": refresh_token,
     }
 
-    response = requests.post(url, headers=headers, data=data)
+    response = get_spotify_client().post(SPOTIFY_TOKEN_URL, headers=headers, data=data)
 
     if response.status_code == 200:
         return response.json()
@@ -67,37 +161,45 @@ def refresh_access_token(client_id, client_secret, refresh_token):
         response.raise_for_status()
 
 
-def get_playlist_tracks(access_token, playlist_id):
+# Spotify returns / accepts at most this many items per playlist request.
+PLAYLIST_PAGE_SIZE = 100
+PLAYLIST_WRITE_LIMIT = 100
+
+# Number of independent playlist writes (e.g. removal chunks) sent at once.
+PLAYLIST_WRITE_WORKERS = int(os.getenv("PLAYLIST_WRITE_WORKERS", "4"))
+
+
+def iter_playlist_tracks(access_token, playlist_id, fields=None):
     """
-    Get all tracks from a Spotify playlist
-    
+    Stream every item of a Spotify playlist, one page at a time.
+
     Args:
-        access_token (str): Spotify access token to check
+        access_token (str): Spotify access token
         playlist_id: The Spotify ID of the playlist
-        
-    Returns:
-        List of track objects from the playlist
+        fields (str): Optional Spotify `fields` filter for the items
+
+    Yields:
+        Track objects from the playlist, in playlist order
     """
     if not playlist_id:
         raise ValueError("Playlist ID is required")
 
-    tracks = []
     offset = 0
-    limit = 100  # Maximum allowed by Spotify API
+    limit = PLAYLIST_PAGE_SIZE  # Maximum allowed by Spotify API
 
     while True:
-        url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
         params = {
             "limit": limit,
             "offset": offset
         }
+        if fields:
+            params["fields"] = fields
 
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-
-        response = requests.get(url, headers=headers, params=urlencode(params))
+        # Playlist items are cached by snapshot_id (see get_playlist_contents),
+        # so the pages aren't kept in the ETag cache as well.
+        response = get_spotify_client().get(
+            f"/playlists/{playlist_id}/tracks", access_token, params=urlencode(params), cache=False,
+        )
         
         if response.status_code != 200:
             raise Exception(f"Failed to get playlist tracks: {response.status_code} - {response.text}")
@@ -109,7 +211,7 @@ def get_playlist_tracks(access_token, playlist_id):
         if not items:
             break
 
-        tracks.extend(items)
+        yield from items
         
         # Check if we've received all tracks
         if len(items) < limit:
@@ -117,7 +219,20 @@ def get_playlist_tracks(access_token, playlist_id):
             
         offset += limit
 
-    return tracks
+
+def get_playlist_tracks(access_token, playlist_id):
+    """
+    Get all tracks from a Spotify playlist
+    
+    Args:
+        access_token (str): Spotify access token to check
+        playlist_id: The Spotify ID of the playlist
+        
+    Returns:
+        List of track objects from the playlist
+    """
+    snapshot_id, items = get_playlist_contents(access_token, playlist_id)
+    return items
 
 
 def is_token_expired(access_token):
@@ -130,13 +245,8 @@ def is_token_expired(access_token):
     Returns:
         bool: True if token is expired or invalid, False if token is valid
     """
-    endpoint = "https://api.spotify.com/v1/me"
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
-    
     try:
-        response = requests.get(endpoint, headers=headers)
+        response = get_spotify_client().get("/me", access_token)
         
         # If we get a 401 status code, the token is expired or invalid
         if response.status_code == 401:
@@ -154,22 +264,263 @@ def is_token_expired(access_token):
         return True
 
 
-def get_user_access_token(user_id):
-    tokens = supabase.table("spotify_tokens").select("user_id, access_token, refresh_token").eq("user_id", user_id).execute()
-    access_token = tokens.data[0]["access_token"]
+# Refresh access tokens this many seconds before Spotify says they expire.
+TOKEN_EXPIRY_MARGIN = 60
 
-    if is_token_expired(access_token):
-        new_tokens = refresh_access_token(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, tokens.data[0]["refresh_token"])
-        supabase.table("spotify_tokens").update(
-            {
-                "access_token": new_tokens["access_token"]
-            }
-        ).eq("user_id", user_id).execute()
-        return new_tokens["access_token"]
+# In-process cache of access tokens: user_id -> {"access_token", "expires_at"}
+# where `expires_at` is a unix timestamp, or None when the row predates us
+# storing expiries (those are trusted until Spotify answers 401).
+_token_cache = {}
+_token_owners = {}  # access_token -> user_id, used by the 401 fallback
+_token_cache_lock = threading.Lock()
+
+# Spotify profile ids never change: user_id -> spotify_id
+_spotify_ids = {}
+
+
+def _parse_expires_at(value):
+    """Convert the `expires_at` column (ISO timestamp) to a unix timestamp."""
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def _is_token_fresh(expires_at):
+    return expires_at is None or expires_at - TOKEN_EXPIRY_MARGIN > time.time()
+
+
+def _cache_access_token(user_id, access_token, expires_at):
+    with _token_cache_lock:
+        previous = _token_cache.get(user_id)
+        if previous is not None:
+            _token_owners.pop(previous["access_token"], None)
+        _token_cache[user_id] = {
+            "access_token": access_token,
+            "expires_at": expires_at,
+        }
+        _token_owners[access_token] = user_id
+
+
+def clear_token_cache():
+    """Forget all cached access tokens (and Spotify profile ids)."""
+    with _token_cache_lock:
+        _token_cache.clear()
+        _token_owners.clear()
+        _spotify_ids.clear()
+
+
+# How long a worker may hold the refresh of a user's token before the others
+# stop waiting for it, and how often they check for the new token meanwhile.
+TOKEN_REFRESH_LEASE_SECONDS = int(os.getenv("TOKEN_REFRESH_LEASE_SECONDS", "15"))
+TOKEN_REFRESH_POLL_SECONDS = 0.25
+
+_token_refreshes = {}  # user_id -> Future of the refresh in progress
+
+
+def _refresh_user_token(user_id, row):
+    """
+    Refresh a user's access token, persist it and cache it.
+
+    Concurrent callers share one refresh: within this process they wait on
+    the first caller's refresh, and across workers only the worker holding
+    the refresh lease of the `spotify_tokens` row refreshes (see migrations/005).
+    """
+    with _token_cache_lock:
+        future = _token_refreshes.get(user_id)
+        is_owner = future is None
+        if is_owner:
+            future = _token_refreshes[user_id] = Future()
+
+    if is_owner:
+        try:
+            future.set_result(_refresh_user_token_once(user_id, row))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with _token_cache_lock:
+                _token_refreshes.pop(user_id, None)
+
+    return future.result()
+
+
+def _refresh_user_token_once(user_id, row):
+    old_token = row["access_token"]
+
+    # A refresh may have finished between reading the row and getting here.
+    cached = _token_cache.get(user_id)
+    if cached is not None and cached["access_token"] != old_token and _is_token_fresh(cached["expires_at"]):
+        return cached["access_token"]
+
+    # Another worker is refreshing (or has refreshed) this token: use theirs.
+    claimed = _claim_token_refresh(user_id, old_token)
+    if not claimed:
+        refreshed = _wait_for_token_refresh(user_id, old_token)
+        if refreshed is not None:
+            return _use_token_row(user_id, refreshed)
+        logger.info(f"Timed out waiting for the token refresh of {user_id}; refreshing it here")
+
+    saved = False
+    try:
+        new_tokens = refresh_access_token(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, row["refresh_token"])
+        access_token = new_tokens["access_token"]
+        expires_at = time.time() + new_tokens.get("expires_in", 3600)
+
+        update = {
+            "access_token": access_token,
+            "expires_at": datetime.fromtimestamp(expires_at, tz=timezone.utc).isoformat(),
+            "refresh_locked_until": None,
+        }
+        # Spotify may rotate the refresh token as well.
+        if new_tokens.get("refresh_token"):
+            update["refresh_token"] = new_tokens["refresh_token"]
+
+        # If we don't have the user's Spotify profile id yet, look it up with the
+        # new token and save it along with it.
+        spotify_id = row.get("spotify_id") or _spotify_ids.get(user_id)
+        if spotify_id is None:
+            try:
+                update["spotify_id"] = spotify_id = get_user_profile(access_token)["id"]
+            except Exception as e:
+                logger.info(f"Couldn't look up the Spotify profile of {user_id}: {str(e)}")
+        if spotify_id is not None:
+            _spotify_ids[user_id] = spotify_id
+
+        # Compare-and-set: only replace the token we refreshed.
+        get_supabase().table("spotify_tokens").update(update)\
+            .eq("user_id", user_id)\
+            .eq("access_token", old_token)\
+            .execute()
+        saved = True
+    finally:
+        # Let the other workers refresh it rather than wait out the lease.
+        if claimed and not saved:
+            _release_token_refresh(user_id, old_token)
+
+    index = _user_index.get()
+    if index is not None and user_id in index.tokens:
+        index.tokens[user_id].update(update)
+
+    _cache_access_token(user_id, access_token, expires_at)
+    return access_token
+
+
+def _claim_token_refresh(user_id, access_token):
+    """Take the refresh lease of `access_token`; False if another worker holds it or has replaced the token."""
+    result = get_supabase().rpc(
+        "claim_token_refresh",
+        {
+            "p_user_id": user_id,
+            "p_access_token": access_token,
+            "p_lease_seconds": TOKEN_REFRESH_LEASE_SECONDS,
+        },
+    ).execute()
+    return bool(result.data)
+
+
+def _release_token_refresh(user_id, access_token):
+    """Give up the refresh lease of `access_token` after a failed refresh."""
+    try:
+        get_supabase().table("spotify_tokens").update({"refresh_locked_until": None})\
+            .eq("user_id", user_id)\
+            .eq("access_token", access_token)\
+            .execute()
+    except Exception as e:
+        # The lease still runs out on its own.
+        logger.info(f"Couldn't release the token refresh lease of {user_id}: {str(e)}")
+
+
+def _wait_for_token_refresh(user_id, old_token):
+    """
+    Wait for another worker to replace `old_token`.
+
+    Returns:
+        dict: The user's new token row, or None if the lease ran out first
+    """
+    deadline = time.monotonic() + TOKEN_REFRESH_LEASE_SECONDS
+    while True:
+        tokens = get_supabase().table("spotify_tokens").select("user_id, access_token, refresh_token, expires_at").eq("user_id", user_id).execute()
+        row = tokens.data[0]
+        if row["access_token"] != old_token:
+            return row
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(TOKEN_REFRESH_POLL_SECONDS)
+
+
+def _use_token_row(user_id, row):
+    # Adopt a token written by another worker.
+    index = _user_index.get()
+    if index is not None and user_id in index.tokens:
+        index.tokens[user_id].update(row)
+
+    _cache_access_token(user_id, row["access_token"], _parse_expires_at(row.get("expires_at")))
+    return row["access_token"]
+
+
+def get_user_access_token(user_id, force_refresh=False):
+    """
+    Get a valid Spotify access token for a user.
+
+    Tokens are served from an in-process cache and refreshed shortly before
+    they expire, so no request to Spotify is needed to check validity.
+
+    Args:
+        user_id (str): The user ID (supabase uuid)
+        force_refresh (bool): Refresh even if the stored token looks valid
+
+    Returns:
+        str: Spotify access token
+    """
+    cached = _token_cache.get(user_id)
+    if cached is not None and not force_refresh and _is_token_fresh(cached["expires_at"]):
+        return cached["access_token"]
+
+    index = _user_index.get()
+    if index is not None and user_id in index.tokens:
+        row = index.tokens[user_id]
+    else:
+        tokens = get_supabase().table("spotify_tokens").select("user_id, access_token, refresh_token, expires_at, spotify_id").eq("user_id", user_id).execute()
+        row = tokens.data[0]
+
+    access_token = row["access_token"]
+    expires_at = _parse_expires_at(row.get("expires_at"))
+
+    if force_refresh or not _is_token_fresh(expires_at):
+        return _refresh_user_token(user_id, row)
     else:
+        _cache_access_token(user_id, access_token, expires_at)
         return access_token
 
 
+def refresh_unauthorized_token(access_token):
+    """
+    Called by the Spotify client when a request is rejected with 401.
+
+    Returns:
+        str: A refreshed token for the owner of `access_token`, or None if we
+        don't know which user it belongs to.
+    """
+    user_id = _token_owners.get(access_token)
+    if user_id is None:
+        return None
+
+    # Another caller may have refreshed it already.
+    cached = _token_cache.get(user_id)
+    if cached is not None and cached["access_token"] != access_token:
+        return cached["access_token"]
+
+    return get_user_access_token(user_id, force_refresh=True)
+
+
+def get_token_owner(access_token):
+    """The user id a cached access token belongs to, or None."""
+    return _token_owners.get(access_token)
+
+
+get_spotify_client().unauthorized_handler = refresh_unauthorized_token
+get_spotify_client().cache_scope_resolver = get_token_owner
+
+
 def create_spotify_playlist(
         user_id, access_token, playlist_name, description="",
         public=False, collaborative=True
@@ -189,15 +540,6 @@ def create_spotify_playlist(
     dict: Playlist information if successful, None if failed
     """
     
-    # Endpoint for creating a playlist
-    endpoint = f"https://api.spotify.com/v1/users/{user_id}/playlists"
-    
-    # Headers for authorization
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
     # Playlist data
     playlist_data = {
         "name": playlist_name,
@@ -208,9 +550,9 @@ def create_spotify_playlist(
     
     try:
         # Make the POST request to create the playlist
-        response = requests.post(
-            endpoint,
-            headers=headers,
+        response = get_spotify_client().post(
+            f"/users/{user_id}/playlists",
+            access_token,
             data=json.dumps(playlist_data)
         )
         
@@ -236,33 +578,16 @@ def clear_playlist(access_token, playlist_id):
     Returns:
         bool: True if successful
     """
-    endpoint = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
     try:
-        # First get all tracks to collect their URIs
-        response = requests.get(endpoint, headers=headers)
-        response.raise_for_status()
-        
-        tracks = response.json()['items']
+        # First get all tracks (every page) to collect their URIs
+        snapshot_id, items = get_playlist_contents(access_token, playlist_id)
+        track_uris = _item_uris(items)
         
-        if not tracks:
+        if not track_uris:
             return True  # Playlist is already empty
             
-        # Create list of track URIs to remove
-        tracks_to_remove = [{"uri": item['track']['uri']} for item in tracks]
-        
-        # Delete all tracks
-        data = {
-            "tracks": tracks_to_remove
-        }
-        
-        response = requests.delete(endpoint, headers=headers, json=data)
-        response.raise_for_status()
+        # Delete all tracks, 100 per request
+        remove_tracks_from_playlist(access_token, playlist_id, track_uris, snapshot_id)
         
         return True
         
@@ -283,15 +608,11 @@ def check_playlist_following(access_token, playlist_id):
     Returns:
         bool: True if user follows the playlist, False otherwise
     """
-    headers = {
-        'Authorization': f'Bearer {access_token}'
-    }
-    
     # Endpoint to check if users follow a playlist
-    url = f'https://api.spotify.com/v1/playlists/{playlist_id}/followers/contains'
+    url = f'/playlists/{playlist_id}/followers/contains'
 
     try:
-        response = requests.get(url, headers=headers)
+        response = get_spotify_client().get(url, access_token)
         response.raise_for_status()
 
         # API returns an array of booleans, one for each user ID provided
@@ -313,9 +634,12 @@ def get_custom_playlists(user_id):
     Returns:
         Supabase result if user exists, otherwise None.
     """
-    
+    index = _user_index.get()
+    if index is not None:
+        return index.playlists.get(user_id)
+
     # Check if user exists
-    result = supabase.table("spotify_playlists").select("*")\
+    result = get_supabase().table("spotify_playlists").select("*")\
         .eq("user_id", user_id)\
         .execute()
 
@@ -326,14 +650,116 @@ def get_custom_playlists(user_id):
         return None
 
 
+def get_users_by_individual_playlists(playlist_ids):
+    """
+    Find the users who own any of the given "My Top Tracks" playlists.
+
+    Args:
+        playlist_ids (list): Spotify playlist IDs
+
+    Returns:
+        list: Rows with the `user_id` and `individual_playlist` of each owner
+    """
+    index = _user_index.get()
+    if index is not None:
+        owners = index.individual_playlist_owners
+        return [
+            {"user_id": owners[playlist_id], "individual_playlist": playlist_id}
+            for playlist_id in dict.fromkeys(playlist_ids) if playlist_id in owners
+        ]
+
+    result = get_supabase().table('spotify_playlists')\
+        .select('user_id, individual_playlist')\
+        .in_('individual_playlist', playlist_ids)\
+        .execute()
+    return result.data
+
+
+def get_followed_user_ids(user_id):
+    """
+    Get the users that `user_id` follows according to `spotify_follows`.
+
+    Args:
+        user_id (str): The follower's user ID
+
+    Returns:
+        list: User IDs of everyone they follow
+    """
+    index = _user_index.get()
+    if index is not None:
+        return list(index.following.get(user_id, []))
+
+    result = get_supabase().table('spotify_follows')\
+        .select('following_id')\
+        .eq('follower_id', user_id)\
+        .execute()
+    return list(dict.fromkeys(row["following_id"] for row in result.data))
+
+
+def get_followed_user_ids_from_spotify(access_token, user_id=None):
+    """
+    Get the users someone follows by checking which "My Top Tracks"
+    playlists they follow on Spotify.
+
+    This pages through all of the user's playlists, so the cron prefers
+    `get_followed_user_ids`; this is the source of truth used to reconcile it.
+
+    Args:
+        access_token (str): The follower's Spotify access token
+        user_id (str): The follower's user id, to use their saved profile id (optional)
+
+    Returns:
+        list: User IDs of everyone they follow
+    """
+    if user_id is not None:
+        profile_id = get_spotify_user_id(user_id, access_token)
+    else:
+        profile_id = get_user_profile(access_token)["id"]
+    all_playlists = get_all_followed_playlists(profile_id, access_token)
+    all_playlist_ids = [playlist["id"] for playlist in all_playlists]
+
+    followed_users = get_users_by_individual_playlists(all_playlist_ids)
+    return list(dict.fromkeys(row["user_id"] for row in followed_users))
+
+
 def get_user_profile(access_token):
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
-    response = requests.get('https://api.spotify.com/v1/me', headers=headers)
+    response = get_spotify_client().get('/me', access_token)
     return response.json()
 
 
+def get_spotify_user_id(user_id, access_token=None):
+    """
+    Get the Spotify profile id of a user.
+
+    It comes from the prefetched `spotify_tokens` rows during a cron run, or
+    from the database otherwise; /v1/me is only called for users whose id
+    hasn't been saved yet, and the id is saved afterwards.
+
+    Returns:
+        str: The user's Spotify profile id
+    """
+    spotify_id = _spotify_ids.get(user_id)
+    if spotify_id is not None:
+        return spotify_id
+
+    index = _user_index.get()
+    if index is not None and user_id in index.tokens:
+        spotify_id = index.tokens[user_id].get("spotify_id")
+    else:
+        result = get_supabase().table("spotify_tokens").select("spotify_id").eq("user_id", user_id).execute()
+        spotify_id = result.data[0].get("spotify_id") if result.data else None
+
+    if spotify_id is None:
+        access_token = access_token or get_user_access_token(user_id)
+        spotify_id = get_user_profile(access_token)["id"]
+        get_supabase().table("spotify_tokens").update({"spotify_id": spotify_id}).eq("user_id", user_id).execute()
+        if index is not None and user_id in index.tokens:
+            index.tokens[user_id]["spotify_id"] = spotify_id
+
+    _spotify_ids[user_id] = spotify_id
+    return spotify_id
+
+
 def create_and_save_playlist(user_id, user_email, access_token, playlist_type="individual"):
     """
     This creates a new set of playlists that will save the users top tracks
@@ -343,7 +769,7 @@ def create_and_save_playlist(user_id, user_email, access_token, playlist_type="i
     """
     assert playlist_type in USER_PLAYLISTS.keys()
 
-    profile_id = get_user_profile(access_token)["id"]
+    profile_id = get_spotify_user_id(user_id, access_token)
     playlist_name = USER_PLAYLISTS[playlist_type]
     if playlist_type == "individual":
         collab_settings = dict(public=True, collaborative=False)
@@ -356,7 +782,7 @@ def create_and_save_playlist(user_id, user_email, access_token, playlist_type="i
         **collab_settings
     )
 
-    insert_result = supabase.table("spotify_playlists").upsert({
+    insert_result = get_supabase().table("spotify_playlists").upsert({
         "user_id": user_id,
         "email": user_email,
         "{}_playlist".format(playlist_type): response["id"],
@@ -365,14 +791,9 @@ def create_and_save_playlist(user_id, user_email, access_token, playlist_type="i
 
 def unfollow_playlist(access_token, playlist_id):
     """Unfollow (delete) a playlist"""
-    base_url = "https://api.spotify.com/v1"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    response = requests.delete(
-        f"{base_url}/playlists/{playlist_id}/followers",
-        headers=headers
+    response = get_spotify_client().delete(
+        f"/playlists/{playlist_id}/followers",
+        access_token
     )
     response.raise_for_status()
     return response.status_code == 200
@@ -380,14 +801,9 @@ def unfollow_playlist(access_token, playlist_id):
 
 def follow_playlist(access_token, playlist_id, public=True):
     """Follow a playlist"""
-    base_url = "https://api.spotify.com/v1"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    response = requests.put(
-        f"{base_url}/playlists/{playlist_id}/followers",
-        headers=headers,
+    response = get_spotify_client().put(
+        f"/playlists/{playlist_id}/followers",
+        access_token,
         json={
                 "public": public,
             }
@@ -401,19 +817,14 @@ def get_user_top_tracks(access_token, time_range="short_term", limit=3):
     
     time_range options: short_term (4 weeks), medium_term (6 months), long_term (years)
     """
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
     params = {
         "time_range": time_range,
         "limit": limit
     }
     
-    response = requests.get(
-        "https://api.spotify.com/v1/me/top/tracks",
-        headers=headers,
+    response = get_spotify_client().get(
+        "/me/top/tracks",
+        access_token,
         params=params
     )
 
@@ -428,6 +839,9 @@ def add_tracks_to_playlist(access_token, playlist_id, track_uris, position=None)
     """
     Add tracks to a collaborative Spotify playlist.
 
+    Lists longer than Spotify's limit of 100 tracks per request are sent in
+    consecutive chunks, so the tracks end up in the given order.
+
     Args:
         access_token (str): Valid Spotify access token with playlist-modify-public scope
         playlist_id (str): Spotify playlist ID
@@ -435,76 +849,135 @@ def add_tracks_to_playlist(access_token, playlist_id, track_uris, position=None)
         position (int): If 0, it will add the songs to the top
     
     Returns:
-        dict: Response from the Spotify API
+        dict: Response from the Spotify API for the last chunk
     """
-    endpoint = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    endpoint = f"/playlists/{playlist_id}/tracks"
+    spotify = get_spotify_client()
 
-    # Spotify API accepts a maximum of 100 tracks per request
-    if len(track_uris) > 100:
-        track_uris = track_uris[:100]
-    
-    data = {
-        "uris": track_uris
-    }
+    result = None
+    for start in range(0, len(track_uris), PLAYLIST_WRITE_LIMIT):
+        data = {
+            "uris": track_uris[start:start + PLAYLIST_WRITE_LIMIT]
+        }
 
-    if position:
-        data["position"] = position
+        # Each chunk goes right after the previous one.
+        if position is not None:
+            data["position"] = position + start
 
-    response = requests.post(endpoint, headers=headers, json=data)
-    response.raise_for_status()  # Raise an exception for error status codes
-    
-    return response.json()
+        response = spotify.post(endpoint, access_token, json=data)
+        response.raise_for_status()  # Raise an exception for error status codes
+        result = response.json()
+
+    # We don't have the full item objects of the new tracks.
+    invalidate_playlist_cache(playlist_id)
+    return result
 
 
-def get_recent_additions_by_user(access_token, playlist_id, days_ago=7, limit=3):
+def remove_tracks_from_playlist(access_token, playlist_id, track_uris, snapshot_id=None):
+    """
+    Remove every occurrence of the given tracks from a playlist.
+
+    With a `snapshot_id`, the 100-track chunks are sent one after another,
+    each guarded with the snapshot_id returned by the previous one, so the
+    result is the version later position-based edits must be guarded with.
+    Without one, the removals don't depend on each other and the chunks are
+    sent concurrently.
+
+    Args:
+        access_token (str): Valid Spotify access token
+        playlist_id (str): Spotify playlist ID
+        track_uris (list): List of Spotify track URIs to remove
+        snapshot_id (str): Playlist version the removals apply to (optional)
+
+    Returns:
+        str: The playlist's snapshot_id after the last removal, or None if
+            several chunks were sent concurrently (the order Spotify applied
+            them in, and so the final version, is unknown)
+    """
+    endpoint = f"/playlists/{playlist_id}/tracks"
+    spotify = get_spotify_client()
+
+    def remove(chunk, snapshot_id=None):
+        data = {"tracks": [{"uri": uri} for uri in chunk]}
+        if snapshot_id:
+            data["snapshot_id"] = snapshot_id
+        response = spotify.delete(endpoint, access_token, json=data)
+        response.raise_for_status()
+        return response.json()["snapshot_id"]
+
+    chunks = [
+        track_uris[start:start + PLAYLIST_WRITE_LIMIT]
+        for start in range(0, len(track_uris), PLAYLIST_WRITE_LIMIT)
+    ]
+    if not chunks:
+        return snapshot_id
+
+    if snapshot_id or len(chunks) == 1:
+        new_snapshot_id = snapshot_id
+        for chunk in chunks:
+            new_snapshot_id = remove(chunk, new_snapshot_id)
+    else:
+        # Each chunk runs in a copy of this context, so its requests are
+        # counted for the stage that removes the tracks (see tracing).
+        with ThreadPoolExecutor(max_workers=min(PLAYLIST_WRITE_WORKERS, len(chunks))) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, remove, chunk) for chunk in chunks]
+            for future in futures:
+                future.result()
+        new_snapshot_id = None
+
+    _remove_from_cached_playlist(playlist_id, track_uris, snapshot_id, new_snapshot_id)
+    return new_snapshot_id
+
+
+def get_recent_additions_by_user(access_token, playlist_id, days_ago=7, limit=3, spotify_id=None):
     """
     Get tracks added by a specific user to a playlist within the specified time period.
+
+    Tracks added from the Spotify apps are appended to the playlist, so it is
+    read from the end, one page at a time, and reading stops once `limit`
+    tracks are found or a page holds nothing added within `days_ago`.
     
     Args:
         access_token (str): Valid Spotify access token
         playlist_id (str): Spotify playlist ID
         days_ago (int): Number of days to look back (default 7)
         limit (int): Maximum number of tracks to return (default 3)
+        spotify_id (str): Spotify profile id of the user (looked up if not given)
     
     Returns:
         list: List of dictionaries containing track info and added_at timestamp
     """
-    endpoint = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
-    
     # Calculate the cutoff date
     cutoff_date = datetime.now() - timedelta(days=days_ago)
-    
-    # Get the playlist tracks with their add dates
-    response = requests.get(endpoint, headers=headers)
-    response.raise_for_status()
-    
-    items = response.json()['items']
-    spotify_id = get_user_profile(access_token)["id"]
+
+    if spotify_id is None:
+        spotify_id = get_user_profile(access_token)["id"]
     
     # Filter tracks by user and date
     recent_additions = []
     
-    for item in items:
-        # Check if the track was added by the specified user
-        if item['added_by']['id'] == spotify_id:
+    for page in iter_playlist_pages_reversed(access_token, playlist_id):
+        page_is_recent = False
+        for item in reversed(page):
+            if not item.get('track') or not item.get('added_at'):
+                continue
+
             added_at = datetime.strptime(item['added_at'], "%Y-%m-%dT%H:%M:%SZ")
-    
-            if added_at > cutoff_date:
+            if added_at <= cutoff_date:
+                continue
+            page_is_recent = True
+
+            # Check if the track was added by the specified user
+            if (item.get('added_by') or {}).get('id') == spotify_id:
                 recent_additions.append({
                     'track_name': item['track']['name'],
                     'artist': item['track']['artists'][0]['name'],
                     'added_at': item['added_at'],
                     'uri': item['track']['uri']
                 })
+
+        if len(recent_additions) >= limit or not page_is_recent:
+            break
     
     # Sort by added_at in descending order (most recent first)
     recent_additions.sort(key=lambda x: x['added_at'], reverse=True)
@@ -513,32 +986,462 @@ def get_recent_additions_by_user(access_token, playlist_id, days_ago=7, limit=3)
     return recent_additions[:limit]
 
 
+def iter_playlist_pages_reversed(access_token, playlist_id):
+    """
+    Read a playlist's items a page at a time, starting with the last page.
+
+    The items are served from the playlist cache if it holds the current
+    snapshot of the playlist.
+
+    Yields:
+        list: Track objects of one page, in playlist order
+    """
+    response = get_spotify_client().get(
+        f"/playlists/{playlist_id}", access_token,
+        params={"fields": "snapshot_id,tracks.total"},
+    )
+    response.raise_for_status()
+    playlist = response.json()
+
+    items = _get_cached_playlist_items(playlist_id, playlist["snapshot_id"])
+    if items is not None:
+        for end in range(len(items), 0, -PLAYLIST_PAGE_SIZE):
+            yield items[max(end - PLAYLIST_PAGE_SIZE, 0):end]
+        return
+
+    total = playlist["tracks"]["total"]
+    for end in range(total, 0, -PLAYLIST_PAGE_SIZE):
+        offset = max(end - PLAYLIST_PAGE_SIZE, 0)
+        response = get_spotify_client().get(
+            f"/playlists/{playlist_id}/tracks", access_token,
+            params={"offset": offset, "limit": end - offset}, cache=False,
+        )
+        response.raise_for_status()
+        yield response.json()["items"]
+
+
 def get_playlist_track_uris(access_token, playlist_id):
     """
-    Add tracks to a collaborative Spotify playlist.
+    Get the URIs of every track in a playlist, reading all pages.
 
     Args:
         access_token (str): Valid Spotify access token with playlist-modify-public scope
         playlist_id (str): Spotify playlist ID
     
     Returns:
-        dict: Response from the Spotify API
+        list: Track URIs in playlist order
     """
-    endpoint = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-    
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    snapshot_id, items = get_playlist_contents(access_token, playlist_id)
+    return _item_uris(items)
+
 
-    response = requests.get(endpoint, headers=headers)
+def get_playlist_snapshot_and_uris(access_token, playlist_id):
+    """
+    Get a playlist's snapshot_id and the URIs of every track in it, i.e. the
+    contents `plan_playlist_update` plans against.
+
+    Returns:
+        tuple: (snapshot_id, track URIs in playlist order)
+    """
+    snapshot_id, items = get_playlist_contents(access_token, playlist_id)
+    return snapshot_id, _item_uris(items)
+
+
+def _item_uris(items):
+    # Extract URIs of existing tracks (unavailable tracks have no track object)
+    return [item['track']['uri'] for item in items if item.get('track')]
+
+
+def get_playlist_snapshot(access_token, playlist_id):
+    """
+    Get the current `snapshot_id` (version) of a playlist.
+
+    Args:
+        access_token (str): Valid Spotify access token
+        playlist_id (str): Spotify playlist ID
+
+    Returns:
+        str: The playlist's snapshot_id
+    """
+    response = get_spotify_client().get(
+        f"/playlists/{playlist_id}", access_token, params={"fields": "snapshot_id"}
+    )
     response.raise_for_status()
-    
-    # Extract URIs of existing tracks
-    return list(item['track']['uri'] for item in response.json()['items'])
+    return response.json()["snapshot_id"]
+
+
+# Playlist items we have read, keyed by playlist_id and only served while the
+# playlist's snapshot_id is unchanged. Our own writes update or drop entries.
+# This is the only cache of playlist items: their pages are fetched past the
+# ETag cache. Bounded by number of playlists and by total number of items;
+# a playlist with more items than that isn't cached.
+PLAYLIST_CACHE_SIZE = int(os.getenv("PLAYLIST_CACHE_SIZE", "512"))
+PLAYLIST_CACHE_MAX_ITEMS = int(os.getenv("PLAYLIST_CACHE_MAX_ITEMS", "20000"))
+
+_playlist_cache = OrderedDict()  # playlist_id -> {"snapshot_id", "items"}
+_playlist_cache_items = 0  # Total items held by _playlist_cache
+_playlist_cache_lock = threading.Lock()
+
+
+def get_playlist_contents(access_token, playlist_id):
+    """
+    Get a playlist's snapshot_id and all of its items.
+
+    Only the snapshot_id is fetched if the playlist hasn't changed since we
+    last read it; the tracks are paged through only when it has.
+
+    Args:
+        access_token (str): Valid Spotify access token
+        playlist_id (str): Spotify playlist ID
+
+    Returns:
+        tuple: (snapshot_id, list of track objects in playlist order)
+    """
+    snapshot_id = get_playlist_snapshot(access_token, playlist_id)
+    items = _get_cached_playlist_items(playlist_id, snapshot_id)
+    if items is not None:
+        return snapshot_id, items
+
+    items = list(iter_playlist_tracks(access_token, playlist_id))
+    _cache_playlist_items(playlist_id, snapshot_id, items)
+    return snapshot_id, list(items)
+
+
+def _cache_playlist_items(playlist_id, snapshot_id, items):
+    global _playlist_cache_items
+    with _playlist_cache_lock:
+        _pop_cached_playlist(playlist_id)
+        if len(items) > PLAYLIST_CACHE_MAX_ITEMS:
+            return
+        _playlist_cache[playlist_id] = {"snapshot_id": snapshot_id, "items": items}
+        _playlist_cache_items += len(items)
+        while len(_playlist_cache) > PLAYLIST_CACHE_SIZE or _playlist_cache_items > PLAYLIST_CACHE_MAX_ITEMS:
+            _pop_cached_playlist(next(iter(_playlist_cache)))
+
+
+def _pop_cached_playlist(playlist_id):
+    # Drop one entry (the caller holds _playlist_cache_lock).
+    global _playlist_cache_items
+    entry = _playlist_cache.pop(playlist_id, None)
+    if entry is not None:
+        _playlist_cache_items -= len(entry["items"])
+
+
+def _get_cached_playlist_items(playlist_id, snapshot_id):
+    # The cached items of the playlist if they are still current, or None.
+    with _playlist_cache_lock:
+        entry = _playlist_cache.get(playlist_id)
+        if entry is None or entry["snapshot_id"] != snapshot_id:
+            return None
+        _playlist_cache.move_to_end(playlist_id)
+        return list(entry["items"])
+
+
+def invalidate_playlist_cache(playlist_id=None):
+    """Forget the cached items of one playlist, or of every playlist."""
+    global _playlist_cache_items
+    with _playlist_cache_lock:
+        if playlist_id is None:
+            _playlist_cache.clear()
+            _playlist_cache_items = 0
+        else:
+            _pop_cached_playlist(playlist_id)
+
+
+def _remove_from_cached_playlist(playlist_id, track_uris, snapshot_id, new_snapshot_id):
+    # Apply our own removal to the cached items, if they are the version the
+    # removal was made against.
+    global _playlist_cache_items
+    with _playlist_cache_lock:
+        entry = _playlist_cache.get(playlist_id)
+        if entry is None:
+            return
+        if snapshot_id is None or entry["snapshot_id"] != snapshot_id:
+            _pop_cached_playlist(playlist_id)
+            return
+
+        removed = set(track_uris)
+        items = [
+            item for item in entry["items"]
+            if not (item.get("track") and item["track"]["uri"] in removed)
+        ]
+        _playlist_cache_items -= len(entry["items"]) - len(items)
+        entry["items"] = items
+        entry["snapshot_id"] = new_snapshot_id
+
+
+def plan_playlist_sync(current_uris, desired_uris):
+    """
+    Compute the playlist edits that turn `current_uris` into `desired_uris`.
+
+    Tracks that stay are never re-added: they are left in place or moved
+    with a reorder. Duplicate URIs in the desired list are dropped.
+
+    Args:
+        current_uris (list): Track URIs currently in the playlist, in order
+        desired_uris (list): Track URIs the playlist should contain, in order
+
+    Returns:
+        list: Operations to apply in order, each one of
+            ("remove", uris)
+            ("insert", position, uris)
+            ("move", range_start, range_length, insert_before)
+    """
+    desired = list(dict.fromkeys(desired_uris))
+    desired_set = set(desired)
+
+    # Removing a URI removes every occurrence, so duplicated tracks are
+    # removed and then inserted back once.
+    counts = Counter(current_uris)
+    to_remove = [uri for uri in counts if uri not in desired_set or counts[uri] > 1]
+
+    operations = []
+    if to_remove:
+        operations.append(("remove", to_remove))
+
+    removed = set(to_remove)
+    current = [uri for uri in current_uris if uri not in removed]
+    current_set = set(current)
+
+    i = 0
+    while i < len(desired):
+        if i < len(current) and current[i] == desired[i]:
+            i += 1
+            continue
+
+        uri = desired[i]
+        if uri in current_set:
+            # Move the longest block that is already in the desired order.
+            start = current.index(uri, i)
+            length = 1
+            while (
+                i + length < len(desired)
+                and start + length < len(current)
+                and current[start + length] == desired[i + length]
+            ):
+                length += 1
+            operations.append(("move", start, length, i))
+            block = current[start:start + length]
+            del current[start:start + length]
+            current[i:i] = block
+            i += length
+        else:
+            # Insert the run of consecutive new tracks in one request.
+            run = []
+            while i + len(run) < len(desired) and desired[i + len(run)] not in current_set:
+                run.append(desired[i + len(run)])
+            operations.append(("insert", i, run))
+            current[i:i] = run
+            current_set.update(run)
+            i += len(run)
+
+    return operations
+
+
+def plan_playlist_update(access_token, playlist_id, desired_uris, insert_access_tokens=None, contents=None):
+    """
+    Plan the writes that make a playlist contain exactly `desired_uris`, in
+    order, without sending any of them.
+
+    Reads the playlist unless the caller passes what it has just read. The
+    writes are the requests `apply_playlist_plan` will send: each run of
+    inserted tracks is packed into as few requests as the per-request limit
+    and the token adding each track allow, and a playlist that already
+    matches gets no writes at all.
+
+    Args:
+        access_token (str): Spotify access token of a user who can edit the playlist
+        playlist_id (str): Spotify playlist ID
+        desired_uris (list): Track URIs the playlist should contain, in order
+        insert_access_tokens (dict): Optional URI -> access token used to add
+            that track, so tracks in a collaborative playlist are attributed
+            to the friend they came from
+        contents (tuple): The playlist's (snapshot_id, current track URIs),
+            if the caller has just read them
+
+    Returns:
+        dict: The playlist, the snapshot_id planned against, the writes
+            (("remove", uris), ("insert", position, uris, access_token) or
+            ("move", range_start, range_length, insert_before)), the number
+            of tracks removed, inserted and moved, and the number of requests
+    """
+    insert_access_tokens = insert_access_tokens or {}
+    snapshot_id, current_uris = contents or get_playlist_snapshot_and_uris(access_token, playlist_id)
+
+    plan = {
+        "playlist_id": playlist_id,
+        "access_token": access_token,
+        "snapshot_id": snapshot_id,
+        "writes": [],
+        "removed": 0,
+        "inserted": 0,
+        "moved": 0,
+        "requests": 0,
+    }
+    for operation in plan_playlist_sync(current_uris, desired_uris):
+        kind = operation[0]
+
+        if kind == "remove":
+            uris = operation[1]
+            plan["writes"].append(("remove", uris))
+            plan["requests"] += -(-len(uris) // PLAYLIST_WRITE_LIMIT)
+            plan["removed"] += len(uris)
+
+        elif kind == "insert":
+            position, uris = operation[1], operation[2]
+
+            # Split the run by whose token adds the tracks and by the
+            # per-request limit, keeping positions contiguous.
+            offset = 0
+            while offset < len(uris):
+                token = insert_access_tokens.get(uris[offset], access_token)
+                chunk = [uris[offset]]
+                while (
+                    offset + len(chunk) < len(uris)
+                    and len(chunk) < PLAYLIST_WRITE_LIMIT
+                    and insert_access_tokens.get(uris[offset + len(chunk)], access_token) == token
+                ):
+                    chunk.append(uris[offset + len(chunk)])
+                plan["writes"].append(("insert", position + offset, chunk, token))
+                plan["requests"] += 1
+                offset += len(chunk)
+            plan["inserted"] += len(uris)
+
+        elif kind == "move":
+            plan["writes"].append(operation)
+            plan["requests"] += 1
+            plan["moved"] += operation[2]
+
+    return plan
+
+
+def apply_playlist_plan(plan):
+    """
+    Send the writes of a `plan_playlist_update` plan.
+
+    Removals and moves are guarded with the snapshot_id returned by the
+    previous write, so they fail rather than apply to a playlist edited
+    since we read it. Inserts can't be guarded (Spotify's add endpoint takes
+    no snapshot_id): an edit made by someone else between our writes can
+    still shift the positions they insert at. The snapshot_id they return is
+    used to guard the writes after them.
+
+    Args:
+        plan (dict): Plan returned by `plan_playlist_update`
+
+    Returns:
+        dict: Number of tracks removed, inserted and moved, and requests made
+    """
+    playlist_id, access_token = plan["playlist_id"], plan["access_token"]
+    snapshot_id = plan["snapshot_id"]
+    endpoint = f"/playlists/{playlist_id}/tracks"
+    spotify = get_spotify_client()
+
+    for write in plan["writes"]:
+        kind = write[0]
+
+        if kind == "remove":
+            snapshot_id = remove_tracks_from_playlist(access_token, playlist_id, write[1], snapshot_id)
+
+        elif kind == "insert":
+            position, uris, token = write[1:]
+            response = spotify.post(endpoint, token, json={"uris": uris, "position": position})
+            response.raise_for_status()
+            snapshot_id = response.json()["snapshot_id"]
+
+        elif kind == "move":
+            range_start, range_length, insert_before = write[1:]
+            response = spotify.put(endpoint, access_token, json={
+                "range_start": range_start,
+                "range_length": range_length,
+                "insert_before": insert_before,
+                "snapshot_id": snapshot_id,
+            })
+            response.raise_for_status()
+            snapshot_id = response.json()["snapshot_id"]
+
+    # Removals keep the cached items current; inserts and moves don't.
+    if plan["inserted"] or plan["moved"]:
+        invalidate_playlist_cache(playlist_id)
+    return {key: plan[key] for key in ("removed", "inserted", "moved", "requests")}
+
+
+def sync_playlist(access_token, playlist_id, desired_uris, insert_access_tokens=None, current_uris=None):
+    """
+    Make a playlist contain exactly `desired_uris`, in order, by applying
+    only the difference against its current contents (see
+    `plan_playlist_update` and `apply_playlist_plan`).
+
+    Args:
+        access_token (str): Spotify access token of a user who can edit the playlist
+        playlist_id (str): Spotify playlist ID
+        desired_uris (list): Track URIs the playlist should contain, in order
+        insert_access_tokens (dict): Optional URI -> access token used to add
+            that track, so tracks in a collaborative playlist are attributed
+            to the friend they came from
+        current_uris (list): The playlist's current track URIs, if the caller
+            has just read them (saves reading the playlist again)
+
+    Returns:
+        dict: Number of tracks removed, inserted and moved, and requests made
+    """
+    contents = None
+    if current_uris is not None:
+        contents = (get_playlist_snapshot(access_token, playlist_id), current_uris)
+    plan = plan_playlist_update(access_token, playlist_id, desired_uris, insert_access_tokens, contents)
+    return apply_playlist_plan(plan)
+
+
+# Run-scoped memo of `get_top_tracks_and_recs` results keyed by user_id. It is
+# only active inside `top_tracks_memo()` and copies of its context (like the
+# prefetched index), so results never leak between runs or into requests
+# handled while a run is in progress.
+_top_tracks_memo = contextvars.ContextVar("top_tracks_memo", default=None)
+_top_tracks_memo_lock = threading.Lock()
+
+
+@contextmanager
+def top_tracks_memo():
+    """
+    Compute each user's top tracks and recs at most once within this block.
+
+    Used by the weekly cron so a user with many followers is only fetched
+    once per run instead of once per follower.
+    """
+    token = _top_tracks_memo.set({})
+    try:
+        yield
+    finally:
+        _top_tracks_memo.reset(token)
 
 
 def get_top_tracks_and_recs(user_id, access_token):
+    memo = _top_tracks_memo.get()
+    if memo is None:
+        return _get_top_tracks_and_recs(user_id, access_token)
+
+    # The first caller for a user computes the result; concurrent callers
+    # for the same user wait on it instead of repeating the Spotify calls.
+    with _top_tracks_memo_lock:
+        future = memo.get(user_id)
+        is_owner = future is None
+        if is_owner:
+            future = memo[user_id] = Future()
+
+    if is_owner:
+        try:
+            future.set_result(_get_top_tracks_and_recs(user_id, access_token))
+        except Exception as e:
+            # Don't keep the failure for the rest of the run: callers already
+            # waiting get the error, later callers compute it again.
+            with _top_tracks_memo_lock:
+                memo.pop(user_id, None)
+            future.set_exception(e)
+
+    return list(future.result())
+
+
+def _get_top_tracks_and_recs(user_id, access_token):
 
     # Get user's recent tops tracks.
     user_top_tracks = get_user_top_tracks(access_token)
@@ -555,7 +1458,10 @@ def get_top_tracks_and_recs(user_id, access_token):
     assert user_playlists is not None, (
         f"The user has not been added yet: {user_id}")
 
-    user_recs = get_recent_additions_by_user(access_token, user_playlists["individual_playlist"], days_ago=7)
+    user_recs = get_recent_additions_by_user(
+        access_token, user_playlists["individual_playlist"], days_ago=7,
+        spotify_id=get_spotify_user_id(user_id, access_token),
+    )
     user_recs_uris = [track["uri"] for track in user_recs]
 
     # Merge top tracks and recs.
@@ -630,12 +1536,9 @@ def get_all_followed_playlists(user_id: str, access_token: str):
         ValueError: If the response is invalid or authorization fails
     """
 
-    base_url = f"https://api.spotify.com/v1/users/{user_id}/playlists"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
+    endpoint = f"/users/{user_id}/playlists"
+    spotify = get_spotify_client()
+
     playlists = []
     limit = 50  # Maximum number of playlists per request
     offset = 0
@@ -647,7 +1550,7 @@ def get_all_followed_playlists(user_id: str, access_token: str):
             "offset": offset
         }
 
-        response = requests.get(base_url, headers=headers, params=params)
+        response = spotify.get(endpoint, access_token, params=params)
         
         if response.status_code == 401:
             raise ValueError("Invalid or expired access token")
@@ -679,28 +1582,27 @@ def get_all_followed_playlists(user_id: str, access_token: str):
 
 class SpotifyAPI:
     """Helper class for Spotify API calls"""
-    BASE_URL = "https://api.spotify.com/v1"
+    BASE_URL = SPOTIFY_API_URL
 
-    def __init__(self, access_token):
-        self.headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
+    def __init__(self, access_token, client=None):
+        self.access_token = access_token
+        self.client = client or get_spotify_client()
+        self.headers = SpotifyClient.build_headers(access_token)
     
     def get_current_user_playlists(self):
         """Get all playlists for the current user"""
-        response = requests.get(
-            f"{self.BASE_URL}/me/playlists",
-            headers=self.headers
+        response = self.client.get(
+            "/me/playlists",
+            self.access_token
         )
         response.raise_for_status()
         return response.json()
     
     def create_playlist(self, user_id, name, public=True, description=""):
         """Create a new playlist"""
-        response = requests.post(
-            f"{self.BASE_URL}/users/{user_id}/playlists",
-            headers=self.headers,
+        response = self.client.post(
+            f"/users/{user_id}/playlists",
+            self.access_token,
             json={
                 "name": name,
                 "public": public,
@@ -712,18 +1614,18 @@ class SpotifyAPI:
     
     def unfollow_playlist(self, playlist_id):
         """Unfollow (delete) a playlist"""
-        response = requests.delete(
-            f"{self.BASE_URL}/playlists/{playlist_id}/followers",
-            headers=self.headers
+        response = self.client.delete(
+            f"/playlists/{playlist_id}/followers",
+            self.access_token
         )
         response.raise_for_status()
         return response.status_code == 200
 
     def get_current_user(self):
         """Get current user's profile"""
-        response = requests.get(
-            f"{self.BASE_URL}/me",
-            headers=self.headers
+        response = self.client.get(
+            "/me",
+            self.access_token
         )
         response.raise_for_status()
         return response.json()
@@ -743,29 +1645,36 @@ def delete_user_and_data(user_id):
         logger.info(f"Starting deletion process for user: {user_id}")
 
         # Step 1a: Delete associated records from spotify_playlists table
-        playlists_result = supabase.table('spotify_playlists').delete().eq('user_id', user_id).execute()
+        playlists_result = get_supabase().table('spotify_playlists').delete().eq('user_id', user_id).execute()
         if hasattr(playlists_result, 'error') and playlists_result.error:
             raise Exception(f"Error deleting spotify_playlists: {playlists_result.error}")
         logger.info(f"Deleted associated playlist records for user: {user_id}")
 
         # Step 1b: Delete associated records from follow-relationship table.
-        follower_result = supabase.table('spotify_follows').delete().eq('follower_id', user_id).execute()
+        follower_result = get_supabase().table('spotify_follows').delete().eq('follower_id', user_id).execute()
         if hasattr(follower_result, 'error') and follower_result.error:
             raise Exception(f"Error deleting from spotify_follows: {playlists_result.error}")
 
-        following_result = supabase.table('spotify_follows').delete().eq('following_id', user_id).execute()
+        following_result = get_supabase().table('spotify_follows').delete().eq('following_id', user_id).execute()
         if hasattr(following_result, 'error') and following_result.error:
             raise Exception(f"Error deleting from spotify_follows: {playlists_result.error}")
         logger.info(f"Deleted associated follower records for user: {user_id}")
 
+        # Step 1c: Delete the user's jobs (e.g. their onboarding), so a new
+        # account with the same id is onboarded again.
+        jobs_result = get_supabase().table('playlist_update_jobs').delete().eq('user_id', user_id).execute()
+        if hasattr(jobs_result, 'error') and jobs_result.error:
+            raise Exception(f"Error deleting playlist_update_jobs: {jobs_result.error}")
+        logger.info(f"Deleted associated job records for user: {user_id}")
+
         # Step 2: Delete associated records from spotify_tokens table
-        tokens_result = supabase.table('spotify_tokens').delete().eq('user_id', user_id).execute()
+        tokens_result = get_supabase().table('spotify_tokens').delete().eq('user_id', user_id).execute()
         if hasattr(tokens_result, 'error') and tokens_result.error:
             raise Exception(f"Error deleting spotify_tokens: {tokens_result.error}")
         logger.info(f"Deleted associated token records for user: {user_id}")
 
         # Step 3: Delete the user from Auth
-        user_result = supabase.auth.admin.delete_user(user_id)
+        user_result = get_supabase().auth.admin.delete_user(user_id)
         if hasattr(user_result, 'error') and user_result.error:
             raise Exception(f"Error deleting user: {user_result.error}")
             